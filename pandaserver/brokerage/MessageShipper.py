@@ -0,0 +1,180 @@
+"""
+background shipper of brokerage messages to the HTTP logger
+
+Messages are put in a bounded queue and sent by a daemon thread in batches,
+one HTTP logger handler per message type and level in each batch, so that
+brokerage doesn't wait for the logger. Messages are dropped and counted when
+the queue is full. Queued messages are flushed at exit
+
+"""
+
+import sys
+import time
+import Queue
+import atexit
+import threading
+
+from config import panda_config
+from pandalogger.PandaLogger import PandaLogger
+
+# logger
+_logger = PandaLogger().getLogger('MessageShipper')
+
+
+class MessageShipper:
+
+    # constructor
+    def __init__(self):
+        # max number of queued messages
+        self.maxQueued = 10000
+        if hasattr(panda_config,'brokerMsgQueueSize'):
+            self.maxQueued = panda_config.brokerMsgQueueSize
+        # max number of messages per batch
+        self.batchSize = 20
+        if hasattr(panda_config,'brokerMsgBatchSize'):
+            self.batchSize = panda_config.brokerMsgBatchSize
+        # interval between batches in sec not to flood the logger
+        self.interval = 1
+        if hasattr(panda_config,'brokerMsgInterval'):
+            self.interval = panda_config.brokerMsgInterval
+        self.queue = Queue.Queue(self.maxQueued)
+        self.thread = None
+        # skip intervals while flushing
+        self.flushing = False
+        self.lock = threading.Lock()
+        self.stats = {'nQueued':0,'nSent':0,'nDropped':0,'nFailed':0,'nBatches':0}
+
+
+    # check if enabled
+    def isEnabled(self):
+        return hasattr(panda_config,'useAsyncBrokerMsg') and panda_config.useAsyncBrokerMsg == True
+
+
+    # update stats
+    def _addStats(self,name,value=1):
+        self.lock.acquire()
+        self.stats[name] += value
+        self.lock.release()
+
+
+    # get stats
+    def getStats(self):
+        self.lock.acquire()
+        retMap = dict(self.stats)
+        self.lock.release()
+        retMap['nInQueue'] = self.queue.qsize()
+        return retMap
+
+
+    # start thread
+    def _startThread(self):
+        self.lock.acquire()
+        try:
+            if self.thread == None:
+                self.thread = threading.Thread(target=self.run,name='MessageShipper')
+                self.thread.setDaemon(True)
+                self.thread.start()
+                atexit.register(self.flush)
+        finally:
+            self.lock.release()
+
+
+    # put messages. False if some of them were dropped
+    def put(self,msgType,level,messages):
+        self._startThread()
+        isOK = True
+        for message in messages:
+            try:
+                self.queue.put_nowait((msgType,level,message))
+                self._addStats('nQueued')
+            except Queue.Full:
+                self._addStats('nDropped')
+                isOK = False
+        if not isOK:
+            _logger.warning('queue is full. stats={0}'.format(str(self.getStats())))
+        return isOK
+
+
+    # send messages of a batch
+    def _send(self,batch):
+        # group by type and level keeping the order
+        groupList = []
+        groupMap = {}
+        for msgType,level,message in batch:
+            key = (msgType,level)
+            if not groupMap.has_key(key):
+                groupMap[key] = []
+                groupList.append(key)
+            groupMap[key].append(message)
+        for msgType,level in groupList:
+            messages = groupMap[(msgType,level)]
+            try:
+                # get logger
+                _pandaLogger = PandaLogger()
+                _pandaLogger.lock()
+                try:
+                    _pandaLogger.setParams({'Type':msgType})
+                    logger = _pandaLogger.getHttpLogger(panda_config.loggername)
+                    # add messages
+                    for message in messages:
+                        getattr(logger,level)(message)
+                finally:
+                    # release HTTP handler
+                    _pandaLogger.release()
+                self._addStats('nSent',len(messages))
+            except:
+                errType,errValue = sys.exc_info()[:2]
+                _logger.error('failed to send {0} messages with {1}:{2}'.format(len(messages),errType,errValue))
+                self._addStats('nFailed',len(messages))
+
+
+    # get a batch. block until the first message
+    def _getBatch(self):
+        batch = [self.queue.get()]
+        while len(batch) < self.batchSize:
+            try:
+                batch.append(self.queue.get_nowait())
+            except Queue.Empty:
+                break
+        return batch
+
+
+    # thread loop
+    def run(self):
+        while True:
+            batch = self._getBatch()
+            try:
+                self._send(batch)
+                self._addStats('nBatches')
+            finally:
+                for i in range(len(batch)):
+                    self.queue.task_done()
+            if not self.flushing:
+                time.sleep(self.interval)
+
+
+    # wait until queued messages are sent
+    def flush(self,timeout=30):
+        if self.thread == None:
+            return True
+        self.flushing = True
+        try:
+            deadline = time.time() + timeout
+            while time.time() < deadline:
+                # unfinished_tasks is decremented by task_done after messages are sent
+                self.queue.all_tasks_done.acquire()
+                nUnfinished = self.queue.unfinished_tasks
+                self.queue.all_tasks_done.release()
+                if nUnfinished == 0:
+                    _logger.debug('flushed. stats={0}'.format(str(self.getStats())))
+                    return True
+                time.sleep(0.1)
+            _logger.warning('flush timed out. stats={0}'.format(str(self.getStats())))
+            return False
+        finally:
+            self.flushing = False
+
+
+
+# Singleton
+messageShipper = MessageShipper()
@@ -0,0 +1,106 @@
+"""
+process-wide cache of file replica lookups
+
+Results of catalog lookups are kept per (catalog, storage, LFN, GUID) with a
+lifetime. Files which were not found are cached as well with a shorter
+lifetime. The least recently used entries are dropped when the number of
+entries exceeds the limit
+
+"""
+
+import time
+import threading
+
+from config import panda_config
+from collections import OrderedDict
+
+
+class ReplicaCache:
+
+    # constructor
+    def __init__(self):
+        # lifetime in sec for found files
+        self.lifetime = 600
+        if hasattr(panda_config,'replicaCacheLifetime'):
+            self.lifetime = panda_config.replicaCacheLifetime
+        # lifetime in sec for missing files
+        self.negativeLifetime = 120
+        if hasattr(panda_config,'replicaCacheNegativeLifetime'):
+            self.negativeLifetime = panda_config.replicaCacheNegativeLifetime
+        # max number of entries
+        self.maxEntries = 1000000
+        if hasattr(panda_config,'replicaCacheMaxEntries'):
+            self.maxEntries = panda_config.replicaCacheMaxEntries
+        # (catalog,storage,lfn,guid) -> (list of PFNs or None for missing,timestamp). the last one is the most recent
+        self.entries = OrderedDict()
+        self.counters = {'hits':0,'negativeHits':0,'misses':0}
+        self.lock = threading.Lock()
+
+
+    # check if enabled
+    def isEnabled(self):
+        return hasattr(panda_config,'useReplicaCache') and panda_config.useReplicaCache == True
+
+
+    # look up files. return a map of (lfn,guid) -> list of PFNs or None for missing, and a list of uncached (lfn,guid)
+    def getBulk(self,catalog,storage,files):
+        cachedMap = {}
+        missFiles = []
+        timeNow = time.time()
+        self.lock.acquire()
+        try:
+            for lfn,guid in files:
+                key = (catalog,storage,lfn,guid)
+                if self.entries.has_key(key):
+                    pfns,timeStamp = self.entries.pop(key)
+                    if pfns == None:
+                        lifetime = self.negativeLifetime
+                    else:
+                        lifetime = self.lifetime
+                    if timeNow - timeStamp <= lifetime:
+                        # move to the end as the most recent
+                        self.entries[key] = (pfns,timeStamp)
+                        cachedMap[(lfn,guid)] = pfns
+                        if pfns == None:
+                            self.counters['negativeHits'] += 1
+                        else:
+                            self.counters['hits'] += 1
+                        continue
+                self.counters['misses'] += 1
+                missFiles.append((lfn,guid))
+            return cachedMap,missFiles
+        finally:
+            self.lock.release()
+
+
+    # set results. fileMap is a map of (lfn,guid) -> list of PFNs or None for missing
+    def setBulk(self,catalog,storage,fileMap):
+        timeNow = time.time()
+        self.lock.acquire()
+        try:
+            for (lfn,guid),pfns in fileMap.iteritems():
+                key = (catalog,storage,lfn,guid)
+                if self.entries.has_key(key):
+                    del self.entries[key]
+                self.entries[key] = (pfns,timeNow)
+            # drop least recently used entries
+            while len(self.entries) > self.maxEntries:
+                self.entries.popitem(last=False)
+        finally:
+            self.lock.release()
+
+
+    # get stats
+    def getStats(self):
+        self.lock.acquire()
+        try:
+            retMap = dict(self.counters)
+            retMap['nEntries'] = len(self.entries)
+            return retMap
+        finally:
+            self.lock.release()
+
+
+
+# Singleton
+replicaCache = ReplicaCache()
@@ -1,5 +1,7 @@
 import re
 import sys
+import copy
+import time
 import traceback
 from config import panda_config
 
@@ -54,8 +56,33 @@ class SiteMapper:
             # satellites
             self.satellites = {}
 
+            # nickname -> (siteID,lastmod) to detect changes in schedconfig
+            self.siteModTimes = {}
+
+            # siteID -> specs added to nuclei or satellites
+            self.nucleusSpecMap = {}
+
+            # cloud attributes to detect changes in cloudconfig
+            self.cloudAttrMap = {}
+
+            # time of the last full build
+            self.timeFullBuild = time.time()
+
+            # lookup tables
+            #    nucleusLookup      : nucleus or satellite name -> NucleusSpec
+            #    nucleusSiteMap     : nucleus or satellite name -> panda site to resolve nucleus:NAME
+            #    siteNucleusMap     : panda site -> nucleus or satellite name
+            #    endpointNucleusMap : DDM endpoint -> nucleus or satellite name
+            #    ddmSiteMap         : default DDM endpoint -> panda sites
+            self.nucleusLookup = {}
+            self.nucleusSiteMap = {}
+            self.siteNucleusMap = {}
+            self.endpointNucleusMap = {}
+            self.ddmSiteMap = {}
+
             # create CloudSpec list 
             tmpCloudListDB = taskBuffer.getCloudList()
+            self.cloudAttrMap = self._getCloudAttrMap(tmpCloudListDB)
             for tmpName,tmpCloudSpec in tmpCloudListDB.iteritems():
                 cloudSpec = {}
                 # copy attributes from CloudSepc
@@ -77,76 +104,19 @@ class SiteMapper:
             self.worldCloudSpec['sites']  = []
             # get list of PandaIDs
             siteIDsList = taskBuffer.getSiteList()
-            firstDefault = True
             # read full list from DB
             siteFullList = taskBuffer.getSiteInfo()
             # read DB to produce paramters in siteinfo dynamically
             for tmpID,tmpNicknameList in siteIDsList.iteritems():
+                siteSpec,nucleusSpecs = self._mergeSiteSpecs(tmpID,tmpNicknameList,siteFullList)
+                if siteSpec != None:
+                    self.siteSpecList[tmpID] = siteSpec
+                # collect nuclei and satellites
+                self._addNucleusSpecs(tmpID,nucleusSpecs)
+                # keep lastmod
                 for tmpNickname in tmpNicknameList:
-                    # invalid nickname
-                    if not siteFullList.has_key(tmpNickname):
-                        continue
-                    # get full spec
-                    ret = siteFullList[tmpNickname]
-                    # append
-                    if ret == None:
-                        _logger.error('Could not read site info for %s:%s' % (tmpID,tmpNickname))
-                    elif (firstDefault and tmpID == defSite.sitename) or (not self.siteSpecList.has_key(tmpID)) \
-                             or (self.siteSpecList.has_key(tmpID) and self.siteSpecList[tmpID].status in ['offline','']):
-                        # overwrite default or remove existing offline 
-                        if firstDefault and tmpID == defSite.sitename:
-                            del self.siteSpecList[tmpID]
-                            firstDefault = False
-                        elif self.siteSpecList.has_key(tmpID) and self.siteSpecList[tmpID].status in ['offline','']:
-                            del self.siteSpecList[tmpID]
-                        # append
-                        if not self.siteSpecList.has_key(tmpID):
-                            # determine type following a convention
-                            tmpType = 'production'
-                            if tmpID.startswith('ANALY_'):
-                                tmpType = 'analysis'
-                            elif re.search('test',tmpID,re.I) or \
-                                     (PandaSiteIDs.has_key(tmpID) and PandaSiteIDs[tmpID]['status']!='OK'):
-                                tmpType = 'test'
-                            # set type
-                            ret.sitename = tmpID
-                            ret.type     = tmpType
-                            # don't use site for production when cloud is undefined
-                            if ret.type == 'production' and ret.cloud == '':
-                                _logger.error('Empty cloud for %s:%s' % (tmpID,tmpNickname))
-                            else:
-                                self.siteSpecList[tmpID] = ret
-                    else:
-                        # overwrite status
-                        if not ret.status in ['offline','']:
-                            if self.siteSpecList[tmpID].status != 'online':
-                                self.siteSpecList[tmpID].status = ret.status
-                            # use larger maxinputsize and memory
-                            try:
-                                if ret.status in ['online']:
-                                    if self.siteSpecList[tmpID].maxinputsize < ret.maxinputsize or \
-                                           ret.maxinputsize == 0:
-                                        self.siteSpecList[tmpID].maxinputsize = ret.maxinputsize
-                                    if (self.siteSpecList[tmpID].memory != 0 and self.siteSpecList[tmpID].memory < ret.memory) or \
-                                           ret.memory == 0:
-                                        self.siteSpecList[tmpID].memory = ret.memory
-                            except:
-                                errtype, errvalue = sys.exc_info()[:2]
-                                _logger.error("%s memory/inputsize failuer : %s %s" % (tmpID,errtype,errvalue))
-                    # collect nuclei
-                    if ret.role == 'nucleus' and ret.type == 'production':
-                        if not ret.pandasite in self.nuclei:
-                            nucleus = NucleusSpec(ret.pandasite)
-                            nucleus.state = ret.pandasite_state
-                            self.nuclei[ret.pandasite] = nucleus
-                        self.nuclei[ret.pandasite].add(ret.sitename,ret.ddm_endpoints)
-                    # collect satellites
-                    if ret.role == 'satellite' and ret.type == 'production':
-                        if not ret.pandasite in self.satellites:
-                            satellite = NucleusSpec(ret.pandasite)
-                            satellite.state = ret.pandasite_state
-                            self.satellites[ret.pandasite] = satellite
-                        self.satellites[ret.pandasite].add(ret.sitename,ret.ddm_endpoints)
+                    if siteFullList.has_key(tmpNickname):
+                        self.siteModTimes[tmpNickname] = (tmpID,siteFullList[tmpNickname].statusmodtime)
             # make cloudSpec
             for siteSpec in self.siteSpecList.values():
                 # choose only prod sites
@@ -196,24 +166,380 @@ class SiteMapper:
                     if tmpSiteSpec.status in ['offline']:
                         _logger.debug('  %s:%s' % (tmpSite,tmpSiteSpec.status))
             _logger.debug('Cloud:XX has %s' % self.defCloudSites)
+            # make lookup tables
+            self._makeNucleusLookup()
+            for siteSpec in self.siteSpecList.values():
+                self._addDdmLookup(siteSpec)
         except:
             type, value, traceBack = sys.exc_info()
             _logger.error("__init__ SiteMapper : %s %s" % (type,value))
             _logger.error(traceback.format_exc())
         _logger.debug('__init__ SiteMapper done')
+
+
+    # get attributes of clouds
+    def _getCloudAttrMap(self,cloudListDB):
+        cloudAttrMap = {}
+        for tmpName,tmpCloudSpec in cloudListDB.iteritems():
+            cloudAttrMap[tmpName] = {}
+            for tmpAttr in tmpCloudSpec._attributes:
+                cloudAttrMap[tmpName][tmpAttr] = getattr(tmpCloudSpec,tmpAttr)
+        return cloudAttrMap
+
+
+    # merge specs of nicknames which belong to a siteID. return the merged spec and specs for nuclei/satellites
+    def _mergeSiteSpecs(self,tmpID,tmpNicknameList,siteFullList):
+        siteSpec = None
+        nucleusSpecs = []
+        firstDefault = True
+        for tmpNickname in tmpNicknameList:
+            # invalid nickname
+            if not siteFullList.has_key(tmpNickname):
+                continue
+            # get full spec
+            ret = siteFullList[tmpNickname]
+            # append
+            if ret == None:
+                _logger.error('Could not read site info for %s:%s' % (tmpID,tmpNickname))
+                continue
+            elif (firstDefault and tmpID == defSite.sitename) or siteSpec == None \
+                     or siteSpec.status in ['offline','']:
+                # overwrite default or remove existing offline 
+                if firstDefault and tmpID == defSite.sitename:
+                    firstDefault = False
+                siteSpec = None
+                # determine type following a convention
+                tmpType = 'production'
+                if tmpID.startswith('ANALY_'):
+                    tmpType = 'analysis'
+                elif re.search('test',tmpID,re.I) or \
+                         (PandaSiteIDs.has_key(tmpID) and PandaSiteIDs[tmpID]['status']!='OK'):
+                    tmpType = 'test'
+                # set type
+                ret.sitename = tmpID
+                ret.type     = tmpType
+                # don't use site for production when cloud is undefined
+                if ret.type == 'production' and ret.cloud == '':
+                    _logger.error('Empty cloud for %s:%s' % (tmpID,tmpNickname))
+                else:
+                    siteSpec = ret
+            else:
+                # overwrite status
+                if not ret.status in ['offline','']:
+                    if siteSpec.status != 'online':
+                        siteSpec.status = ret.status
+                    # use larger maxinputsize and memory
+                    try:
+                        if ret.status in ['online']:
+                            if siteSpec.maxinputsize < ret.maxinputsize or \
+                                   ret.maxinputsize == 0:
+                                siteSpec.maxinputsize = ret.maxinputsize
+                            if (siteSpec.memory != 0 and siteSpec.memory < ret.memory) or \
+                                   ret.memory == 0:
+                                siteSpec.memory = ret.memory
+                    except:
+                        errtype, errvalue = sys.exc_info()[:2]
+                        _logger.error("%s memory/inputsize failuer : %s %s" % (tmpID,errtype,errvalue))
+            # nuclei and satellites
+            if ret.role in ['nucleus','satellite'] and ret.type == 'production':
+                nucleusSpecs.append(ret)
+        return siteSpec,nucleusSpecs
+
+
+    # make lookup tables for nuclei and satellites
+    def _makeNucleusLookup(self):
+        nucleusLookup = {}
+        siteNucleusMap = {}
+        endpointNucleusMap = {}
+        # nuclei take precedence over satellites with the same name
+        for nucleusMap in [self.satellites,self.nuclei]:
+            for tmpName,nucleus in nucleusMap.iteritems():
+                nucleusLookup[tmpName] = nucleus
+                for tmpSite in nucleus.allPandaSites:
+                    siteNucleusMap[tmpSite] = tmpName
+                for tmpEndPoint in nucleus.allDdmEndPoints.keys():
+                    endpointNucleusMap[tmpEndPoint] = tmpName
+        nucleusSiteMap = {}
+        for tmpName,nucleus in nucleusLookup.iteritems():
+            nucleusSiteMap[tmpName] = nucleus.getOnePandaSite()
+        # replace
+        self.nucleusLookup = nucleusLookup
+        self.nucleusSiteMap = nucleusSiteMap
+        self.siteNucleusMap = siteNucleusMap
+        self.endpointNucleusMap = endpointNucleusMap
+
+
+    # add a site to the lookup table for DDM endpoints
+    def _addDdmLookup(self,siteSpec):
+        if not siteSpec.ddm in self.ddmSiteMap:
+            self.ddmSiteMap[siteSpec.ddm] = set()
+        self.ddmSiteMap[siteSpec.ddm].add(siteSpec.sitename)
+
+
+    # remove a site from the lookup table for DDM endpoints
+    def _removeDdmLookup(self,siteSpec):
+        if siteSpec.ddm in self.ddmSiteMap:
+            self.ddmSiteMap[siteSpec.ddm].discard(siteSpec.sitename)
+            if len(self.ddmSiteMap[siteSpec.ddm]) == 0:
+                del self.ddmSiteMap[siteSpec.ddm]
+
+
+    # get map of nuclei or satellites
+    def _getNucleusMap(self,role):
+        if role == 'nucleus':
+            return self.nuclei
+        return self.satellites
+
+
+    # add specs to nuclei and satellites
+    def _addNucleusSpecs(self,tmpID,nucleusSpecs):
+        if nucleusSpecs == []:
+            return
+        self.nucleusSpecMap[tmpID] = nucleusSpecs
+        for ret in nucleusSpecs:
+            nucleusMap = self._getNucleusMap(ret.role)
+            if not ret.pandasite in nucleusMap:
+                nucleus = NucleusSpec(ret.pandasite)
+                nucleus.state = ret.pandasite_state
+                nucleusMap[ret.pandasite] = nucleus
+            nucleusMap[ret.pandasite].add(ret.sitename,ret.ddm_endpoints)
+
+
+    # rebuild nuclei and satellites. nucleusKeys is a set of (role,name)
+    def _rebuildNuclei(self,nucleusKeys):
+        for role,tmpName in nucleusKeys:
+            nucleusMap = self._getNucleusMap(role)
+            # keep the order of existing sites since the first one is used to resolve the nucleus
+            siteNames = []
+            if tmpName in nucleusMap:
+                siteNames = list(nucleusMap[tmpName].allPandaSites)
+            for tmpID,nucleusSpecs in self.nucleusSpecMap.iteritems():
+                for ret in nucleusSpecs:
+                    if ret.role == role and ret.pandasite == tmpName and not ret.sitename in siteNames:
+                        siteNames.append(ret.sitename)
+            nucleus = None
+            for tmpID in siteNames:
+                if not tmpID in self.nucleusSpecMap:
+                    continue
+                for ret in self.nucleusSpecMap[tmpID]:
+                    if ret.role == role and ret.pandasite == tmpName:
+                        if nucleus == None:
+                            nucleus = NucleusSpec(tmpName)
+                            nucleus.state = ret.pandasite_state
+                        nucleus.add(ret.sitename,ret.ddm_endpoints)
+            # replace
+            if nucleus == None:
+                if tmpName in nucleusMap:
+                    del nucleusMap[tmpName]
+            else:
+                nucleusMap[tmpName] = nucleus
+
+
+    # get names of site lists where a site is listed. None for the default cloud
+    def _getSiteListNames(self,siteSpec):
+        listNames = set()
+        if siteSpec == None or siteSpec.type != 'production':
+            return listNames
+        for tmpCloud in siteSpec.cloudlist:
+            if self.cloudSpec.has_key(tmpCloud):
+                listNames.add(tmpCloud)
+            elif not self.cloudSpec.has_key('US'):
+                # sites in the default cloud are ignored when US sites are used
+                listNames.add(None)
+        listNames.add(worldCloudName)
+        return listNames
+
+
+    # get site list of a cloud
+    def _getSiteListByName(self,listName):
+        if listName == None:
+            return self.defCloudSites
+        if listName == worldCloudName:
+            return self.worldCloudSpec['sites']
+        return self.cloudSpec[listName]['sites']
+
+
+    # replace a site spec and update site lists of clouds
+    def _replaceSite(self,tmpID,siteSpec):
+        oldSpec = None
+        if self.siteSpecList.has_key(tmpID):
+            oldSpec = self.siteSpecList[tmpID]
+        oldListNames = self._getSiteListNames(oldSpec)
+        newListNames = self._getSiteListNames(siteSpec)
+        # replace spec
+        if siteSpec != None:
+            self.siteSpecList[tmpID] = siteSpec
+        elif oldSpec != None:
+            del self.siteSpecList[tmpID]
+        if oldSpec != None:
+            self._removeDdmLookup(oldSpec)
+        if siteSpec != None:
+            self._addDdmLookup(siteSpec)
+        # add to new clouds
+        for listName in newListNames.difference(oldListNames):
+            tmpSiteList = self._getSiteListByName(listName)
+            if not tmpID in tmpSiteList:
+                tmpSiteList.append(tmpID)
+        # remove from old clouds
+        for listName in oldListNames.difference(newListNames):
+            # T1 is always listed
+            if not listName in [None,worldCloudName] and self.cloudSpec[listName]['dest'] == tmpID:
+                continue
+            tmpSiteList = self._getSiteListByName(listName)
+            if tmpID in tmpSiteList:
+                tmpSiteList.remove(tmpID)
+
+
+    # rebuild in place
+    def _fullRefresh(self,taskBuffer):
+        newSiteMapper = SiteMapper(taskBuffer)
+        self.__dict__.update(newSiteMapper.__dict__)
+
+
+    # shallow copy where containers patched by refresh are duplicated
+    def _copy(self):
+        newSiteMapper = copy.copy(self)
+        newSiteMapper.siteSpecList = dict(self.siteSpecList)
+        newSiteMapper.cloudSpec = {}
+        for tmpCloud,tmpVals in self.cloudSpec.iteritems():
+            newSiteMapper.cloudSpec[tmpCloud] = dict(tmpVals)
+            newSiteMapper.cloudSpec[tmpCloud]['sites'] = list(tmpVals['sites'])
+        newSiteMapper.worldCloudSpec = dict(self.worldCloudSpec)
+        if 'sites' in self.worldCloudSpec:
+            newSiteMapper.worldCloudSpec['sites'] = list(self.worldCloudSpec['sites'])
+        # defCloudSites is an alias of US sites
+        if self.cloudSpec.has_key('US') and self.defCloudSites is self.cloudSpec['US']['sites']:
+            newSiteMapper.defCloudSites = newSiteMapper.cloudSpec['US']['sites']
+        else:
+            newSiteMapper.defCloudSites = list(self.defCloudSites)
+        newSiteMapper.nuclei = dict(self.nuclei)
+        newSiteMapper.satellites = dict(self.satellites)
+        newSiteMapper.nucleusSpecMap = dict(self.nucleusSpecMap)
+        newSiteMapper.ddmSiteMap = {}
+        for tmpDDM,tmpSites in self.ddmSiteMap.iteritems():
+            newSiteMapper.ddmSiteMap[tmpDDM] = set(tmpSites)
+        return newSiteMapper
+
+
+    # get a refreshed copy so that threads using this instance see no partial update. self if failed
+    def getRefreshed(self,taskBuffer):
+        newSiteMapper = self._copy()
+        if newSiteMapper.refresh(taskBuffer):
+            return newSiteMapper
+        return self
+
+
+    # refresh only sites which were changed in schedconfig since the last refresh
+    def refresh(self,taskBuffer):
+        methodName = 'refresh'
+        _logger.debug('{0} start'.format(methodName))
+        try:
+            # full refresh periodically since some attributes come from other tables
+            fullRefreshInterval = 60*60
+            if hasattr(panda_config,'siteMapperFullRefreshInterval'):
+                fullRefreshInterval = panda_config.siteMapperFullRefreshInterval
+            if time.time() - self.timeFullBuild > fullRefreshInterval:
+                _logger.debug('{0} full refresh after {1} sec'.format(methodName,fullRefreshInterval))
+                self._fullRefresh(taskBuffer)
+                return True
+            # full refresh when clouds were changed
+            cloudAttrMap = self._getCloudAttrMap(taskBuffer.getCloudList())
+            if cloudAttrMap == {}:
+                _logger.error('{0} failed to get clouds'.format(methodName))
+                return False
+            if cloudAttrMap != self.cloudAttrMap:
+                _logger.debug('{0} full refresh since clouds were changed'.format(methodName))
+                self._fullRefresh(taskBuffer)
+                return True
+            # get changed sites
+            siteModTimes = taskBuffer.getSiteModTimes()
+            if siteModTimes == None:
+                _logger.error('{0} failed to get lastmod'.format(methodName))
+                return False
+            changedIDs = set()
+            for tmpNickname,tmpVal in siteModTimes.iteritems():
+                if tmpNickname in self.siteModTimes:
+                    if self.siteModTimes[tmpNickname] == tmpVal:
+                        continue
+                    changedIDs.add(self.siteModTimes[tmpNickname][0])
+                changedIDs.add(tmpVal[0])
+            for tmpNickname,tmpVal in self.siteModTimes.iteritems():
+                if not tmpNickname in siteModTimes:
+                    changedIDs.add(tmpVal[0])
+            if len(changedIDs) == 0:
+                _logger.debug('{0} done with no change'.format(methodName))
+                return True
+            # full refresh when many sites were changed
+            maxSites = 100
+            if hasattr(panda_config,'siteMapperMaxIncrementalSites'):
+                maxSites = panda_config.siteMapperMaxIncrementalSites
+            if len(changedIDs) > maxSites:
+                _logger.debug('{0} full refresh since {1} sites were changed'.format(methodName,len(changedIDs)))
+                self._fullRefresh(taskBuffer)
+                return True
+            # nicknames of changed sites in the same order as __init__
+            siteIDsList = taskBuffer.getSiteList()
+            if siteIDsList == {}:
+                _logger.error('{0} failed to get site list'.format(methodName))
+                return False
+            nicknameMap = {}
+            for tmpID in changedIDs:
+                if tmpID in siteIDsList:
+                    nicknameMap[tmpID] = siteIDsList[tmpID]
+            # read changed sites
+            siteFullList = {}
+            if nicknameMap != {}:
+                siteFullList = taskBuffer.getSiteInfo(nicknameMap.keys())
+                for tmpID,tmpNicknameList in nicknameMap.iteritems():
+                    for tmpNickname in tmpNicknameList:
+                        if not siteFullList.has_key(tmpNickname):
+                            _logger.error('{0} failed to get {1}:{2}'.format(methodName,tmpID,tmpNickname))
+                            return False
+            # patch
+            nucleusKeys = set()
+            for tmpID in changedIDs:
+                if tmpID in self.nucleusSpecMap:
+                    for ret in self.nucleusSpecMap[tmpID]:
+                        nucleusKeys.add((ret.role,ret.pandasite))
+                    del self.nucleusSpecMap[tmpID]
+                siteSpec = None
+                nucleusSpecs = []
+                if tmpID in nicknameMap:
+                    siteSpec,nucleusSpecs = self._mergeSiteSpecs(tmpID,nicknameMap[tmpID],siteFullList)
+                self._replaceSite(tmpID,siteSpec)
+                if nucleusSpecs != []:
+                    self.nucleusSpecMap[tmpID] = nucleusSpecs
+                    for ret in nucleusSpecs:
+                        nucleusKeys.add((ret.role,ret.pandasite))
+            self._rebuildNuclei(nucleusKeys)
+            if len(nucleusKeys) > 0:
+                self._makeNucleusLookup()
+            self.siteModTimes = siteModTimes
+            _logger.debug('{0} done with {1} changed sites {2}'.format(methodName,len(changedIDs),
+                                                                      str(list(changedIDs))))
+            return True
+        except:
+            errtype,errvalue = sys.exc_info()[:2]
+            _logger.error('{0} failed with {1}:{2}'.format(methodName,errtype,errvalue))
+            _logger.error(traceback.format_exc())
+            return False
         
 
-    # accessor for site
-    def getSite(self,site):
+    # resolve nucleus:NAME to panda site
+    def _resolveNucleusSite(self,site):
         try:
             if site.startswith(nucleusTag):
                 tmpName = site.split(':')[-1]
-                if tmpName in self.nuclei:
-                    site = self.nuclei[tmpName].getOnePandaSite()
-                elif tmpName in self.satellites:
-                    site = self.satellites[tmpName].getOnePandaSite()
+                if tmpName in self.nucleusSiteMap:
+                    site = self.nucleusSiteMap[tmpName]
         except:
             pass
+        return site
+
+
+    # accessor for site
+    def getSite(self,site):
+        site = self._resolveNucleusSite(site)
         if self.siteSpecList.has_key(site):
             return self.siteSpecList[site]
         else:
@@ -223,29 +549,13 @@ class SiteMapper:
 
     # check if site exists
     def checkSite(self,site):
-        try:
-            if site.startswith(nucleusTag):
-                tmpName = site.split(':')[-1]
-                if tmpName in self.nuclei:
-                    site = self.nuclei[tmpName].getOnePandaSite()
-                elif tmpName in self.satellites:
-                    site = self.satellites[tmpName].getOnePandaSite()
-        except:
-            pass
+        site = self._resolveNucleusSite(site)
         return self.siteSpecList.has_key(site)
 
 
     # resolve nucleus
     def resolveNucleus(self,site):
-        try:
-            if site.startswith(nucleusTag):
-                tmpName = site.split(':')[-1]
-                if tmpName in self.nuclei:
-                    site = self.nuclei[tmpName].getOnePandaSite()
-                elif tmpName in self.satellites:
-                    site = self.satellites[tmpName].getOnePandaSite()
-        except:
-            pass
+        site = self._resolveNucleusSite(site)
         if site == 'NULL':
             site = None
         return site
@@ -286,9 +596,10 @@ class SiteMapper:
 
     # get ddm point
     def getDdmEndpoint(self,siteID,storageToken):
-        if not self.checkSite(siteID):
+        siteID = self._resolveNucleusSite(siteID)
+        if not self.siteSpecList.has_key(siteID):
             return None
-        siteSpec =  self.getSite(siteID)
+        siteSpec = self.siteSpecList[siteID]
         if siteSpec.setokens.has_key(storageToken):
             return siteSpec.setokens[storageToken]
         return siteSpec.ddm
@@ -297,8 +608,30 @@ class SiteMapper:
 
     # get nucleus
     def getNucleus(self,tmpName):
-        if tmpName in self.nuclei:
-            return self.nuclei[tmpName]
-        if tmpName in self.satellites:
-            return self.satellites[tmpName]
+        if tmpName in self.nucleusLookup:
+            return self.nucleusLookup[tmpName]
+        return None
+
+
+
+    # get name of nucleus or satellite which a site belongs to
+    def getNucleusWithSite(self,siteName):
+        if siteName in self.siteNucleusMap:
+            return self.siteNucleusMap[siteName]
+        return None
+
+
+
+    # get name of nucleus or satellite which a DDM endpoint belongs to
+    def getNucleusWithEndpoint(self,endPoint):
+        if endPoint in self.endpointNucleusMap:
+            return self.endpointNucleusMap[endPoint]
         return None
+
+
+
+    # get sites which use a DDM endpoint as default
+    def getSitesWithDdm(self,ddm):
+        if ddm in self.ddmSiteMap:
+            return list(self.ddmSiteMap[ddm])
+        return []
@@ -0,0 +1,349 @@
+"""
+bulk evaluation of candidate sites for brokerage
+
+Attributes of candidate sites are copied into columns once per brokerage
+pass. For each bunch of jobs, the static filters and the release check are
+applied stage by stage to the remaining candidates, in the same order as the
+checks in broker.schedule, so that every rejected site gets the reason of the
+first failed check
+
+"""
+
+import re
+
+
+# column table of site attributes. rows are made when sites are looked up for the first time
+# so that only candidates are converted
+class SiteTable:
+    # constructor
+    def __init__(self,siteMapper):
+        self.siteMapper = siteMapper
+        self.index = {}
+        self.siteSpecs = []
+        self.status = []
+        self.accessControl = []
+        self.coreCount = []
+        self.memory = []
+        self.minMemory = []
+        self.maxTime = []
+        self.minTime = []
+        self.maxWdir = []
+        self.reliability = []
+        self.cloud = []
+        self.releases = []
+        self.releaseSet = []
+        self.validatedReleases = []
+        self.validatedSet = []
+        self.directAccess = []
+        # conversion errors per row
+        self.errors = []
+        # pilot rates per site
+        self.pilots = {}
+
+
+    # add row
+    def _addRow(self,siteName,siteSpec):
+        self.index[siteName] = len(self.siteSpecs)
+        self.siteSpecs.append(siteSpec)
+        self.status.append(siteSpec.status)
+        self.accessControl.append(siteSpec.accesscontrol)
+        self.coreCount.append(siteSpec.coreCount)
+        self.cloud.append(siteSpec.cloud)
+        self.reliability.append(siteSpec.reliabilityLevel)
+        self.directAccess.append(siteSpec.allowdirectaccess)
+        errors = {}
+        self.memory.append(self._toInt(siteSpec.memory,'memory',errors))
+        self.minMemory.append(self._toInt(siteSpec.minmemory,'minmemory',errors))
+        self.maxTime.append(self._toInt(siteSpec.maxtime,'maxtime',errors))
+        self.minTime.append(self._toInt(siteSpec.mintime,'mintime',errors))
+        self.maxWdir.append(self._toInt(siteSpec.maxwdir,'maxwdir',errors))
+        self.errors.append(errors)
+        self.releases.append(siteSpec.releases)
+        self.releaseSet.append(self._toSet(siteSpec.releases))
+        self.validatedReleases.append(siteSpec.validatedreleases)
+        self.validatedSet.append(self._toSet(siteSpec.validatedreleases))
+
+
+    # convert to int. 0 means no limit, and invalid values are recorded in errors
+    def _toInt(self,value,name,errors):
+        if value == 0:
+            return 0
+        try:
+            return int(value)
+        except:
+            errors[name] = value
+            return None
+
+
+    # convert release list to set
+    def _toSet(self,releases):
+        try:
+            return frozenset(releases)
+        except:
+            return frozenset()
+
+
+    # get row. None if the site doesn't exist
+    def getRow(self,siteName):
+        if not self.index.has_key(siteName):
+            if not self.siteMapper.checkSite(siteName):
+                return None
+            self._addRow(siteName,self.siteMapper.getSite(siteName))
+        return self.index[siteName]
+
+
+    # get pilot rates limited by (G+1)/(U+1)
+    def getPilots(self,siteName,nWNmap):
+        if not self.pilots.has_key(siteName):
+            nPilotsGet = 0
+            nPilotsUpdate = 0
+            if nWNmap.has_key(siteName):
+                nPilots = nWNmap[siteName]['getJob'] + nWNmap[siteName]['updateJob']
+                nPilotsGet = nWNmap[siteName]['getJob']
+                nPilotsUpdate = nWNmap[siteName]['updateJob']
+            else:
+                nPilots = 0
+            limitOnGUmax = 1.1
+            limitOnGUmin = 0.9
+            guRatio = float(1+nPilotsGet)/float(1+nPilotsUpdate)
+            if guRatio > limitOnGUmax:
+                nPilotsGet = limitOnGUmax * float(1+nPilotsUpdate) - 1.0
+            elif guRatio < limitOnGUmin:
+                nPilotsGet = limitOnGUmin * float(1+nPilotsUpdate) - 1.0
+            self.pilots[siteName] = (nPilots,nPilotsGet,nPilotsUpdate)
+        return self.pilots[siteName]
+
+
+
+# result of evaluation
+class ScoreResult:
+    # constructor
+    def __init__(self):
+        # sites passed all filters in the original order
+        self.candidates = []
+        # site -> (key in resultsForAnal or None,message)
+        self.rejections = {}
+        # site -> (nPilots,nPilotsGet,nPilotsUpdate)
+        self.pilots = {}
+        # at least one site has the release
+        self.foundRelease = False
+        # messages to the logger
+        self.loggerMessages = []
+        # errors in the checks
+        self.errors = []
+
+
+    # reject a site
+    def reject(self,siteName,resultKey,message):
+        self.rejections[siteName] = (resultKey,message)
+
+
+
+# convert job parameter to int. None if not set or invalid
+def _jobInt(value,name,result):
+    if value in [None,0,'NULL']:
+        return None
+    try:
+        return int(value)
+    except:
+        result.errors.append('%s : invalid job value %s' % (name,value))
+        return None
+
+
+# extract release versions of a job
+def getJobReleases(jobRels):
+    return [re.sub('^Atlas-','',tmpRel) for tmpRel in jobRels.split('\n')]
+
+
+# release checker using precomputed versions and set of site releases
+def checkReleaseSet(jobRelVers,siteRelSet):
+    # all on/off
+    if "True" in siteRelSet:
+        return True
+    if "False" in siteRelSet:
+        return False
+    return siteRelSet.issuperset(jobRelVers)
+
+
+# apply filters to candidate sites
+def filterSites(table,scanSiteList,forAnalysis,computingSite,prevProType,prevSourceLabel,prevCoreCount,
+                prevMemory,prevMaxCpuCount,prevDiskCount,siteReliability,isIntReliability,prevRelease,
+                prevCmtConfig,prevHomePkg,prevManualPreset,prevDirectAcc,useCacheVersion,siteListWithCache,
+                trustIS,nWNmap):
+    result = ScoreResult()
+    # name-based checks
+    rows = []
+    for site in scanSiteList:
+        if site == 'NULL':
+            continue
+        # ignore test sites
+        if (prevManualPreset == False) and (site.endswith('test') or site.endswith('Test') or site.startswith('Test')):
+            result.reject(site,None,None)
+            continue
+        # ignore analysis queues
+        if (not forAnalysis) and site.startswith('ANALY'):
+            result.reject(site,None,None)
+            continue
+        row = table.getRow(site)
+        if row == None:
+            result.reject(site,None," skip: %s doesn't exist in DB" % site)
+            continue
+        rows.append((site,row))
+    # status
+    ignoreOffline = not computingSite in ['NULL',None,'']
+    isHC = prevProType in ['hammercloud','gangarobot','gangarobot-squid']
+    allowTest = prevProType in ['prod_test','hammercloud','gangarobot','gangarobot-squid'] or \
+                prevSourceLabel in ['test','prod_test']
+    newRows = []
+    for site,row in rows:
+        status = table.status[row]
+        if status in ['offline','brokeroff'] and not ignoreOffline:
+            if forAnalysis and status == 'brokeroff' and table.accessControl[row] == 'grouplist':
+                # ignore brokeroff for grouplist site
+                pass
+            elif forAnalysis and isHC:
+                # ignore site status for HC
+                pass
+            else:
+                result.reject(site,'status',' skip: status %s' % status)
+                continue
+        if status == 'test' and not allowTest:
+            result.reject(site,'status',' skip: status %s for %s' % (status,prevProType))
+            continue
+        newRows.append((site,row))
+    rows = newRows
+    # core count
+    isMP = not prevCoreCount in [None,'NULL'] and prevCoreCount > 1
+    newRows = []
+    for site,row in rows:
+        coreCount = table.coreCount[row]
+        if coreCount > 1 and not isMP:
+            result.reject(site,'cpucore','  skip: MP site (%s core) for job.coreCount=%s' % (coreCount,prevCoreCount))
+            continue
+        if coreCount <= 1 and isMP:
+            result.reject(site,'cpucore','  skip: single core site (%s core) for job.coreCount=%s' % (coreCount,
+                                                                                                    prevCoreCount))
+            continue
+        newRows.append((site,row))
+    rows = newRows
+    # memory, walltime and scratch disk. checks with invalid values are skipped
+    jobMemory = _jobInt(prevMemory,'memory',result)
+    jobMaxCpuCount = _jobInt(prevMaxCpuCount,'maxtime',result)
+    jobDiskCount = _jobInt(prevDiskCount,'disk',result)
+    for column,attrName,jobValue,isMax,resultKey,msgTemplate in \
+            [(table.memory,'memory',jobMemory,True,'memory','  skip: site memory shortage %s<%s'),
+             (table.minMemory,'minmemory',jobMemory,False,'memory','  skip: job memory shortage %s>%s'),
+             (table.maxTime,'maxtime',jobMaxCpuCount,True,'maxtime','  skip: insufficient maxtime %s<%s'),
+             (table.minTime,'mintime',jobMaxCpuCount,False,'maxtime','  skip: insufficient job maxtime %s<%s'),
+             (table.maxWdir,'maxwdir',jobDiskCount,True,'scratch','  skip: not enough disk %s<%s'),
+             ]:
+        if jobValue == None:
+            continue
+        newRows = []
+        for site,row in rows:
+            siteValue = column[row]
+            if siteValue == 0:
+                pass
+            elif siteValue == None:
+                result.errors.append('%s check : invalid %s=%s at %s' % (attrName,attrName,
+                                                                         table.errors[row][attrName],site))
+            elif isMax and siteValue < jobValue:
+                result.reject(site,resultKey,msgTemplate % (siteValue,jobValue))
+                continue
+            elif not isMax and siteValue > jobValue:
+                if attrName == 'minmemory':
+                    message = msgTemplate % (table.siteSpecs[row].memory,jobValue)
+                elif attrName == 'mintime':
+                    message = msgTemplate % (jobValue,siteValue)
+                else:
+                    message = msgTemplate % (siteValue,jobValue)
+                result.reject(site,resultKey,message)
+                continue
+            newRows.append((site,row))
+        rows = newRows
+    # reliability
+    if forAnalysis and isIntReliability:
+        newRows = []
+        for site,row in rows:
+            reliability = table.reliability[row]
+            if reliability != None and reliability > siteReliability:
+                result.reject(site,'reliability',' skip: insufficient reliability %s > %s' % (reliability,
+                                                                                              siteReliability))
+                continue
+            newRows.append((site,row))
+        rows = newRows
+    # release
+    isRepro = prevProType in ['reprocessing']
+    jobRelVers = []
+    if prevRelease != None:
+        jobRelVers = getJobReleases(prevRelease)
+    relString = str(prevRelease).replace('\n',' ')
+    homePkgString = str(prevHomePkg).replace('\n',' ')
+    siteSetWithCache = set(siteListWithCache)
+    newRows = []
+    for site,row in rows:
+        if isRepro:
+            releases = table.validatedReleases[row]
+            releaseSet = table.validatedSet[row]
+        else:
+            releases = table.releases[row]
+            releaseSet = table.releaseSet[row]
+        isND = table.cloud[row] in ['ND']
+        if table.releases[row] == ['ANY']:
+            # doesn't check releases for catch all
+            result.foundRelease = True
+        elif forAnalysis and (isND or prevRelease==''):
+            # doesn't check releases for analysis
+            pass
+        elif forAnalysis and useCacheVersion:
+            # cache matching
+            if not site in siteSetWithCache:
+                if trustIS:
+                    resultKey = 'rel'
+                else:
+                    resultKey = None
+                result.reject(site,resultKey,' skip: cache %s/%s not found' % (relString,prevCmtConfig))
+                continue
+        elif prevRelease != None and \
+                 (useCacheVersion and not isND and not site in ['CERN-RELEASE']) and \
+                 (not isRepro) and \
+                 (not site in siteSetWithCache):
+            resultKey = None
+            if prevSourceLabel in ['managed','test']:
+                resultKey = 'rel'
+                # make message
+                message = '%s - cache %s/%s not found' % (site,homePkgString,prevCmtConfig)
+                if not message in result.loggerMessages:
+                    result.loggerMessages.append(message)
+            result.reject(site,resultKey,' skip: cache %s/%s not found' % (homePkgString,prevCmtConfig))
+            continue
+        elif prevRelease != None and \
+                 ((not useCacheVersion and releases != [] and not isND and not site in ['CERN-RELEASE']) or isRepro) and \
+                 (((not checkReleaseSet(jobRelVers,releaseSet) and prevManualPreset == False) or \
+                   not site in siteSetWithCache) and not isND and not site in ['CERN-RELEASE']):
+            # release matching
+            if not useCacheVersion:
+                message = ' skip: release %s/%s not found' % (relString,prevCmtConfig)
+            else:
+                message = ' skip: repro cache %s/%s not found' % (homePkgString,prevCmtConfig)
+            result.reject(site,'rel',message)
+            continue
+        else:
+            # found at least one site has the release
+            result.foundRelease = True
+        # direct access
+        if prevDirectAcc == 'direct' and not table.directAccess[row]:
+            result.reject(site,None,' skip: no direct access support')
+            continue
+        newRows.append((site,row))
+    rows = newRows
+    # pilots
+    for site,row in rows:
+        pilots = table.getPilots(site,nWNmap)
+        # if no pilots
+        if pilots[0] == 0 and nWNmap != {}:
+            result.reject(site,'pilot'," skip: %s no pilot" % site)
+            continue
+        result.pilots[site] = pilots
+        result.candidates.append(site)
+    return result
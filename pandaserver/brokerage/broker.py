@@ -8,8 +8,11 @@ import datetime
 import commands
 import ErrorCode
 import broker_util
-import PandaSiteIDs
+import SiteScorer
+from MessageShipper import messageShipper
+from taskbuffer import JobUtils
 from taskbuffer import ProcessGroups
+from taskbuffer.JobStatsSnapshot import jobStatsSnapshot
 from dataservice import DataServiceUtils
 from dataservice.DDM import toa
 from config import panda_config
@@ -17,9 +20,6 @@ from config import panda_config
 from pandalogger.PandaLogger import PandaLogger
 _log = PandaLogger().getLogger('broker')
 
-# all known sites
-_allSites = PandaSiteIDs.PandaSiteIDs.keys()
-        
 # sites for prestaging
 #prestageSites = ['BNL_ATLAS_test','BNL_ATLAS_1','BNL_ATLAS_2']
 
@@ -39,24 +39,6 @@ shortLongMap = {'ANALY_BNL_ATLAS_1':'ANALY_LONG_BNL_ATLAS',
 # processingType to skip brokerage
 skipBrokerageProTypes = ['prod_test']
 
-# comparison function for sort
-def _compFunc(jobA,jobB):
-    # append site if not in list
-    if not jobA.computingSite in _allSites:
-        _allSites.append(jobA.computingSite)
-    if not jobB.computingSite in _allSites:
-        _allSites.append(jobB.computingSite)
-    # compare
-    indexA = _allSites.index(jobA.computingSite) 
-    indexB = _allSites.index(jobB.computingSite) 
-    if indexA > indexB:
-        return 1
-    elif indexA < indexB:
-        return -1
-    else:
-        return 0
-
-
 # release checker
 def _checkRelease(jobRels,siteRels):
     # all on/off
@@ -286,6 +268,16 @@ def sendMsgToLoggerHTTP(msgList,job):
             msgHead = "dn='%s' : jobset=%s jobdef=%s" % (job.prodUserName,job.jobsetID,job.jobDefinitionID)
         else:
             msgHead = "dn='%s' : jobdef=%s" % (job.prodUserName,job.jobDefinitionID)
+        # ship in background
+        if messageShipper.isEnabled():
+            messages = []
+            for msgBody in msgList:
+                message = msgHead + ' : ' + msgBody
+                # dump locally
+                _log.debug(message)
+                messages.append(message)
+            messageShipper.put(msgType,'info',messages)
+            return
         for msgBody in msgList:
             # make message
             message = msgHead + ' : ' + msgBody
@@ -575,6 +567,9 @@ def schedule(jobs,taskBuffer,siteMapper,forAnalysis=False,setScanSiteList=[],tru
 
         prestageSites = getPrestageSites(siteMapper)
 
+        # table of site attributes for bulk filtering
+        siteTable = None
+
         # check if only JEDI
         onlyJEDI = True
         for tmpJob in jobs:
@@ -582,7 +577,8 @@ def schedule(jobs,taskBuffer,siteMapper,forAnalysis=False,setScanSiteList=[],tru
                 onlyJEDI = False
                 break
 
-        # get statistics
+        # get statistics from the shared snapshot if enabled
+        statSource = jobStatsSnapshot.getSource(taskBuffer)
         faresharePolicy = {}
         newJobStatWithPrio = {}
         jobStatBrokerCloudsWithPrio = {}
@@ -597,20 +593,20 @@ def schedule(jobs,taskBuffer,siteMapper,forAnalysis=False,setScanSiteList=[],tru
             nRunningMap = {}
             hospitalQueueMap = {}
         else:
-            jobStatistics = taskBuffer.getJobStatistics(forAnal=forAnalysis)
+            jobStatistics = statSource.getJobStatistics(forAnal=forAnalysis)
             if not forAnalysis:
                 jobStatBroker = {}
-                jobStatBrokerClouds = taskBuffer.getJobStatisticsBrokerage()
-                faresharePolicy = taskBuffer.getFaresharePolicy()
+                jobStatBrokerClouds = statSource.getJobStatisticsBrokerage()
+                faresharePolicy = statSource.getFaresharePolicy()
             else:
                 if minPriority == None:
-                    jobStatBroker = taskBuffer.getJobStatisticsAnalBrokerage()
+                    jobStatBroker = statSource.getJobStatisticsAnalBrokerage()
                 else:
-                    jobStatBroker = taskBuffer.getJobStatisticsAnalBrokerage(minPriority=minPriority)                    
-                nRunningMap   = taskBuffer.getnRunningInSiteData()
+                    jobStatBroker = statSource.getJobStatisticsAnalBrokerage(minPriority=minPriority)                    
+                nRunningMap   = statSource.getnRunningInSiteData()
             hospitalQueueMap = getHospitalQueues(siteMapper)
-        # sort jobs by siteID. Some jobs may already define computingSite
-        jobs.sort(_compFunc)
+        # group jobs by siteID. Some jobs may already define computingSite
+        jobs[:] = JobUtils.groupJobsBySite(jobs)
         # brokerage for analysis 
         candidateForAnal = True
         relCloudMap      = {}
@@ -864,210 +860,50 @@ def schedule(jobs,taskBuffer,siteMapper,forAnalysis=False,setScanSiteList=[],tru
                         random.shuffle(scanSiteList)
                     # get cnadidates    
                     if True:
+                        # evaluate filters in bulk
+                        if not prevIsJEDI:
+                            if siteTable == None:
+                                siteTable = SiteScorer.SiteTable(siteMapper)
+                            if nWNmap == {}:
+                                nWNmap = taskBuffer.getCurrentSiteData()
+                            scoreResult = SiteScorer.filterSites(siteTable,scanSiteList,forAnalysis,computingSite,
+                                                                 prevProType,prevSourceLabel,prevCoreCount,prevMemory,
+                                                                 prevMaxCpuCount,prevDiskCount,siteReliability,
+                                                                 isinstance(siteReliability,types.IntType),
+                                                                 prevRelease,prevCmtConfig,prevHomePkg,prevManualPreset,
+                                                                 prevDirectAcc,useCacheVersion,siteListWithCache,
+                                                                 trustIS,nWNmap)
+                            for tmpErrMsg in scoreResult.errors:
+                                tmpLog.error(tmpErrMsg)
+                            for message in scoreResult.loggerMessages:
+                                if not message in loggerMessages:
+                                    loggerMessages.append(message)
+                            if scoreResult.foundRelease:
+                                foundRelease = True
+                            tmpLog.debug('  %s/%s sites passed filters' % (len(scoreResult.candidates),len(scanSiteList)))
                         # loop over all sites    
                         for site in scanSiteList:
                             tmpLog.debug('calculate weight for site:%s' % site)
-                            # _allSites may conain NULL after sort()
+                            # site list may contain NULL
                             if site == 'NULL':
                                 continue
                             if prevIsJEDI:
                                 foundRelease = True
                                 winv = 1
                             else:
-                                # ignore test sites
-                                if (prevManualPreset == False) and (site.endswith('test') or \
-                                                                    site.endswith('Test') or site.startswith('Test')):
-                                    continue
-                                # ignore analysis queues
-                                if (not forAnalysis) and site.startswith('ANALY'):
-                                    continue
-                                # get SiteSpec
-                                if siteMapper.checkSite(site):
-                                    tmpSiteSpec = siteMapper.getSite(site)
-                                else:
-                                    tmpLog.debug(" skip: %s doesn't exist in DB" % site)
-                                    continue
-                                # check status
-                                if tmpSiteSpec.status in ['offline','brokeroff'] and computingSite in ['NULL',None,'']:
-                                    if forAnalysis and tmpSiteSpec.status == 'brokeroff' and tmpSiteSpec.accesscontrol == 'grouplist':
-                                        # ignore brokeroff for grouplist site
-                                        pass
-                                    elif forAnalysis and  prevProType in ['hammercloud','gangarobot','gangarobot-squid']:
-                                        # ignore site status for HC
-                                        pass
-                                    else:
-                                        tmpLog.debug(' skip: status %s' % tmpSiteSpec.status)
-                                        resultsForAnal['status'].append(site)                                    
-                                        continue
-                                if tmpSiteSpec.status == 'test' and (not prevProType in ['prod_test','hammercloud','gangarobot','gangarobot-squid']) \
-                                       and not prevSourceLabel in ['test','prod_test']:
-                                    tmpLog.debug(' skip: status %s for %s' % (tmpSiteSpec.status,prevProType))
-                                    resultsForAnal['status'].append(site)
-                                    continue
-                                tmpLog.debug('   status=%s' % tmpSiteSpec.status)
-                                # check core count
-                                if tmpSiteSpec.coreCount > 1:
-                                    # use multi-core queue for MP jobs
-                                    if not prevCoreCount in [None,'NULL'] and prevCoreCount > 1:
-                                        pass
-                                    else:
-                                        tmpLog.debug('  skip: MP site (%s core) for job.coreCount=%s' % (tmpSiteSpec.coreCount,
-                                                                                                       prevCoreCount))
-                                        resultsForAnal['cpucore'].append(site)
-                                        continue
-                                else:
-                                    # use single core for non-MP jobs
-                                    if not prevCoreCount in [None,'NULL'] and prevCoreCount > 1:
-                                        tmpLog.debug('  skip: single core site (%s core) for job.coreCount=%s' % (tmpSiteSpec.coreCount,
-                                                                                                                prevCoreCount))
-                                        resultsForAnal['cpucore'].append(site)
-                                        continue
-                                # check max memory
-                                if tmpSiteSpec.memory != 0 and not prevMemory in [None,0,'NULL']:
-                                    try:
-                                        if int(tmpSiteSpec.memory) < int(prevMemory):
-                                            tmpLog.debug('  skip: site memory shortage %s<%s' % (tmpSiteSpec.memory,prevMemory))
-                                            resultsForAnal['memory'].append(site)
-                                            continue
-                                    except:
-                                        errtype,errvalue = sys.exc_info()[:2]
-                                        tmpLog.error("max memory check : %s %s" % (errtype,errvalue))
-                                # check min memory
-                                if tmpSiteSpec.minmemory != 0 and not prevMemory in [None,0,'NULL']:
-                                    try:
-                                        if int(tmpSiteSpec.minmemory) > int(prevMemory):
-                                            tmpLog.debug('  skip: job memory shortage %s>%s' % (tmpSiteSpec.memory,prevMemory))
-                                            resultsForAnal['memory'].append(site)
-                                            continue
-                                    except:
-                                        errtype,errvalue = sys.exc_info()[:2]
-                                        tmpLog.error("min memory check : %s %s" % (errtype,errvalue))
-                                # check maxcpucount
-                                if tmpSiteSpec.maxtime != 0 and not prevMaxCpuCount in [None,0,'NULL']:
-                                    try:
-                                        if int(tmpSiteSpec.maxtime) < int(prevMaxCpuCount):
-                                            tmpLog.debug('  skip: insufficient maxtime %s<%s' % (tmpSiteSpec.maxtime,prevMaxCpuCount))
-                                            resultsForAnal['maxtime'].append(site)
-                                            continue
-                                    except:
-                                        errtype,errvalue = sys.exc_info()[:2]
-                                        tmpLog.error("maxtime check : %s %s" % (errtype,errvalue))
-                                if tmpSiteSpec.mintime != 0 and not prevMaxCpuCount in [None,0,'NULL']:
-                                    try:
-                                        if int(tmpSiteSpec.mintime) > int(prevMaxCpuCount):
-                                            tmpLog.debug('  skip: insufficient job maxtime %s<%s' % (prevMaxCpuCount,tmpSiteSpec.mintime))
-                                            resultsForAnal['maxtime'].append(site)
-                                            continue
-                                    except:
-                                        errtype,errvalue = sys.exc_info()[:2]
-                                        tmpLog.error("mintime check : %s %s" % (errtype,errvalue))
-                                # check max work dir size
-                                if tmpSiteSpec.maxwdir != 0 and (not prevDiskCount in [None,0,'NULL']):
-                                    try:
-                                        if int(tmpSiteSpec.maxwdir) < int(prevDiskCount):
-                                            tmpLog.debug('  skip: not enough disk %s<%s' % (tmpSiteSpec.maxwdir,prevDiskCount))
-                                            resultsForAnal['scratch'].append(site)
-                                            continue
-                                    except:
-                                        errtype,errvalue = sys.exc_info()[:2]
-                                        tmpLog.error("disk check : %s %s" % (errtype,errvalue))
-                                tmpLog.debug('   maxwdir=%s' % tmpSiteSpec.maxwdir)
-                                # reliability
-                                if forAnalysis and isinstance(siteReliability,types.IntType):
-                                    if tmpSiteSpec.reliabilityLevel != None and tmpSiteSpec.reliabilityLevel > siteReliability:
-                                        tmpLog.debug(' skip: insufficient reliability %s > %s' % (tmpSiteSpec.reliabilityLevel,siteReliability))
-                                        resultsForAnal['reliability'].append(site)
-                                        continue
-                                # change NULL cmtconfig to slc3/4
-                                if prevCmtConfig in ['NULL','',None]:
-                                    if forAnalysis:
-                                        tmpCmtConfig = 'i686-slc4-gcc34-opt'
-                                    else:
-                                        tmpCmtConfig = 'i686-slc3-gcc323-opt'                                    
-                                else:
-                                    tmpCmtConfig = prevCmtConfig
-                                # set release
-                                releases = tmpSiteSpec.releases
-                                origReleases = releases
-                                if prevProType in ['reprocessing']:
-                                    # use validated releases for reprocessing
-                                    releases = tmpSiteSpec.validatedreleases
-                                if not useCacheVersion:    
-                                    tmpLog.debug('   %s' % str(releases))
-                                if origReleases == ['ANY']:
-                                    # doesn't check releases for catch all
-                                    tmpLog.debug(' no release check due to releases=%s'  % origReleases)
-                                    foundRelease = True
-                                elif forAnalysis and (tmpSiteSpec.cloud in ['ND'] or prevRelease==''):
-                                    # doesn't check releases for analysis
-                                    tmpLog.debug(' no release check')
-                                    pass
-                                elif forAnalysis and useCacheVersion:
-                                    # cache matching 
-                                    if not site in siteListWithCache:
-                                        tmpLog.debug(' skip: cache %s/%s not found' % (prevRelease.replace('\n',' '),prevCmtConfig))
-                                        if trustIS:
-                                            resultsForAnal['rel'].append(site)
-                                        continue
-                                elif prevRelease != None and \
-                                         (useCacheVersion and not tmpSiteSpec.cloud in ['ND'] and not site in ['CERN-RELEASE']) and \
-                                         (not prevProType in ['reprocessing']) and \
-                                         (not site in siteListWithCache):
-                                        tmpLog.debug(' skip: cache %s/%s not found' % (prevHomePkg.replace('\n',' '),prevCmtConfig))
-                                        # send message to logger
-                                        try:
-                                            if prevSourceLabel in ['managed','test']:
-                                                resultsForAnal['rel'].append(site)                                    
-                                                # make message
-                                                message = '%s - cache %s/%s not found' % (site,prevHomePkg.replace('\n',' '),prevCmtConfig)
-                                                if not message in loggerMessages:
-                                                    loggerMessages.append(message)
-                                        except:
-                                            pass
-                                        continue
-                                elif prevRelease != None and \
-                                     ((not useCacheVersion and releases != [] and not tmpSiteSpec.cloud in ['ND'] and not site in ['CERN-RELEASE']) or prevProType in ['reprocessing']) and \
-                                     (((not _checkRelease(prevRelease,releases) and prevManualPreset == False) or not site in siteListWithCache) and not tmpSiteSpec.cloud in ['ND'] and not site in ['CERN-RELEASE']):
-                                    # release matching
-                                    if not useCacheVersion:
-                                        tmpLog.debug(' skip: release %s/%s not found' % (prevRelease.replace('\n',' '),prevCmtConfig))
-                                    else:
-                                        tmpLog.debug(' skip: repro cache %s/%s not found' % (prevHomePkg.replace('\n',' '),prevCmtConfig))
-                                    resultsForAnal['rel'].append(site)
-                                    continue
-                                elif not foundRelease:
-                                    # found at least one site has the release
-                                    foundRelease = True
-                                # direct access
-                                if prevDirectAcc == 'direct' and not tmpSiteSpec.allowdirectaccess:
-                                    tmpLog.debug(' skip: no direct access support')
+                                # rejected by filters
+                                if scoreResult.rejections.has_key(site):
+                                    resultKey,message = scoreResult.rejections[site]
+                                    if message != None:
+                                        tmpLog.debug(message)
+                                    if resultKey != None:
+                                        resultsForAnal[resultKey].append(site)
                                     continue
+                                tmpSiteSpec = siteMapper.getSite(site)
+                                tmpLog.debug('   status=%s maxwdir=%s' % (tmpSiteSpec.status,tmpSiteSpec.maxwdir))
                                 # get pilot statistics
-                                nPilotsGet = 0
-                                nPilotsUpdate = 0
-                                if nWNmap == {}:
-                                    nWNmap = taskBuffer.getCurrentSiteData()
-                                if nWNmap.has_key(site):    
-                                    nPilots = nWNmap[site]['getJob'] + nWNmap[site]['updateJob']
-                                    nPilotsGet = nWNmap[site]['getJob']
-                                    nPilotsUpdate = nWNmap[site]['updateJob']
-                                else:
-                                    nPilots = 0
-                                tmpLog.debug(' original nPilots:%s get:%s update:%s' % (nPilots,nPilotsGet,nPilotsUpdate))
-                                # limit on (G+1)/(U+1)
-                                limitOnGUmax = 1.1
-                                limitOnGUmin = 0.9                            
-                                guRatio = float(1+nPilotsGet)/float(1+nPilotsUpdate) 
-                                if guRatio > limitOnGUmax:
-                                    nPilotsGet = limitOnGUmax * float(1+nPilotsUpdate) - 1.0
-                                elif guRatio < limitOnGUmin:
-                                    nPilotsGet = limitOnGUmin * float(1+nPilotsUpdate) - 1.0
+                                nPilots,nPilotsGet,nPilotsUpdate = scoreResult.pilots[site]
                                 tmpLog.debug(' limited nPilots:%s get:%s update:%s' % (nPilots,nPilotsGet,nPilotsUpdate))
-                                # if no pilots
-                                if nPilots == 0 and nWNmap != {}:
-                                    tmpLog.debug(" skip: %s no pilot" % site)
-                                    resultsForAnal['pilot'].append(site)
-                                    continue
                                 # if no jobs in jobsActive/jobsDefined
                                 if not jobStatistics.has_key(site):
                                     jobStatistics[site] = {'assigned':0,'activated':0,'running':0,'transferring':0}
@@ -1211,7 +1047,7 @@ def schedule(jobs,taskBuffer,siteMapper,forAnalysis=False,setScanSiteList=[],tru
                                 nRunJobsPerGroup = None
                                 if not forAnalysis and prevSourceLabel in ['managed','test']:
                                     if not jobStatBrokerCloudsWithPrio.has_key(prevPriority):
-                                        jobStatBrokerCloudsWithPrio[prevPriority] = taskBuffer.getJobStatisticsBrokerage(prevPriority,prevPriority+prioInterval)
+                                        jobStatBrokerCloudsWithPrio[prevPriority] = statSource.getJobStatisticsBrokerage(prevPriority,prevPriority+prioInterval)
                                     if not jobStatBrokerCloudsWithPrio[prevPriority].has_key(previousCloud):
                                         jobStatBrokerCloudsWithPrio[prevPriority][previousCloud] = {}
                                     if not jobStatBrokerCloudsWithPrio[prevPriority][previousCloud].has_key(site):
@@ -1703,6 +1539,9 @@ def schedule(jobs,taskBuffer,siteMapper,forAnalysis=False,setScanSiteList=[],tru
                     # release lock
                     fcntl.flock(_lockGetUU.fileno(), fcntl.LOCK_UN)
         # send log messages
+        if messageShipper.isEnabled():
+            messageShipper.put('brokerage','warning',loggerMessages)
+            loggerMessages = []
         try:
             for  message in loggerMessages:
                 # get logger
@@ -9,6 +9,7 @@ import xml.dom.minidom
 
 
 from config import panda_config
+from ReplicaCache import replicaCache
 from pandalogger.LogWrapper import LogWrapper
 from pandalogger.PandaLogger import PandaLogger
 _log = PandaLogger().getLogger('broker_util')
@@ -218,6 +219,27 @@ def _getPFNFromMySQL(lfns,dq2url):
     return outStr
 
 
+# cache output of LFCclient. files are (lfn,guid) sent to LFCclient
+def _cacheLFCOutput(dq2url,storageKey,files,output,tmpLog):
+    try:
+        foundMap = {}
+        tmpItems = output.split('LFCRet :')
+        tmpItems.remove('')
+        for tmpItem in tmpItems:
+            exec "tmpLFNmap = %s" % tmpItem
+            foundMap.update(tmpLFNmap)
+    except:
+        # not cached when the output is unexpected
+        errType,errValue = sys.exc_info()[:2]
+        tmpLog.warning('_getPFNFromLFC could not cache output - %s %s' % (errType,errValue))
+        return
+    fileMap = {}
+    for tmpLFN,tmpGUID in files:
+        # None for missing files
+        fileMap[(tmpLFN,tmpGUID)] = foundMap.get(tmpLFN)
+    replicaCache.setBulk(dq2url,storageKey,fileMap)
+
+
 # get files from LFC
 def _getPFNFromLFC(lfns,dq2url,guids,storageName,scopeList=[],tmpLog=None):
     if tmpLog == None:
@@ -235,18 +257,33 @@ def _getPFNFromLFC(lfns,dq2url,guids,storageName,scopeList=[],tmpLog=None):
                                                                        str(lfns),str(scopeList)))
         tmpLog.error('_getPFNFromLFC failed')
         return outStr
+    # look up cache
+    useCache = replicaCache.isEnabled()
+    idxList = range(len(lfns))
+    if useCache:
+        storageKey = ','.join(storageName)
+        cachedMap,missFiles = replicaCache.getBulk(dq2url,storageKey,zip(lfns,guids))
+        cachedPFNs = {}
+        for (tmpLFN,tmpGUID),tmpPFNs in cachedMap.iteritems():
+            if tmpPFNs != None:
+                cachedPFNs[tmpLFN] = tmpPFNs
+        missFiles = set(missFiles)
+        idxList = [iLFN for iLFN in idxList if (lfns[iLFN],guids[iLFN]) in missFiles]
+        tmpLog.debug('_getPFNFromLFC %s/%s LFNs cached' % (len(lfns)-len(idxList),len(lfns)))
+        # cached files in the same format as LFCclient
+        outStr = 'LFCRet : %s ' % cachedPFNs
     # loop over all LFNs
-    iLFN = 0
     nLFN = 1000
     strFiles = ''    
-    outStr = ''
-    for iLFN in range(len(lfns)):
+    chunkFiles = []
+    for iIdx,iLFN in enumerate(idxList):
+        chunkFiles.append((lfns[iLFN],guids[iLFN]))
         if scopeList != []:
             strFiles  += '%s %s %s\n' % (lfns[iLFN],guids[iLFN],scopeList[iLFN]) 
         else:
             strFiles  += '%s %s\n' % (lfns[iLFN],guids[iLFN]) 
         # bulk operation
-        if (iLFN+1) % nLFN == 0 or (iLFN+1) >= len(lfns):
+        if (iIdx+1) % nLFN == 0 or (iIdx+1) >= len(idxList):
             # write to file
             inFileName = '%s/lfcin.%s'  % (panda_config.logdir,commands.getoutput('uuidgen'))
             ifile = open(inFileName,'w')
@@ -268,6 +305,8 @@ def _getPFNFromLFC(lfns,dq2url,guids,storageName,scopeList=[],tmpLog=None):
             tmpLog.debug(status)
             if status == 0:
                 outStr += output
+                if useCache:
+                    _cacheLFCOutput(dq2url,storageKey,chunkFiles,output,tmpLog)
             else:
                 tmpLog.error("_getPFNFromLFC : %s %s %s" % (dq2url,status,output))
                 # send message to logger
@@ -289,6 +328,9 @@ def _getPFNFromLFC(lfns,dq2url,guids,storageName,scopeList=[],tmpLog=None):
                 return status
             # reset
             strFiles = ''
+            chunkFiles = []
+    if useCache:
+        tmpLog.debug('_getPFNFromLFC cache stats %s' % str(replicaCache.getStats()))
     tmpLog.debug('_getPFNFromLFC done')
     # return
     return outStr
@@ -3,6 +3,7 @@ activate job
 
 '''
 
+from config import panda_config
 from pandalogger.PandaLogger import PandaLogger
 
 # logger
@@ -29,6 +30,18 @@ class Activator:
         _logger.debug("start: %s" % self.dataset.name)
         if self.dataset.status in ['completed','deleting','deleted'] and not self.enforce:
             _logger.debug("   skip: %s" % self.dataset.name)
+        elif hasattr(panda_config,'useSetBasedActivation') and panda_config.useSetBasedActivation == True:
+            # update input files and activate jobs in DB
+            ids = self.taskBuffer.activateJobsInDispatchBlock(self.dataset.name)
+            if ids == None:
+                # remaining jobs are activated by datasetManager
+                _logger.error("failed to activate jobs for %s" % self.dataset.name)
+            else:
+                _logger.debug("activated IDs: %s" % ids)
+            # update dataset in DB
+            if self.dataset.type == 'dispatch':
+                self.dataset.status = 'completed'        
+                self.taskBuffer.updateDatasets([self.dataset])
         else:
             # update input files
             ids = self.taskBuffer.updateInFilesReturnPandaIDs(self.dataset.name,'ready')
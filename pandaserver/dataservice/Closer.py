@@ -7,6 +7,7 @@ import re
 import sys
 import time
 import urllib
+import threading
 import commands
 from DDM import ddm
 import Notifier
@@ -31,6 +32,66 @@ def initLogger(pLogger):
     RetryMaker.initLogger(_logger)
     
 
+# dataset status which are not changed by Closer
+_skipStatusList = ['cleanup','tobeclosed','completed']
+
+
+# memo of dataset status which were finalized or found in skip status, shared by Closers
+class DatasetStateMemo:
+    # constructor
+    def __init__(self):
+        # name -> (status,timestamp)
+        self.states = {}
+        # lifetime of entries in sec, which is roughly one cycle of cron processes
+        self.lifetime = 600
+        if hasattr(panda_config,'closerMemoLifetime'):
+            self.lifetime = panda_config.closerMemoLifetime
+        self.maxSize = 100000
+        self.lock = threading.Lock()
+
+    # get status. None if unknown or expired
+    def get(self,name):
+        self.lock.acquire()
+        try:
+            if not self.states.has_key(name):
+                return None
+            status,timeStamp = self.states[name]
+            if time.time() - timeStamp > self.lifetime:
+                del self.states[name]
+                return None
+            return status
+        finally:
+            self.lock.release()
+
+    # set status
+    def set(self,name,status):
+        if self.lifetime <= 0:
+            return
+        self.lock.acquire()
+        try:
+            timeNow = time.time()
+            # drop expired entries
+            if len(self.states) >= self.maxSize:
+                for tmpName,(tmpStatus,timeStamp) in self.states.items():
+                    if timeNow - timeStamp > self.lifetime:
+                        del self.states[tmpName]
+                if len(self.states) >= self.maxSize:
+                    self.states = {}
+            self.states[name] = (status,timeNow)
+        finally:
+            self.lock.release()
+
+    # clear
+    def clear(self):
+        self.lock.acquire()
+        self.states = {}
+        self.lock.release()
+
+
+# Singleton
+datasetStateMemo = DatasetStateMemo()
+
+
 class Closer:
     # constructor
     def __init__(self,taskBuffer,destinationDBlocks,job,pandaDDM=False,datasetMap={}):
@@ -41,6 +102,7 @@ class Closer:
         self.pandaDDM = pandaDDM
         self.siteMapper = None
         self.datasetMap = datasetMap
+        self.memo = datasetStateMemo
         
     # to keep backward compatibility
     def start(self):
@@ -48,6 +110,22 @@ class Closer:
     def join(self):
         pass
 
+    # get datasets and the number of unfinished files for all destinationDBlocks in one go
+    def getDatasetStates(self):
+        names = set()
+        for destinationDBlock in self.destinationDBlocks:
+            if re.search('_tid[\d_]+$',destinationDBlock):
+                continue
+            if self.memo.get(destinationDBlock) in _skipStatusList:
+                continue
+            names.add(destinationDBlock)
+        if len(names) == 0:
+            return {}
+        retMap = self.taskBuffer.queryDatasetsWithUnfinishedFiles(names)
+        if retMap == None:
+            _logger.error('%s failed to get dataset states in bulk' % self.pandaID)
+        return retMap
+
     # main
     def run(self):
         try:
@@ -58,6 +136,8 @@ class Closer:
             disableNotifier = False
             firstIndvDS     = True
             finalStatusDS   = []
+            # None to query datasets one by one
+            dsStateMap = self.getDatasetStates()
             for destinationDBlock in self.destinationDBlocks:
                 dsList = []
                 _logger.debug('%s start %s' % (self.pandaID,destinationDBlock))
@@ -70,9 +150,19 @@ class Closer:
                     if re.search('_sub\d+$',destinationDBlock) == None and re.search('\.lib$',destinationDBlock) == None:
                         _logger.debug('%s skip HC %s' % (self.pandaID,destinationDBlock))                
                         continue
+                # skip datasets which were already finalized by other Closers
+                memoStatus = self.memo.get(destinationDBlock)
+                if memoStatus in _skipStatusList:
+                    _logger.debug('%s skip %s due to %s in memo' % (self.pandaID,destinationDBlock,memoStatus))
+                    continue
                 # query dataset
                 if self.datasetMap.has_key(destinationDBlock):
                     dataset = self.datasetMap[destinationDBlock]
+                elif dsStateMap != None:
+                    if dsStateMap.has_key(destinationDBlock):
+                        dataset = dsStateMap[destinationDBlock][0]
+                    else:
+                        dataset = None
                 else:
                     dataset = self.taskBuffer.queryDatasetWithMap({'name':destinationDBlock})
                 if dataset == None:
@@ -80,15 +170,19 @@ class Closer:
                     flagComplete = False
                     continue
                 # skip tobedeleted/tobeclosed 
-                if dataset.status in ['cleanup','tobeclosed','completed']:
+                if dataset.status in _skipStatusList:
                     _logger.debug('%s skip %s due to %s' % (self.pandaID,destinationDBlock,dataset.status))
+                    self.memo.set(destinationDBlock,dataset.status)
                     continue
                 dsList.append(dataset)
                 # sort
                 dsList.sort()
                 # count number of completed files
-                notFinish = self.taskBuffer.countFilesWithMap({'destinationDBlock':destinationDBlock,
-                                                               'status':'unknown'})
+                if dsStateMap != None and dsStateMap.has_key(destinationDBlock):
+                    notFinish = dsStateMap[destinationDBlock][1]
+                else:
+                    notFinish = self.taskBuffer.countFilesWithMap({'destinationDBlock':destinationDBlock,
+                                                                   'status':'unknown'})
                 if notFinish < 0:
                     _logger.error('%s Invalid DB return : %s' % (self.pandaID,notFinish))
                     flagComplete = False                
@@ -124,9 +218,14 @@ class Closer:
                     # set status
                     dataset.status = finalStatus
                     # update dataset in DB
-                    retT = self.taskBuffer.updateDatasets(dsList,withLock=True,withCriteria="status<>:crStatus AND status<>:lockStatus ",
-                                                          criteriaMap={':crStatus':finalStatus,':lockStatus':'locked'})
+                    if memoStatus == finalStatus:
+                        # already updated by another Closer
+                        retT = []
+                    else:
+                        retT = self.taskBuffer.updateDatasets(dsList,withLock=True,withCriteria="status<>:crStatus AND status<>:lockStatus ",
+                                                              criteriaMap={':crStatus':finalStatus,':lockStatus':'locked'})
                     if len(retT) > 0 and retT[0]==1:
+                        self.memo.set(destinationDBlock,finalStatus)
                         finalStatusDS += dsList
                         # close user datasets
                         if self.job.prodSourceLabel in ['user'] and self.job.destinationDBlock.endswith('/') \
@@ -9,8 +9,8 @@ import types
 import commands
 import hashlib
 from config import panda_config
+from DDMClientPool import ddmClientPool,PooledDQ2Module
 
-from rucio.client import Client as RucioClient
 from rucio.common.exception import UnsupportedOperation,DataIdentifierNotFound,\
     FileAlreadyExists,Duplicate,DataIdentifierAlreadyExists,DuplicateRule
 
@@ -176,7 +176,10 @@ class DDM:
         self.usingNativeDQ2 = True
     # getter    
     def __getattr__(self,moduleName):
-        if not self.usingNativeDQ2:
+        if ddmClientPool.isEnabled() or ddmClientPool.isFake():
+            # run dq2 command with a pooled client
+            return PooledDQ2Module(moduleName)
+        elif not self.usingNativeDQ2:
             # run dq2 comamnd in another session
             return _DQModule(moduleName)
         else:
@@ -375,6 +378,11 @@ class RucioAPI:
         pass
 
 
+    # get client. pooled clients are reused when the client pool is enabled
+    def getClient(self):
+        return ddmClientPool.getRucioClient()
+
+
     # extract scope
     def extract_scope(self,dsn):
         if ':' in dsn:
@@ -400,7 +408,7 @@ class RucioAPI:
                 file['adler32'] = checksum[3:]
             files.append(file)
         # register dataset
-        client = RucioClient()
+        client = self.getClient()
         try:
             scope,dsn = self.extract_scope(dsn)
             client.add_dataset(scope=scope, name=dsn)
@@ -441,7 +449,7 @@ class RucioAPI:
         rses.sort()
         location = '|'.join(rses)
         # check if a replication rule already exists
-        client = RucioClient()
+        client = self.getClient()
         # owner
         if owner == None:
             owner = client.account
@@ -518,7 +526,7 @@ class RucioAPI:
                     attachment['rse'] = rse
                 attachmentList.append(attachment)
         # add files
-        client = RucioClient()
+        client = self.getClient()
         return client.add_files_to_datasets(attachmentList,ignore_duplicate=True)
 
 
@@ -527,7 +535,7 @@ class RucioAPI:
     def getRseUsage(self,rse,src='srm'):
         retMap = {}
         try:
-            client = RucioClient()
+            client = self.getClient()
             itr = client.get_rse_usage(rse)
             # look for srm
             for item in itr:
@@ -561,7 +569,7 @@ class RucioAPI:
         scope,dsn = self.extract_scope(datasetName)
         try:
             # get replicas
-            client = RucioClient()
+            client = self.getClient()
             itr = client.list_dataset_replicas(scope,dsn)
             for item in itr:
                 rse = item["rse"]
@@ -575,10 +583,37 @@ class RucioAPI:
 
 
 
+    # list replicas of multiple datasets in one call. return a map of datasetName -> map of replicas
+    def listDatasetReplicasBulk(self,datasetNames):
+        retMap = {}
+        didMap = {}
+        dids = []
+        for datasetName in datasetNames:
+            scope,dsn = self.extract_scope(datasetName)
+            didMap[(scope,dsn)] = datasetName
+            dids.append({'scope':scope,'name':dsn})
+            retMap[datasetName] = {}
+        try:
+            # get replicas
+            client = self.getClient()
+            itr = client.list_dataset_replicas_bulk(dids)
+            for item in itr:
+                datasetName = didMap[(item['scope'],item['name'])]
+                rse = item["rse"]
+                retMap[datasetName][rse] = [{'total':item["length"],
+                                             'found':item["available_length"],
+                                             'immutable':1}]
+            return 0,retMap
+        except:
+            errType,errVale = sys.exc_info()[:2]
+            return 1,'%s %s' % (errType,errVale)
+
+
+
     # set metadata
     def setMetaData(self,dsn,metadata=None):
         # register dataset
-        client = RucioClient()
+        client = self.getClient()
         try:
             scope,dsn = self.extract_scope(dsn)
             for tmpKey,tmpValue in metadata.iteritems():
@@ -593,7 +628,7 @@ class RucioAPI:
     # get metadata
     def getMetaData(self,dsn):
         # register dataset
-        client = RucioClient()
+        client = self.getClient()
         try:
             scope,dsn = self.extract_scope(dsn)
             return True,client.get_metadata(scope,dsn)
@@ -608,7 +643,7 @@ class RucioAPI:
     # check if dataset exists
     def checkDatasetExist(self,dsn):
         # register dataset
-        client = RucioClient()
+        client = self.getClient()
         try:
             scope,dsn = self.extract_scope(dsn)
             return True
@@ -620,7 +655,7 @@ class RucioAPI:
     # close dataset
     def closeDataset(self,dsn):
         # register dataset
-        client = RucioClient()
+        client = self.getClient()
         try:
             scope,dsn = self.extract_scope(dsn)
             client.set_status(scope,dsn,open=False)
@@ -633,7 +668,7 @@ class RucioAPI:
     # list file replicas
     def listFileReplicas(self,scopes,lfns):
         try:
-            client = RucioClient()
+            client = self.getClient()
             dids = []
             iGUID = 0
             nGUID = 1000
@@ -658,7 +693,7 @@ class RucioAPI:
     def listFilesInDataset(self,datasetName,long=False,fileList=None):
         # extract scope from dataset
         scope,dsn = self.extract_scope(datasetName)
-        client = RucioClient()
+        client = self.getClient()
         return_dict = {}
         for x in client.list_files(scope, dsn, long=long):
             tmpLFN = str(x['name'])
@@ -683,7 +718,7 @@ class RucioAPI:
 
     # register files
     def registerFiles(self,files,rse):
-        client = RucioClient()
+        client = self.getClient()
         try:
             # add replicas
             client.add_replicas(files=files,rse=rse)
@@ -701,7 +736,7 @@ class RucioAPI:
     def deleteFilesFromDataset(self,datasetName,files):
         # extract scope from dataset
         scope,dsn = self.extract_scope(datasetName)
-        client = RucioClient()
+        client = self.getClient()
         try:
             # delete files
             client.detach_dids(scope=scope,name=dsn,dids=files)
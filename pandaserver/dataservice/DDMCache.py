@@ -0,0 +1,162 @@
+"""
+process-wide cache of DDM lookups shared by Setupper, TaskAssigner and PD2P runs
+
+Entries are grouped by namespace and keyed by dataset name, with a lifetime
+per namespace. The least recently used entries are dropped when the number of
+entries or the total number of cached files exceeds the limits. Entries of a
+dataset are invalidated when Setupper registers or modifies the dataset
+
+"""
+
+import copy
+import time
+import threading
+
+from config import panda_config
+from pandalogger.PandaLogger import PandaLogger
+from collections import OrderedDict
+
+# logger
+_logger = PandaLogger().getLogger('DDMCache')
+
+
+class DDMCache:
+
+    # constructor
+    def __init__(self):
+        # lifetime in sec per namespace
+        lifetime = 600
+        if hasattr(panda_config,'ddmCacheLifetime'):
+            lifetime = panda_config.ddmCacheLifetime
+        replicaLifetime = 300
+        if hasattr(panda_config,'ddmCacheReplicaLifetime'):
+            replicaLifetime = panda_config.ddmCacheReplicaLifetime
+        self.lifetimes = {'vuid'       : lifetime,
+                          'files'      : lifetime,
+                          'containers' : lifetime,
+                          'replicas'   : replicaLifetime,
+                          'metadata'   : replicaLifetime,
+                          # raw responses for PD2P
+                          'pd2pContainers'      : lifetime,
+                          'pd2pFiles'           : lifetime,
+                          'pd2pMetadata'        : lifetime,
+                          'pd2pReplicaMetadata' : replicaLifetime,
+                          'closeSites'          : lifetime,
+                          'rseUsage'            : replicaLifetime,
+                          # for TaskAssigner
+                          'toaProperties'       : lifetime,
+                          }
+        # size limits
+        self.maxEntries = 10000
+        if hasattr(panda_config,'ddmCacheMaxEntries'):
+            self.maxEntries = panda_config.ddmCacheMaxEntries
+        self.maxFiles = 1000000
+        if hasattr(panda_config,'ddmCacheMaxFiles'):
+            self.maxFiles = panda_config.ddmCacheMaxFiles
+        # (namespace,datasetName,subKey) -> (value,timestamp,nFiles). the last one is the most recent
+        self.entries = OrderedDict()
+        # datasetName -> set of entry keys
+        self.index = {}
+        # total number of cached files
+        self.nFiles = 0
+        # hit/miss counters per namespace
+        self.counters = {}
+        for namespace in self.lifetimes.keys():
+            self.counters[namespace] = {'hits':0,'misses':0}
+        # lock
+        self.lock = threading.Lock()
+
+
+    # check if enabled
+    def isEnabled(self):
+        return hasattr(panda_config,'useDDMCache') and panda_config.useDDMCache == True
+
+
+    # remove an entry. must be called with the lock
+    def _remove(self,key):
+        value,timeStamp,nFiles = self.entries.pop(key)
+        self.nFiles -= nFiles
+        datasetName = key[1]
+        if self.index.has_key(datasetName):
+            self.index[datasetName].discard(key)
+            if len(self.index[datasetName]) == 0:
+                del self.index[datasetName]
+
+
+    # get a copy of the cached value. None if not cached or expired
+    def get(self,namespace,datasetName,subKey=None):
+        if not self.isEnabled():
+            return None
+        key = (namespace,datasetName,subKey)
+        self.lock.acquire()
+        try:
+            if self.entries.has_key(key):
+                value,timeStamp,nFiles = self.entries[key]
+                if time.time() - timeStamp <= self.lifetimes[namespace]:
+                    # move to the end as the most recent
+                    del self.entries[key]
+                    self.entries[key] = (value,timeStamp,nFiles)
+                    self.counters[namespace]['hits'] += 1
+                    # callers modify returned objects in place
+                    return copy.deepcopy(value)
+                self._remove(key)
+            self.counters[namespace]['misses'] += 1
+            return None
+        finally:
+            self.lock.release()
+
+
+    # set value. nFiles is the number of files in the value to limit the memory usage
+    def set(self,namespace,datasetName,value,subKey=None,nFiles=0):
+        if not self.isEnabled():
+            return
+        key = (namespace,datasetName,subKey)
+        self.lock.acquire()
+        try:
+            if self.entries.has_key(key):
+                self._remove(key)
+            # too large
+            if nFiles > self.maxFiles:
+                return
+            self.entries[key] = (copy.deepcopy(value),time.time(),nFiles)
+            self.nFiles += nFiles
+            self.index.setdefault(datasetName,set())
+            self.index[datasetName].add(key)
+            # drop least recently used entries
+            while len(self.entries) > self.maxEntries or self.nFiles > self.maxFiles:
+                self._remove(self.entries.iterkeys().next())
+        finally:
+            self.lock.release()
+
+
+    # invalidate entries of a dataset. namespaces=None for all namespaces
+    def invalidate(self,datasetName,namespaces=None):
+        self.lock.acquire()
+        try:
+            if not self.index.has_key(datasetName):
+                return
+            for key in list(self.index[datasetName]):
+                if namespaces == None or key[0] in namespaces:
+                    self._remove(key)
+        finally:
+            self.lock.release()
+
+
+    # get stats
+    def getStats(self):
+        self.lock.acquire()
+        try:
+            retMap = {'nEntries':len(self.entries),'nFiles':self.nFiles}
+            for namespace,counter in self.counters.iteritems():
+                retMap[namespace] = dict(counter)
+                nLookup = counter['hits'] + counter['misses']
+                if nLookup > 0:
+                    retMap[namespace]['hitRate'] = round(float(counter['hits']) / float(nLookup),3)
+            return retMap
+        finally:
+            self.lock.release()
+
+
+
+# Singleton
+ddmCache = DDMCache()
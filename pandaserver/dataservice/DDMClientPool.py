@@ -0,0 +1,360 @@
+"""
+pool of in-process DDM clients
+
+DQ2 API objects and rucio clients are authenticated once and then reused by
+checking them out exclusively from a bounded pool, since they are not
+thread-safe. Clients are recreated after a lifetime to renew tokens and are
+discarded when they fail with non-DDM errors. The fake backend in
+DDMFakeBackend is used instead of DQ2/rucio when ddmBackend = fake
+
+"""
+
+import sys
+import time
+import types
+import Queue
+import threading
+
+from config import panda_config
+from pandalogger.PandaLogger import PandaLogger
+
+# logger
+_logger = PandaLogger().getLogger('DDMClientPool')
+
+
+# check if an exception comes from DDM itself rather than from the client or connection
+def _isDDMError(errType):
+    try:
+        if errType.__module__.startswith('rucio.common.exception'):
+            return True
+        if errType.__name__.startswith('DQ'):
+            return True
+    except:
+        pass
+    return False
+
+
+# pooled client
+class _PoolEntry:
+    # constructor
+    def __init__(self,client):
+        self.client = client
+        self.created = time.time()
+
+
+
+# bounded pool of clients of one kind
+class ClientPool:
+    # constructor
+    def __init__(self,name,factory,maxSize,lifetime):
+        self.name = name
+        self.factory = factory
+        self.maxSize = maxSize
+        self.lifetime = lifetime
+        # idle clients. the last one is the most recent
+        self.idle = []
+        # number of clients checked out or being created
+        self.nUsed = 0
+        self.cond = threading.Condition()
+        self.stats = {'nCreated':0,'nReused':0,'nDiscarded':0,'nWaited':0}
+
+
+    # check out a client. RuntimeError on timeout
+    def acquire(self,timeout=None):
+        if timeout != None:
+            deadline = time.time() + timeout
+        self.cond.acquire()
+        try:
+            waited = False
+            while True:
+                # reuse idle client
+                while self.idle != []:
+                    entry = self.idle.pop()
+                    if time.time() - entry.created > self.lifetime:
+                        self.stats['nDiscarded'] += 1
+                        continue
+                    self.nUsed += 1
+                    self.stats['nReused'] += 1
+                    return entry
+                # make new one
+                if self.nUsed < self.maxSize:
+                    self.nUsed += 1
+                    break
+                # wait for release
+                if not waited:
+                    self.stats['nWaited'] += 1
+                    waited = True
+                if timeout == None:
+                    self.cond.wait()
+                else:
+                    timeLeft = deadline - time.time()
+                    if timeLeft <= 0:
+                        raise RuntimeError,'timeout to get {0} client after {1}sec'.format(self.name,timeout)
+                    self.cond.wait(timeLeft)
+        finally:
+            self.cond.release()
+        # authenticate outside the lock
+        try:
+            entry = _PoolEntry(self.factory())
+        except:
+            self.cond.acquire()
+            self.nUsed -= 1
+            self.cond.notify()
+            self.cond.release()
+            raise
+        self.cond.acquire()
+        self.stats['nCreated'] += 1
+        self.cond.release()
+        return entry
+
+
+    # return a client. broken clients are dropped
+    def release(self,entry,broken=False):
+        self.cond.acquire()
+        try:
+            self.nUsed -= 1
+            if broken:
+                self.stats['nDiscarded'] += 1
+            else:
+                self.idle.append(entry)
+            self.cond.notify()
+        finally:
+            self.cond.release()
+
+
+    # call a method of a pooled client
+    def call(self,methodName,args,kwargs,timeout=None):
+        entry = self.acquire(timeout)
+        broken = False
+        try:
+            try:
+                retVal = apply(getattr(entry.client,methodName),args,kwargs)
+                # consume iterators before the client is reused by another thread
+                if isinstance(retVal,types.GeneratorType):
+                    retVal = list(retVal)
+                return retVal
+            except:
+                broken = not _isDDMError(sys.exc_info()[0])
+                raise
+        finally:
+            self.release(entry,broken)
+
+
+    # get stats
+    def getStats(self):
+        self.cond.acquire()
+        try:
+            retMap = dict(self.stats)
+            retMap['nUsed'] = self.nUsed
+            retMap['nIdle'] = len(self.idle)
+            return retMap
+        finally:
+            self.cond.release()
+
+
+
+# rucio client which checks out a pooled client for each method call
+class PooledRucioClient:
+    # constructor
+    def __init__(self,pool,timeout):
+        self._pool = pool
+        self._timeout = timeout
+
+
+    # getter
+    def __getattr__(self,name):
+        if name.startswith('__'):
+            raise AttributeError,name
+        entry = self._pool.acquire(self._timeout)
+        try:
+            attr = getattr(entry.client,name)
+        finally:
+            self._pool.release(entry)
+        if not callable(attr):
+            return attr
+        pool = self._pool
+        timeout = self._timeout
+        def method(*args,**kwargs):
+            return pool.call(name,args,kwargs,timeout)
+        return method
+
+
+
+# pooled DQ2 method with the same return values as _DQMethod
+class PooledDQ2Method:
+    # constructor
+    def __init__(self,moduleName,methodName):
+        self.moduleName = moduleName
+        self.methodName = methodName
+
+
+    # method emulation
+    def __call__(self,*args,**kwargs):
+        try:
+            backend = 'rucio'
+            if 'force_backend' in kwargs:
+                if kwargs['force_backend'] != None:
+                    backend = kwargs['force_backend']
+                del kwargs['force_backend']
+            # main method has disappeared since 0.3
+            args = list(args)
+            methodName = self.methodName
+            if methodName == 'main':
+                methodName = args[0]
+                args.pop(0)
+            pool = ddmClientPool.getDQ2Pool(backend)
+            entry = pool.acquire(ddmClientPool.timeout)
+            broken = False
+            try:
+                try:
+                    if self.moduleName in ['DQ2','DQ2_iter']:
+                        methodObj = getattr(entry.client,methodName)
+                    else:
+                        methodObj = getattr(getattr(entry.client,self.moduleName),methodName)
+                    retVal = apply(methodObj,args,kwargs)
+                    # one item per line as _DQMethod
+                    if self.moduleName == 'DQ2_iter':
+                        strRet = '\n'.join([str(item) for item in retVal])
+                    else:
+                        strRet = str(retVal)
+                except:
+                    broken = not _isDDMError(sys.exc_info()[0])
+                    raise
+            finally:
+                pool.release(entry,broken)
+            return 0,strRet
+        except:
+            errType,errVale = sys.exc_info()[:2]
+            return 1,'%s %s' % (errType,errVale)
+
+
+
+# pooled DQ2 module
+class PooledDQ2Module:
+    # constructor
+    def __init__(self,moduleName):
+        self.moduleName = moduleName
+
+    # factory method
+    def __getattr__(self,methodName):
+        return PooledDQ2Method(self.moduleName,methodName)
+
+
+
+# manager of client pools
+class DDMClientPool:
+    # constructor
+    def __init__(self):
+        # max number of clients per backend
+        self.maxSize = 4
+        if hasattr(panda_config,'ddmClientPoolSize'):
+            self.maxSize = panda_config.ddmClientPoolSize
+        # clients are recreated after this period in sec to renew tokens
+        self.lifetime = 3000
+        if hasattr(panda_config,'ddmClientLifetime'):
+            self.lifetime = panda_config.ddmClientLifetime
+        # how long callers wait for a free client in sec
+        self.timeout = 300
+        if hasattr(panda_config,'ddmClientWaitTimeout'):
+            self.timeout = panda_config.ddmClientWaitTimeout
+        # backend name -> pool
+        self.pools = {}
+        self.lock = threading.Lock()
+
+
+    # check if enabled
+    def isEnabled(self):
+        return hasattr(panda_config,'useDDMClientPool') and panda_config.useDDMClientPool == True
+
+
+    # check if the fake backend is used
+    def isFake(self):
+        return hasattr(panda_config,'ddmBackend') and panda_config.ddmBackend == 'fake'
+
+
+    # get pool
+    def _getPool(self,name,factory):
+        self.lock.acquire()
+        try:
+            if not self.pools.has_key(name):
+                self.pools[name] = ClientPool(name,factory,self.maxSize,self.lifetime)
+            return self.pools[name]
+        finally:
+            self.lock.release()
+
+
+    # get DQ2 pool
+    def getDQ2Pool(self,backend):
+        def factory():
+            if self.isFake():
+                from DDMFakeBackend import FakeDQ2
+                return FakeDQ2()
+            from dq2.clientapi import DQ2
+            return DQ2.DQ2(force_backend=backend)
+        return self._getPool('DQ2:{0}'.format(backend),factory)
+
+
+    # make new rucio client
+    def newRucioClient(self):
+        if self.isFake():
+            from DDMFakeBackend import FakeRucioClient
+            return FakeRucioClient()
+        from rucio.client import Client as RucioClient
+        return RucioClient()
+
+
+    # get rucio client
+    def getRucioClient(self):
+        if not self.isEnabled():
+            return self.newRucioClient()
+        pool = self._getPool('rucio',self.newRucioClient)
+        return PooledRucioClient(pool,self.timeout)
+
+
+    # get stats
+    def getStats(self):
+        self.lock.acquire()
+        pools = self.pools.items()
+        self.lock.release()
+        retMap = {}
+        for name,pool in pools:
+            retMap[name] = pool.getStats()
+        return retMap
+
+
+
+# run DDM calls in parallel. calls is a list of (function,args,kwargs) and
+# the return is a list of (isOK,return value or error message) in the same order
+def runParallel(calls,nThreads=None):
+    if nThreads == None:
+        nThreads = ddmClientPool.maxSize
+    nThreads = max(1,min(nThreads,len(calls)))
+    results = [None] * len(calls)
+    queue = Queue.Queue()
+    for idx in range(len(calls)):
+        queue.put(idx)
+    def worker():
+        while True:
+            try:
+                idx = queue.get_nowait()
+            except Queue.Empty:
+                return
+            func,args,kwargs = calls[idx]
+            try:
+                results[idx] = (True,apply(func,args,kwargs))
+            except:
+                errType,errVale = sys.exc_info()[:2]
+                results[idx] = (False,'%s %s' % (errType,errVale))
+    threads = []
+    for i in range(nThreads):
+        thr = threading.Thread(target=worker)
+        thr.start()
+        threads.append(thr)
+    for thr in threads:
+        thr.join()
+    return results
+
+
+
+# Singleton
+ddmClientPool = DDMClientPool()
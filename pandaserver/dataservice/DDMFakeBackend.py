@@ -0,0 +1,693 @@
+"""
+in-memory fake DDM backend for testing
+
+FakeDQ2 and FakeRucioClient emulate the subset of the DQ2 API and the rucio
+client used by the panda server on top of one shared store, so that datasets
+registered through one API are visible through the other. It is enabled by
+ddmBackend = fake together with the client pool in DDMClientPool
+
+"""
+
+import time
+import uuid
+import hashlib
+import threading
+
+from rucio.common.exception import UnsupportedOperation,DataIdentifierNotFound,\
+    FileAlreadyExists,DataIdentifierAlreadyExists,DuplicateRule
+
+
+# exceptions with the same names as DQ2 since callers look for them in the output
+class DQUnknownDatasetException(Exception):
+    pass
+
+class DQDatasetExistsException(Exception):
+    pass
+
+class DQFrozenDatasetException(Exception):
+    pass
+
+class DQUnknownReplicaException(Exception):
+    pass
+
+
+
+# shared store
+class FakeDDMStore:
+    # constructor
+    def __init__(self):
+        self.lock = threading.RLock()
+        self.reset()
+
+
+    # clear all data
+    def reset(self):
+        self.lock.acquire()
+        # name -> dataset
+        self.datasets = {}
+        # name -> list of dataset names
+        self.containers = {}
+        # guid -> file
+        self.files = {}
+        # list of rules
+        self.rules = []
+        # number of calls per method
+        self.calls = {}
+        self.lock.release()
+
+
+    # strip scope and trailing /
+    def normalize(self,name):
+        if ':' in name:
+            name = name.split(':')[-1]
+        if name.endswith('/'):
+            name = name[:-1]
+        return name
+
+
+    # get scope in the same way as rucioAPI.extract_scope
+    def getScope(self,name):
+        if ':' in name:
+            return name.split(':')[0]
+        scope = name.split('.')[0]
+        if name.startswith('user') or name.startswith('group'):
+            scope = '.'.join(name.split('.')[0:2])
+        return scope
+
+
+    # count a call
+    def count(self,methodName):
+        self.calls.setdefault(methodName,0)
+        self.calls[methodName] += 1
+
+
+    # add dataset
+    def addDataset(self,name,files=[],locations=[],metadata={}):
+        self.lock.acquire()
+        try:
+            origName = name
+            name = self.normalize(name)
+            if self.datasets.has_key(name):
+                raise DQDatasetExistsException,'dataset %s already exists' % name
+            vuid = hashlib.md5(name).hexdigest()
+            vuid = '%s-%s-%s-%s-%s' % (vuid[0:8],vuid[8:12],vuid[12:16],vuid[16:20],vuid[20:32])
+            self.datasets[name] = {'vuid':vuid,
+                                   'state':'open',
+                                   'guids':[],
+                                   'locations':{},
+                                   'subscriptions':{},
+                                   'metadata':dict(metadata),
+                                   }
+            self.addFiles(origName,files)
+            for location in locations:
+                self.datasets[name]['locations'][location] = {'archived':'primary','pin_lifetime':''}
+            return self.datasets[name]
+        finally:
+            self.lock.release()
+
+
+    # get dataset
+    def getDataset(self,name):
+        name = self.normalize(name)
+        if not self.datasets.has_key(name):
+            raise DQUnknownDatasetException,'dataset %s not found' % name
+        return self.datasets[name]
+
+
+    # add files to a dataset. each file is a dict with lfn, guid, size, checksum, scope, events
+    def addFiles(self,name,files):
+        self.lock.acquire()
+        try:
+            dataset = self.getDataset(name)
+            if dataset['state'] == 'frozen':
+                raise DQFrozenDatasetException,'dataset %s is frozen' % name
+            for tmpFile in files:
+                tmpFile = dict(tmpFile)
+                if not tmpFile.has_key('guid') or tmpFile['guid'] in [None,'']:
+                    tmpFile['guid'] = str(uuid.uuid4())
+                tmpFile.setdefault('size',0)
+                tmpFile.setdefault('checksum',None)
+                tmpFile.setdefault('scope',self.getScope(name))
+                tmpFile.setdefault('events',None)
+                tmpFile.setdefault('lumiblocknr',None)
+                self.files[tmpFile['guid']] = tmpFile
+                if not tmpFile['guid'] in dataset['guids']:
+                    dataset['guids'].append(tmpFile['guid'])
+        finally:
+            self.lock.release()
+
+
+    # get files in a dataset
+    def getFiles(self,name):
+        return [self.files[guid] for guid in self.getDataset(name)['guids']]
+
+
+
+# DQ2 API
+class FakeDQ2:
+    # constructor
+    def __init__(self,force_backend=None):
+        self.store = fakeStore
+
+
+    # list datasets
+    def listDatasets(self,name,version=0,onlyNames=False):
+        fakeStore.lock.acquire()
+        try:
+            fakeStore.count('listDatasets')
+            retMap = {}
+            normName = fakeStore.normalize(name)
+            if fakeStore.containers.has_key(normName):
+                retMap[name] = {'vuids':[hashlib.md5(normName).hexdigest()],'duid':None}
+            elif fakeStore.datasets.has_key(normName):
+                vuid = fakeStore.datasets[normName]['vuid']
+                retMap[name] = {'vuids':[vuid],'duid':vuid}
+            return retMap
+        finally:
+            fakeStore.lock.release()
+
+
+    # register dataset
+    def registerNewDataset(self,name,lfns=[],guids=[],sizes=[],checksums=[],*args,**kwargs):
+        fakeStore.lock.acquire()
+        try:
+            fakeStore.count('registerNewDataset')
+            files = []
+            for lfn,guid,size,checksum in zip(lfns,guids,sizes,checksums):
+                files.append({'lfn':lfn,'guid':guid,'size':size,'checksum':checksum})
+            dataset = fakeStore.addDataset(name,files)
+            return {'duid':dataset['vuid'],'vuid':dataset['vuid'],'version':1}
+        finally:
+            fakeStore.lock.release()
+
+
+    # register files
+    def registerFilesInDatasets(self,idMap,*args,**kwargs):
+        fakeStore.lock.acquire()
+        try:
+            fakeStore.count('registerFilesInDatasets')
+            for name,files in idMap.iteritems():
+                fakeStore.addFiles(name,files)
+        finally:
+            fakeStore.lock.release()
+
+
+    # list files
+    def listFilesInDataset(self,name,*args,**kwargs):
+        fakeStore.lock.acquire()
+        try:
+            fakeStore.count('listFilesInDataset')
+            retMap = {}
+            for tmpFile in fakeStore.getFiles(name):
+                retMap[tmpFile['guid']] = {'lfn':tmpFile['lfn'],
+                                           'guid':tmpFile['guid'],
+                                           'filesize':tmpFile['size'],
+                                           'checksum':tmpFile['checksum'],
+                                           'scope':tmpFile['scope'],
+                                           'events':tmpFile['events']}
+            return retMap,{'numbfiles':len(retMap),'lastdate':time.strftime('%Y-%m-%d %H:%M:%S')}
+        finally:
+            fakeStore.lock.release()
+
+
+    # get number of files
+    def getNumberOfFiles(self,name,*args,**kwargs):
+        fakeStore.lock.acquire()
+        try:
+            fakeStore.count('getNumberOfFiles')
+            return len(fakeStore.getDataset(name)['guids'])
+        finally:
+            fakeStore.lock.release()
+
+
+    # freeze
+    def freezeDataset(self,name,*args,**kwargs):
+        fakeStore.lock.acquire()
+        try:
+            fakeStore.count('freezeDataset')
+            fakeStore.getDataset(name)['state'] = 'frozen'
+        finally:
+            fakeStore.lock.release()
+
+
+    # erase
+    def eraseDataset(self,name,*args,**kwargs):
+        fakeStore.lock.acquire()
+        try:
+            fakeStore.count('eraseDataset')
+            fakeStore.getDataset(name)
+            del fakeStore.datasets[fakeStore.normalize(name)]
+        finally:
+            fakeStore.lock.release()
+
+
+    # register container
+    def registerContainer(self,name,datasets=[],*args,**kwargs):
+        fakeStore.lock.acquire()
+        try:
+            fakeStore.count('registerContainer')
+            name = fakeStore.normalize(name)
+            if fakeStore.containers.has_key(name):
+                raise DQDatasetExistsException,'container %s already exists' % name
+            fakeStore.containers[name] = []
+            for dataset in datasets:
+                fakeStore.containers[name].append(fakeStore.normalize(dataset))
+        finally:
+            fakeStore.lock.release()
+
+
+    # add datasets to container
+    def registerDatasetsInContainer(self,name,datasets,*args,**kwargs):
+        fakeStore.lock.acquire()
+        try:
+            fakeStore.count('registerDatasetsInContainer')
+            name = fakeStore.normalize(name)
+            if not fakeStore.containers.has_key(name):
+                raise DQUnknownDatasetException,'container %s not found' % name
+            for dataset in datasets:
+                dataset = fakeStore.normalize(dataset)
+                if not dataset in fakeStore.containers[name]:
+                    fakeStore.containers[name].append(dataset)
+        finally:
+            fakeStore.lock.release()
+
+
+    # list datasets in container
+    def listDatasetsInContainer(self,name,*args,**kwargs):
+        fakeStore.lock.acquire()
+        try:
+            fakeStore.count('listDatasetsInContainer')
+            name = fakeStore.normalize(name)
+            if not fakeStore.containers.has_key(name):
+                raise DQUnknownDatasetException,'container %s not found' % name
+            return list(fakeStore.containers[name])
+        finally:
+            fakeStore.lock.release()
+
+
+    # register location
+    def registerDatasetLocation(self,name,location,*args,**kwargs):
+        fakeStore.lock.acquire()
+        try:
+            fakeStore.count('registerDatasetLocation')
+            fakeStore.getDataset(name)['locations'].setdefault(location,{'archived':'primary','pin_lifetime':''})
+        finally:
+            fakeStore.lock.release()
+
+
+    # delete replicas
+    def deleteDatasetReplicas(self,name,locations,*args,**kwargs):
+        fakeStore.lock.acquire()
+        try:
+            fakeStore.count('deleteDatasetReplicas')
+            dataset = fakeStore.getDataset(name)
+            for location in locations:
+                if dataset['locations'].has_key(location):
+                    del dataset['locations'][location]
+        finally:
+            fakeStore.lock.release()
+
+
+    # get replica metadata
+    def listMetaDataReplica(self,location,name):
+        fakeStore.lock.acquire()
+        try:
+            fakeStore.count('listMetaDataReplica')
+            dataset = fakeStore.getDataset(name)
+            if not dataset['locations'].has_key(location):
+                raise DQUnknownReplicaException,'ReplicaNotFound %s at %s' % (name,location)
+            return dict(dataset['locations'][location])
+        finally:
+            fakeStore.lock.release()
+
+
+    # set replica metadata
+    def setReplicaMetaDataAttribute(self,name,location,attrname,attrvalue):
+        fakeStore.lock.acquire()
+        try:
+            fakeStore.count('setReplicaMetaDataAttribute')
+            dataset = fakeStore.getDataset(name)
+            if not dataset['locations'].has_key(location):
+                raise DQUnknownReplicaException,'ReplicaNotFound %s at %s' % (name,location)
+            dataset['locations'][location][attrname] = attrvalue
+        finally:
+            fakeStore.lock.release()
+
+
+    # set metadata
+    def setMetaDataAttribute(self,name,attrname,attrvalue):
+        fakeStore.lock.acquire()
+        try:
+            fakeStore.count('setMetaDataAttribute')
+            fakeStore.getDataset(name)['metadata'][attrname] = attrvalue
+        finally:
+            fakeStore.lock.release()
+
+
+    # get metadata
+    def getMetaDataAttribute(self,name,attrnames):
+        fakeStore.lock.acquire()
+        try:
+            fakeStore.count('getMetaDataAttribute')
+            metadata = fakeStore.getDataset(name)['metadata']
+            retMap = {}
+            for attrname in attrnames:
+                if attrname == 'state':
+                    retMap[attrname] = fakeStore.getDataset(name)['state']
+                else:
+                    retMap[attrname] = metadata.get(attrname)
+            return retMap
+        finally:
+            fakeStore.lock.release()
+
+
+    # subscribe
+    def registerDatasetSubscription(self,name,location,*args,**kwargs):
+        fakeStore.lock.acquire()
+        try:
+            fakeStore.count('registerDatasetSubscription')
+            fakeStore.getDataset(name)['subscriptions'][location] = time.time()
+        finally:
+            fakeStore.lock.release()
+
+
+    # list subscriptions
+    def listSubscriptions(self,name,*args,**kwargs):
+        fakeStore.lock.acquire()
+        try:
+            fakeStore.count('listSubscriptions')
+            return fakeStore.getDataset(name)['subscriptions'].keys()
+        finally:
+            fakeStore.lock.release()
+
+
+    # get subscription
+    def listSubscriptionInfo(self,name,location,version=0):
+        fakeStore.lock.acquire()
+        try:
+            fakeStore.count('listSubscriptionInfo')
+            subscriptions = fakeStore.getDataset(name)['subscriptions']
+            if not subscriptions.has_key(location):
+                return ()
+            return ('',subscriptions[location],'','','')
+        finally:
+            fakeStore.lock.release()
+
+
+
+# rucio client
+class FakeRucioClient:
+    # constructor
+    def __init__(self,account='panda'):
+        self.account = account
+
+
+    # file for rucio
+    def _makeFileDict(self,tmpFile):
+        # checksums are stored with ad: or md5: as DQ2
+        adler32 = None
+        md5 = None
+        checksum = tmpFile['checksum']
+        if checksum != None:
+            if checksum.startswith('ad:'):
+                adler32 = checksum[3:]
+            elif checksum.startswith('md5:'):
+                md5 = checksum[4:]
+            else:
+                adler32 = checksum
+        return {'scope':tmpFile['scope'],
+                'name':tmpFile['lfn'],
+                'bytes':tmpFile['size'],
+                'adler32':adler32,
+                'md5':md5,
+                'guid':tmpFile['guid'].replace('-',''),
+                'events':tmpFile['events'],
+                'lumiblocknr':tmpFile['lumiblocknr']}
+
+
+    # file for store
+    def _makeStoreFile(self,did):
+        meta = did.get('meta',{})
+        guid = meta.get('guid')
+        checksum = None
+        if did.get('adler32') != None:
+            checksum = 'ad:' + did['adler32']
+        elif did.get('md5') != None:
+            checksum = 'md5:' + did['md5']
+        return {'lfn':did['name'],'guid':guid,'size':did.get('bytes',0),'checksum':checksum,
+                'scope':did.get('scope'),'events':meta.get('events'),
+                'lumiblocknr':meta.get('lumiblocknr')}
+
+
+    # get dataset with rucio exceptions
+    def _getDataset(self,name):
+        try:
+            return fakeStore.getDataset(name)
+        except DQUnknownDatasetException:
+            raise DataIdentifierNotFound,'%s not found' % name
+
+
+    # add dataset
+    def add_dataset(self,scope,name,*args,**kwargs):
+        fakeStore.lock.acquire()
+        try:
+            fakeStore.count('add_dataset')
+            try:
+                fakeStore.addDataset(name)
+            except DQDatasetExistsException:
+                raise DataIdentifierAlreadyExists,'%s:%s already exists' % (scope,name)
+        finally:
+            fakeStore.lock.release()
+
+
+    # set status
+    def set_status(self,scope,name,open=True):
+        fakeStore.lock.acquire()
+        try:
+            fakeStore.count('set_status')
+            dataset = self._getDataset(name)
+            if open and dataset['state'] == 'frozen':
+                raise UnsupportedOperation,'%s:%s is closed' % (scope,name)
+            if open:
+                dataset['state'] = 'open'
+            else:
+                dataset['state'] = 'frozen'
+        finally:
+            fakeStore.lock.release()
+
+
+    # set metadata
+    def set_metadata(self,scope,name,key,value):
+        fakeStore.lock.acquire()
+        try:
+            fakeStore.count('set_metadata')
+            self._getDataset(name)['metadata'][key] = value
+        finally:
+            fakeStore.lock.release()
+
+
+    # get metadata
+    def get_metadata(self,scope,name):
+        fakeStore.lock.acquire()
+        try:
+            fakeStore.count('get_metadata')
+            dataset = self._getDataset(name)
+            retMap = dict(dataset['metadata'])
+            retMap['scope'] = scope
+            retMap['name'] = name
+            retMap['is_open'] = dataset['state'] == 'open'
+            retMap['length'] = len(dataset['guids'])
+            return retMap
+        finally:
+            fakeStore.lock.release()
+
+
+    # add files to dataset
+    def add_files_to_dataset(self,scope,name,files,rse=None):
+        fakeStore.lock.acquire()
+        try:
+            fakeStore.count('add_files_to_dataset')
+            dataset = self._getDataset(name)
+            newFiles = []
+            for did in files:
+                tmpFile = self._makeStoreFile(did)
+                if tmpFile['guid'] in dataset['guids']:
+                    raise FileAlreadyExists,'%s already exists in %s' % (did['name'],name)
+                newFiles.append(tmpFile)
+            fakeStore.addFiles(name,newFiles)
+            if rse != None:
+                dataset['locations'].setdefault(rse,{'archived':'primary','pin_lifetime':''})
+        finally:
+            fakeStore.lock.release()
+
+
+    # add files to datasets
+    def add_files_to_datasets(self,attachments,ignore_duplicate=False):
+        fakeStore.lock.acquire()
+        try:
+            fakeStore.count('add_files_to_datasets')
+            for attachment in attachments:
+                dataset = self._getDataset(attachment['name'])
+                newFiles = []
+                for did in attachment['dids']:
+                    tmpFile = self._makeStoreFile(did)
+                    if tmpFile['guid'] in dataset['guids'] and not ignore_duplicate:
+                        raise FileAlreadyExists,'%s already exists in %s' % (did['name'],attachment['name'])
+                    newFiles.append(tmpFile)
+                fakeStore.addFiles(attachment['name'],newFiles)
+                if attachment.has_key('rse'):
+                    dataset['locations'].setdefault(attachment['rse'],{'archived':'primary','pin_lifetime':''})
+            return True
+        finally:
+            fakeStore.lock.release()
+
+
+    # detach files
+    def detach_dids(self,scope,name,dids):
+        fakeStore.lock.acquire()
+        try:
+            fakeStore.count('detach_dids')
+            dataset = self._getDataset(name)
+            lfns = set([did['name'] for did in dids])
+            for guid in list(dataset['guids']):
+                if fakeStore.files[guid]['lfn'] in lfns:
+                    dataset['guids'].remove(guid)
+        finally:
+            fakeStore.lock.release()
+
+
+    # list files
+    def list_files(self,scope,name,long=False):
+        fakeStore.lock.acquire()
+        try:
+            fakeStore.count('list_files')
+            files = [self._makeFileDict(tmpFile) for tmpFile in fakeStore.getFiles(name)]
+        except DQUnknownDatasetException:
+            raise DataIdentifierNotFound,'%s not found' % name
+        finally:
+            fakeStore.lock.release()
+        for tmpFile in files:
+            yield tmpFile
+
+
+    # list dataset replicas
+    def list_dataset_replicas(self,scope,name,deep=False):
+        fakeStore.lock.acquire()
+        try:
+            fakeStore.count('list_dataset_replicas')
+            dataset = self._getDataset(name)
+            replicas = []
+            for location in dataset['locations'].keys():
+                replicas.append({'scope':scope,'name':name,'rse':location,
+                                 'length':len(dataset['guids']),
+                                 'available_length':len(dataset['guids'])})
+        finally:
+            fakeStore.lock.release()
+        for replica in replicas:
+            yield replica
+
+
+    # list replicas of multiple datasets
+    def list_dataset_replicas_bulk(self,dids):
+        fakeStore.lock.acquire()
+        try:
+            fakeStore.count('list_dataset_replicas_bulk')
+            replicas = []
+            for did in dids:
+                dataset = self._getDataset(did['name'])
+                for location in dataset['locations'].keys():
+                    replicas.append({'scope':did['scope'],'name':did['name'],'rse':location,
+                                     'length':len(dataset['guids']),
+                                     'available_length':len(dataset['guids'])})
+        finally:
+            fakeStore.lock.release()
+        for replica in replicas:
+            yield replica
+
+
+    # list file replicas
+    def list_replicas(self,dids,schemes=None):
+        fakeStore.lock.acquire()
+        try:
+            fakeStore.count('list_replicas')
+            replicas = []
+            for did in dids:
+                rses = {}
+                for dataset in fakeStore.datasets.values():
+                    for guid in dataset['guids']:
+                        if fakeStore.files[guid]['lfn'] == did['name']:
+                            for location in dataset['locations'].keys():
+                                rses[location] = []
+                replicas.append({'scope':did['scope'],'name':did['name'],'rses':rses})
+        finally:
+            fakeStore.lock.release()
+        for replica in replicas:
+            yield replica
+
+
+    # add replicas
+    def add_replicas(self,rse,files):
+        fakeStore.lock.acquire()
+        try:
+            fakeStore.count('add_replicas')
+            for did in files:
+                tmpFile = self._makeStoreFile(did)
+                if tmpFile['guid'] != None and fakeStore.files.has_key(tmpFile['guid']):
+                    raise FileAlreadyExists,'%s already exists' % did['name']
+        finally:
+            fakeStore.lock.release()
+
+
+    # list rules
+    def list_did_rules(self,scope,name):
+        fakeStore.lock.acquire()
+        try:
+            fakeStore.count('list_did_rules')
+            rules = [dict(rule) for rule in fakeStore.rules if rule['name'] == name]
+        finally:
+            fakeStore.lock.release()
+        for rule in rules:
+            yield rule
+
+
+    # add rule
+    def add_replication_rule(self,dids,copies,rse_expression,weight=None,lifetime=None,grouping='DATASET',
+                             account=None,locked=False,activity=None,notify='N',ignore_availability=False,
+                             *args,**kwargs):
+        fakeStore.lock.acquire()
+        try:
+            fakeStore.count('add_replication_rule')
+            if account == None:
+                account = self.account
+            ruleIDs = []
+            for did in dids:
+                for rule in fakeStore.rules:
+                    if rule['name'] == did['name'] and rule['rse_expression'] == rse_expression \
+                            and rule['account'] == account:
+                        raise DuplicateRule,'rule for %s at %s already exists' % (did['name'],rse_expression)
+                ruleID = uuid.uuid4().hex
+                fakeStore.rules.append({'id':ruleID,'scope':did['scope'],'name':did['name'],
+                                        'rse_expression':rse_expression,'account':account,
+                                        'expires_at':lifetime,'activity':activity})
+                # datasets become available at the destinations immediately
+                if fakeStore.datasets.has_key(fakeStore.normalize(did['name'])):
+                    dataset = fakeStore.getDataset(did['name'])
+                    for rse in rse_expression.split('|'):
+                        dataset['locations'].setdefault(rse,{'archived':'primary','pin_lifetime':''})
+                ruleIDs.append(ruleID)
+            return ruleIDs
+        finally:
+            fakeStore.lock.release()
+
+
+    # disk usage
+    def get_rse_usage(self,rse):
+        fakeStore.lock.acquire()
+        fakeStore.count('get_rse_usage')
+        fakeStore.lock.release()
+        return [{'rse':rse,'source':'srm','total':100*1024**4,'used':50*1024**4,'free':50*1024**4}]
+
+
+
+# Singleton
+fakeStore = FakeDDMStore()
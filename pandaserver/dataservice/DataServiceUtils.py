@@ -309,18 +309,16 @@ def getSitesShareDDM(siteMapper,siteName):
         return []
     # get siteSpec
     siteSpec = siteMapper.getSite(siteName)
-    # loop over all sites
+    # loop over all sites with the same endpoint
     retSites = []
-    for tmpSiteName,tmpSiteSpec in siteMapper.siteSpecList.iteritems():
+    for tmpSiteName in siteMapper.getSitesWithDdm(siteSpec.ddm):
+        tmpSiteSpec = siteMapper.getSite(tmpSiteName)
         # only same type
         if siteSpec.type != tmpSiteSpec.type:
             continue
         # only online sites
         if tmpSiteSpec.status != 'online':
             continue
-        # same endpoint
-        if siteSpec.ddm != tmpSiteSpec.ddm:
-            continue
         # skip itself
         if siteName == tmpSiteSpec.sitename:
             continue
@@ -16,6 +16,9 @@ from dataservice.DDM import toa
 from dataservice.DDM import dq2Common
 from dataservice.DDM import dq2Info
 from dataservice.DDM import rucioAPI
+from dataservice.DDMCache import ddmCache
+from dataservice.PD2PDataAccess import pd2pDataAccess
+from dataservice.EventGuidResolver import eventGuidResolver
 from taskbuffer.JobSpec import JobSpec
 import brokerage.broker
 
@@ -49,6 +52,9 @@ maxWaitingJobsets = 2
 # clouds with small T1 to make replica at T2
 cloudsWithSmallT1 = ['IT']
 
+# metadata attributes to check
+metaDataAttrs = ['provenance','hidden']
+
 # files in datasets
 g_filesInDsMap = {}
 
@@ -366,13 +372,21 @@ class DynDataDistributer:
             # failed
             self.putLog("failed to get replica locations for %s" % inputDS,'error')
             return failedRet
+        # look up close sites and metadata in advance
+        allDQ2IDs = []
+        for tmpRepMap in tmpRepMaps.values():
+            for tmpDQ2ID in tmpRepMap.keys():
+                if not tmpDQ2ID in allDQ2IDs:
+                    allDQ2IDs.append(tmpDQ2ID)
+        pd2pDataAccess.prefetch('getCloseSites',[(tmpDQ2ID,) for tmpDQ2ID in allDQ2IDs])
+        pd2pDataAccess.prefetch('getMetaDataAttribute',[(tmpDS,tuple(metaDataAttrs)) for tmpDS in tmpRepMaps.keys()])
         # get close sites
         closeSitesMap = {}
         for tmpDS,tmpRepMap in tmpRepMaps.iteritems():
             # loop over all DQ2 IDs
             for tmpDQ2ID in tmpRepMap.keys():
                 if not closeSitesMap.has_key(tmpDQ2ID):
-                    status,tmpCloseSiteList = toa.getCloseSites(tmpDQ2ID)
+                    status,tmpCloseSiteList = pd2pDataAccess.call('getCloseSites',tmpDQ2ID)
                     exec "tmpCloseSiteList = %s" % tmpCloseSiteList
                     closeSitesMap[tmpDQ2ID] = []
                     # select only DATADISK
@@ -400,6 +414,16 @@ class DynDataDistributer:
             allSiteMap[tmpSiteSpec.cloud].append(tmpSiteSpec)
         # NG DQ2 IDs
         ngDQ2SuffixList = ['LOCALGROUPDISK','STAGING']
+        # look up replica metadata at T1s in advance
+        repMetaArgs = []
+        for cloud in self.pd2pClouds:
+            tmpT1SiteID = self.siteMapper.getCloud(cloud)['source']
+            prefixDQ2T1 = re.sub('[^_]+DISK$','',self.siteMapper.getSite(tmpT1SiteID).ddm)
+            for tmpDS,tmpRepMap in tmpRepMaps.iteritems():
+                for tmpDQ2ID in tmpRepMap.keys():
+                    if tmpDQ2ID.startswith(prefixDQ2T1):
+                        repMetaArgs.append((tmpDQ2ID,tmpDS))
+        pd2pDataAccess.prefetch('listMetaDataReplica',repMetaArgs)
         # loop over all clouds
         returnMap = {}
         checkedMetaMap = {}
@@ -607,6 +631,8 @@ class DynDataDistributer:
             self.putLog(out,'error')
             self.putLog('bad DQ2 response for %s' % dataset,'error')
             return retFailed
+        # cached replicas are stale since the subscription was made
+        ddmCache.invalidate(dataset,['replicas','metadata'])
         # update 
         self.putLog('%s %s' % (status,out))
         return True,dq2ID
@@ -642,6 +668,14 @@ class DynDataDistributer:
     def getFreeDiskSize(self,dataset,siteList):
         # return for failuer
         retFailed = False,{}
+        # look up space usage of uncached sites in advance
+        tmpArgs = []
+        for sitename in siteList:
+            if not self.cachedSizeMap.has_key(sitename):
+                dq2ID = self.getDQ2ID(sitename,dataset)
+                if dq2ID != '':
+                    tmpArgs.append((dq2ID,))
+        pd2pDataAccess.prefetch('getRseUsage',tmpArgs)
         # loop over all sites
         sizeMap = {}
         for sitename in siteList:
@@ -654,7 +688,7 @@ class DynDataDistributer:
             if dq2ID == '':
                 self.putLog("cannot find DQ2 ID for %s:%s" % (sitename,dataset))
                 return retFailed
-            tmpMap = rucioAPI.getRseUsage(dq2ID)
+            tmpMap = pd2pDataAccess.call('getRseUsage',dq2ID)
             if tmpMap == {}:
                 self.putLog('getRseUsage failed for {0}'.format(sitename))
             # append
@@ -672,7 +706,7 @@ class DynDataDistributer:
         nTry = 3
         for iDDMTry in range(nTry):
             self.putLog("%s/%s listDatasetReplicas %s" % (iDDMTry,nTry,dataset))
-            status,out = rucioAPI.listDatasetReplicas(dataset)
+            status,out = pd2pDataAccess.call('listDatasetReplicas',dataset)
             if status != 0:
                 time.sleep(10)
             else:
@@ -695,7 +729,7 @@ class DynDataDistributer:
         nTry = 3
         for iDDMTry in range(nTry):
             self.putLog('%s/%s listDatasetsInContainer %s' % (iDDMTry,nTry,container))
-            status,out = ddm.DQ2.main('listDatasetsInContainer',container)
+            status,out = pd2pDataAccess.call('listDatasetsInContainer',container)
             if status != 0 or (not self.isDQ2ok(out)):
                 time.sleep(60)
             else:
@@ -711,6 +745,8 @@ class DynDataDistributer:
         except:
             self.putLog('could not convert HTTP-res to dataset list for %s' % container, 'error')
             return resForFailure
+        # look up replicas in bulk
+        pd2pDataAccess.prefetch('listDatasetReplicas',[(dataset,) for dataset in datasets])
         # loop over all datasets
         allRepMap = {}
         for dataset in datasets:
@@ -729,12 +765,11 @@ class DynDataDistributer:
     def getDatasetMetadata(self,datasetName):
         # response for failure
         resForFailure = False,{}
-        metaDataAttrs = ['provenance','hidden']
         # get datasets in container
         nTry = 3
         for iDDMTry in range(nTry):
             self.putLog('%s/%s getMetaDataAttribute %s' % (iDDMTry,nTry,datasetName))
-            status,out = ddm.DQ2.main('getMetaDataAttribute',datasetName,metaDataAttrs)
+            status,out = pd2pDataAccess.call('getMetaDataAttribute',datasetName,tuple(metaDataAttrs))
             if status != 0 or (not self.isDQ2ok(out)):
                 time.sleep(60)
             else:
@@ -768,7 +803,7 @@ class DynDataDistributer:
         nTry = 3
         for iDDMTry in range(nTry):
             self.putLog('%s/%s listMetaDataReplica %s %s' % (iDDMTry,nTry,datasetName,locationName))
-            status,out = ddm.DQ2.main('listMetaDataReplica',locationName,datasetName)
+            status,out = pd2pDataAccess.call('listMetaDataReplica',locationName,datasetName)
             if status != 0 or (not self.isDQ2ok(out)):
                 time.sleep(10)
             else:
@@ -825,7 +860,7 @@ class DynDataDistributer:
         nTry = 3
         for iDDMTry in range(nTry):
             self.putLog('%s/%s listFilesInDataset %s' % (iDDMTry,nTry,datasetName))
-            status,out = ddm.DQ2.listFilesInDataset(datasetName)
+            status,out = pd2pDataAccess.call('listFilesInDataset',datasetName)
             if status != 0:
                 time.sleep(60)
             else:
@@ -853,6 +888,8 @@ class DynDataDistributer:
     # get datasets used by jobs
     def getUsedDatasets(self,datasetMap):
         resForFailure = (False,[])
+        # look up file lists in advance
+        pd2pDataAccess.prefetch('listFilesInDataset',[(datasetName,) for datasetName in datasetMap.keys()])
         # loop over all datasets
         usedDsList = []
         for datasetName in datasetMap.keys():
@@ -860,7 +897,7 @@ class DynDataDistributer:
             nTry = 3
             for iDDMTry in range(nTry):
                 self.putLog('%s/%s listFilesInDataset %s' % (iDDMTry,nTry,datasetName))
-                status,out = ddm.DQ2.listFilesInDataset(datasetName)
+                status,out = pd2pDataAccess.call('listFilesInDataset',datasetName)
                 if status != 0:
                     time.sleep(60)
                 else:
@@ -905,7 +942,7 @@ class DynDataDistributer:
             nTry = 3
             for iDDMTry in range(nTry):
                 self.putLog('%s/%s listFilesInDataset %s' % (iDDMTry,nTry,datasetName))
-                status,out = ddm.DQ2.listFilesInDataset(datasetName)
+                status,out = pd2pDataAccess.call('listFilesInDataset',datasetName)
                 if status != 0:
                     time.sleep(60)
                 else:
@@ -1140,6 +1177,8 @@ class DynDataDistributer:
                 self.putLog(out,'error')
                 self.putLog('bad DQ2 response to set owner %s' % datasetName, 'error')
                 return resForFailure
+            # cached replicas are stale since the location was registered
+            ddmCache.invalidate(datasetName,['replicas','metadata'])
         return True
 
 
@@ -1224,57 +1263,33 @@ class DynDataDistributer:
             if len(runEvtList) == 0:
                 self.putLog("Empty list for run and events was provided",type='error')
                 return failedRet
-            # Hadoop EI
-            from eventLookupClientEI import eventLookupClientEI
-            elssiIF = eventLookupClientEI()
-            # Oracle EI
-            from taskbuffer.EiTaskBuffer import eiTaskBuffer
-            eiTaskBuffer.init()
-            # loop over all events
-            nEventsPerLoop = 500
-            iEventsTotal = 0
-            while iEventsTotal < len(runEvtList):
-                tmpRunEvtList = runEvtList[iEventsTotal:iEventsTotal+nEventsPerLoop]
-                iEventsTotal += nEventsPerLoop
-                regStart = datetime.datetime.utcnow()
-                guidListELSSI,tmpCom,tmpOut,tmpErr = elssiIF.doLookup(tmpRunEvtList,stream=streamName,tokens=streamRef,
-                                                                      amitag=amiTag,user=user)
-                regTime = datetime.datetime.utcnow()-regStart
-                self.putLog("Hadoop EI took {0}.{1:03d} sec for {2} events" .format(regTime.seconds,
-                                                                                    regTime.microseconds/1000,
-                                                                                    len(tmpRunEvtList)))
-                regStart = datetime.datetime.utcnow()
-                statOra,guidListOraEI = eiTaskBuffer.getGUIDsFromEventIndex(tmpRunEvtList,streamName,amiTag,dsType)
-                regTime = datetime.datetime.utcnow()-regStart
-                self.putLog("Oracle EI took {0}.{1:03d} sec for {2} events" .format(regTime.seconds,
-                                                                                    regTime.microseconds/1000,
-                                                                                    len(tmpRunEvtList)))
-                # failed
-                if not tmpErr in [None,''] or len(guidListELSSI) == 0:
-                    self.putLog(tmpCom)
-                    self.putLog(tmpOut)
-                    self.putLog(tmpErr)
-                    self.putLog("invalid retrun from EventIndex",type='error')
-                    return failedRet
-                # check events
-                for runNr,evtNr in tmpRunEvtList:
-                    paramStr = 'Run:%s Evt:%s Stream:%s' % (runNr,evtNr,streamName)
-                    self.putLog(paramStr)
-                    tmpRunEvtKey = (long(runNr),long(evtNr))
-                    # check in Oracle EI
-                    if not tmpRunEvtKey in guidListOraEI:
-                        errStr = "no GUIDs were found in Oracle EI for %s" % paramStr
-                        self.putLog(errStr)
-                    # not found
-                    if not tmpRunEvtKey in guidListELSSI:
-                        self.putLog(tmpCom)
-                        self.putLog(tmpOut)
-                        self.putLog(tmpErr)
-                        errStr = "no GUIDs were found in EventIndex for %s" % paramStr
-                        self.putLog(errStr,type='error')
-                        return fatalRet
-                    # append
-                    runEvtGuidMap[tmpRunEvtKey] = guidListELSSI[tmpRunEvtKey]
+            # look up Hadoop EI and Oracle EI in chunks
+            tmpStat,guidListELSSI,guidListOraEI = eventGuidResolver.resolve(runEvtList,streamName,streamRef,amiTag,
+                                                                            dsType,user,self.putLog)
+            # failed
+            if not tmpStat:
+                tmpCom,tmpOut,tmpErr = guidListELSSI
+                self.putLog(tmpCom)
+                self.putLog(tmpOut)
+                self.putLog(tmpErr)
+                self.putLog("invalid retrun from EventIndex",type='error')
+                return failedRet
+            # check events
+            for runNr,evtNr in runEvtList:
+                paramStr = 'Run:%s Evt:%s Stream:%s' % (runNr,evtNr,streamName)
+                self.putLog(paramStr)
+                tmpRunEvtKey = (long(runNr),long(evtNr))
+                # check in Oracle EI
+                if tmpRunEvtKey in guidListOraEI and guidListOraEI[tmpRunEvtKey] == []:
+                    errStr = "no GUIDs were found in Oracle EI for %s" % paramStr
+                    self.putLog(errStr)
+                # not found
+                if not tmpRunEvtKey in guidListELSSI:
+                    errStr = "no GUIDs were found in EventIndex for %s" % paramStr
+                    self.putLog(errStr,type='error')
+                    return fatalRet
+                # append
+                runEvtGuidMap[tmpRunEvtKey] = guidListELSSI[tmpRunEvtKey]
         # convert to datasets
         allDatasets  = []
         allFiles     = []
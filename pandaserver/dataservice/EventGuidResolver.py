@@ -0,0 +1,189 @@
+"""
+batched resolver of run/event pairs to GUIDs for event picking
+
+Run/event pairs are looked up in chunks. Chunks are sent to Hadoop EI in
+parallel and to Oracle EI as bulk queries with large chunks. GUIDs found in
+Hadoop EI are kept per (run, event, stream, token, AMI tag) with a lifetime so
+that overlapping picking requests don't look them up again. The least recently
+used entries are dropped when the number of entries exceeds the limit
+
+"""
+
+import time
+import datetime
+import threading
+
+from config import panda_config
+from collections import OrderedDict
+
+from DDMClientPool import runParallel
+
+
+class EventGuidResolver:
+
+    # constructor
+    def __init__(self):
+        # lifetime in sec
+        self.lifetime = 3600
+        if hasattr(panda_config,'eventGuidCacheLifetime'):
+            self.lifetime = panda_config.eventGuidCacheLifetime
+        # max number of entries
+        self.maxEntries = 1000000
+        if hasattr(panda_config,'eventGuidCacheMaxEntries'):
+            self.maxEntries = panda_config.eventGuidCacheMaxEntries
+        # number of events per Hadoop EI lookup
+        self.chunkSize = 500
+        if hasattr(panda_config,'eventLookupChunkSize'):
+            self.chunkSize = panda_config.eventLookupChunkSize
+        # number of events per Oracle EI query
+        self.oraChunkSize = 10000
+        if hasattr(panda_config,'eventIndexChunkSize'):
+            self.oraChunkSize = panda_config.eventIndexChunkSize
+        # max number of parallel Hadoop EI lookups
+        self.nThreads = 4
+        if hasattr(panda_config,'eventLookupThreads'):
+            self.nThreads = panda_config.eventLookupThreads
+        # (run,event,stream,token,AMI tag) -> (set of GUIDs,timestamp). the last one is the most recent
+        self.entries = OrderedDict()
+        self.counters = {'hits':0,'misses':0}
+        self.lock = threading.Lock()
+
+
+    # check if enabled
+    def isEnabled(self):
+        return hasattr(panda_config,'useEventGuidResolver') and panda_config.useEventGuidResolver == True
+
+
+    # look up GUIDs. return a map of (run,event) -> set of GUIDs and a list of uncached (run,event)
+    def getBulk(self,runEvtList,stream,token,amiTag):
+        cachedMap = {}
+        missList = []
+        timeNow = time.time()
+        self.lock.acquire()
+        try:
+            for runEvt in runEvtList:
+                key = runEvt + (stream,token,amiTag)
+                if self.entries.has_key(key):
+                    guids,timeStamp = self.entries.pop(key)
+                    if timeNow - timeStamp <= self.lifetime:
+                        # move to the end as the most recent
+                        self.entries[key] = (guids,timeStamp)
+                        cachedMap[runEvt] = set(guids)
+                        self.counters['hits'] += 1
+                        continue
+                self.counters['misses'] += 1
+                missList.append(runEvt)
+            return cachedMap,missList
+        finally:
+            self.lock.release()
+
+
+    # set GUIDs. guidMap is a map of (run,event) -> set of GUIDs
+    def setBulk(self,guidMap,stream,token,amiTag):
+        timeNow = time.time()
+        self.lock.acquire()
+        try:
+            for runEvt,guids in guidMap.iteritems():
+                # skip dummy and empty
+                if runEvt == None or not guids:
+                    continue
+                key = runEvt + (stream,token,amiTag)
+                if self.entries.has_key(key):
+                    del self.entries[key]
+                self.entries[key] = (set(guids),timeNow)
+            # drop least recently used entries
+            while len(self.entries) > self.maxEntries:
+                self.entries.popitem(last=False)
+        finally:
+            self.lock.release()
+
+
+    # get stats
+    def getStats(self):
+        self.lock.acquire()
+        try:
+            retMap = dict(self.counters)
+            retMap['nEntries'] = len(self.entries)
+            return retMap
+        finally:
+            self.lock.release()
+
+
+    # split list to chunks
+    def _makeChunks(self,itemList,chunkSize):
+        return [itemList[i:i+chunkSize] for i in range(0,len(itemList),chunkSize)]
+
+
+    # resolve GUIDs. return (True,map of (run,event) -> set of GUIDs from Hadoop EI,map of (run,event) -> list of
+    # GUIDs from Oracle EI) for success, or (False,(command,stdout,stderr),None) when Hadoop EI returns an invalid
+    # output. Cached events are not looked up in Oracle EI, and events missing there have empty lists
+    def resolve(self,runEvtList,stream,token,amiTag,dsType,user,putLog):
+        from eventLookupClientEI import eventLookupClientEI
+        from taskbuffer.EiTaskBuffer import eiTaskBuffer
+        eiTaskBuffer.init()
+        # remove duplication
+        tmpRunEvtList = []
+        tmpRunEvtSet = set()
+        for runNr,evtNr in runEvtList:
+            runEvt = (long(runNr),long(evtNr))
+            if not runEvt in tmpRunEvtSet:
+                tmpRunEvtSet.add(runEvt)
+                tmpRunEvtList.append(runEvt)
+        # use cached GUIDs
+        if self.isEnabled():
+            guidMap,missList = self.getBulk(tmpRunEvtList,stream,token,amiTag)
+            putLog("{0} events are cached and {1} events are looked up".format(len(guidMap),len(missList)))
+            chunkSize = self.chunkSize
+            nThreads = self.nThreads
+            oraChunkSize = self.oraChunkSize
+        else:
+            guidMap,missList = {},tmpRunEvtList
+            chunkSize = 500
+            nThreads = 1
+            oraChunkSize = 500
+        oraGuidMap = {}
+        if missList == []:
+            return True,guidMap,oraGuidMap
+        # Hadoop EI
+        regStart = datetime.datetime.utcnow()
+        chunks = self._makeChunks(missList,chunkSize)
+        calls = []
+        for tmpChunk in chunks:
+            calls.append((eventLookupClientEI().doLookup,(tmpChunk,),
+                          {'stream':stream,'tokens':token,'amitag':amiTag,'user':user}))
+        results = runParallel(calls,nThreads)
+        regTime = datetime.datetime.utcnow()-regStart
+        putLog("Hadoop EI took {0}.{1:03d} sec for {2} events in {3} chunks".format(regTime.seconds,
+                                                                                   regTime.microseconds/1000,
+                                                                                   len(missList),len(chunks)))
+        for isOK,tmpRet in results:
+            if not isOK:
+                return False,(None,None,tmpRet),None
+            guidListELSSI,tmpCom,tmpOut,tmpErr = tmpRet
+            # failed
+            if not tmpErr in [None,''] or len(guidListELSSI) == 0:
+                return False,(tmpCom,tmpOut,tmpErr),None
+            guidMap.update(guidListELSSI)
+        if self.isEnabled():
+            self.setBulk(guidMap,stream,token,amiTag)
+        # Oracle EI
+        regStart = datetime.datetime.utcnow()
+        for tmpChunk in self._makeChunks(missList,oraChunkSize):
+            statOra,tmpOraGuidMap = eiTaskBuffer.getGUIDsFromEventIndex(tmpChunk,stream,amiTag,dsType)
+            if not statOra or tmpOraGuidMap == None:
+                tmpOraGuidMap = {}
+            for runEvt in tmpChunk:
+                if runEvt in tmpOraGuidMap:
+                    oraGuidMap[runEvt] = tmpOraGuidMap[runEvt]
+                else:
+                    oraGuidMap[runEvt] = []
+        regTime = datetime.datetime.utcnow()-regStart
+        putLog("Oracle EI took {0}.{1:03d} sec for {2} events".format(regTime.seconds,
+                                                                      regTime.microseconds/1000,
+                                                                      len(missList)))
+        return True,guidMap,oraGuidMap
+
+
+
+# Singleton
+eventGuidResolver = EventGuidResolver()
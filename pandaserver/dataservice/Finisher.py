@@ -5,6 +5,7 @@ finish transferring jobs
 
 import re
 import sys
+import time
 import commands
 import threading
 from DDM import ddm
@@ -17,6 +18,31 @@ from pandalogger.PandaLogger import PandaLogger
 # logger
 _logger = PandaLogger().getLogger('Finisher')
 
+# site mapper shared by Finishers in the process
+_siteMapper = None
+_siteMapperTime = 0
+_siteMapperLock = threading.Lock()
+
+# get site mapper which is refreshed every 10 min instead of instantiating it for every callback
+def getSiteMapper(taskBuffer):
+    global _siteMapper
+    global _siteMapperTime
+    _siteMapperLock.acquire()
+    try:
+        if _siteMapper == None:
+            _siteMapper = SiteMapper(taskBuffer)
+            _siteMapperTime = time.time()
+        elif time.time() - _siteMapperTime > 10*60:
+            if hasattr(panda_config,'useIncrementalSiteMapper') and panda_config.useIncrementalSiteMapper == True:
+                # refresh only changed sites on a copy since other threads use the current one without lock
+                _siteMapper = _siteMapper.getRefreshed(taskBuffer)
+            else:
+                _siteMapper = SiteMapper(taskBuffer)
+            _siteMapperTime = time.time()
+        return _siteMapper
+    finally:
+        _siteMapperLock.release()
+
 
 class Finisher (threading.Thread):
     # constructor
@@ -40,8 +66,8 @@ class Finisher (threading.Thread):
                 # FIXME when callback from BNLPANDA disappeared
                 if self.site == 'BNLPANDA':
                     self.site = 'BNL-OSG2_ATLASMCDISK'
-                # instantiate site mapper
-                siteMapper = SiteMapper(self.taskBuffer)
+                # get site mapper
+                siteMapper = getSiteMapper(self.taskBuffer)
                 # get computingSite/destinationSE
                 computingSite,destinationSE = self.taskBuffer.getDestSE(self.dataset.name)
                 if destinationSE == None:
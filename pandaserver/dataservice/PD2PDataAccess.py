@@ -0,0 +1,184 @@
+"""
+data access layer of DDM lookups for PD2P
+
+Results of replica, metadata, file list, close site and space usage lookups
+are kept in the process-wide DDM cache so that they are reused by following
+PD2P runs. Replica maps are shared with Setupper. Lookups for many datasets
+or endpoints are prefetched with a bulk call where DDM has one, otherwise in
+parallel with a bounded number of threads. Subscriptions are never cached
+since PD2P makes them
+
+"""
+
+import types
+import threading
+
+from config import panda_config
+from pandalogger.PandaLogger import PandaLogger
+
+from DDM import ddm
+from DDM import toa
+from DDM import rucioAPI
+from DDMCache import ddmCache
+from DDMClientPool import runParallel
+import DataServiceUtils
+
+# logger
+_logger = PandaLogger().getLogger('PD2PDataAccess')
+
+
+# check if the return value of a lookup is good to be cached
+def _isGood(ret):
+    # space usage
+    if isinstance(ret,types.DictType):
+        return ret != {}
+    try:
+        status,out = ret
+    except:
+        return False
+    if status != 0:
+        return False
+    # string response from DQ2
+    if isinstance(out,types.StringTypes):
+        if not DataServiceUtils.isDQ2ok(out) or out.startswith('Error'):
+            return False
+    return True
+
+
+class PD2PDataAccess:
+
+    # constructor
+    def __init__(self):
+        # max number of threads for parallel lookups
+        self.nThreads = 4
+        if hasattr(panda_config,'pd2pDDMThreads'):
+            self.nThreads = panda_config.pd2pDDMThreads
+        # lookup name -> (function,namespace in DDM cache)
+        self.lookupMap = {
+            'listDatasetReplicas'     : (rucioAPI.listDatasetReplicas,'replicas'),
+            'listDatasetsInContainer' : (lambda name: ddm.DQ2.main('listDatasetsInContainer',name),
+                                         'pd2pContainers'),
+            'listFilesInDataset'      : (lambda name: ddm.DQ2.listFilesInDataset(name),'pd2pFiles'),
+            'getMetaDataAttribute'    : (lambda name,attrs: ddm.DQ2.main('getMetaDataAttribute',name,list(attrs)),
+                                         'pd2pMetadata'),
+            'listMetaDataReplica'     : (lambda location,name: ddm.DQ2.main('listMetaDataReplica',location,name),
+                                         'pd2pReplicaMetadata'),
+            'getCloseSites'           : (lambda name: toa.getCloseSites(name),'closeSites'),
+            'getRseUsage'             : (rucioAPI.getRseUsage,'rseUsage'),
+            }
+        self.stats = {'nCalls':0,'nBulkCalls':0}
+        self.lock = threading.Lock()
+
+
+    # check if enabled
+    def isEnabled(self):
+        return hasattr(panda_config,'usePD2PDataAccess') and panda_config.usePD2PDataAccess == True
+
+
+    # get key in DDM cache. return namespace,name,subKey
+    def _getCacheKey(self,lookupName,args):
+        namespace = self.lookupMap[lookupName][1]
+        if lookupName == 'getMetaDataAttribute':
+            return namespace,args[0],args[1]
+        if lookupName == 'listMetaDataReplica':
+            return namespace,args[1],args[0]
+        return namespace,args[0],None
+
+
+    # get cached return value. None if not cached
+    def _get(self,lookupName,args):
+        namespace,name,subKey = self._getCacheKey(lookupName,args)
+        value = ddmCache.get(namespace,name,subKey)
+        if value == None:
+            return None
+        # only the replica map is cached to share with Setupper
+        if namespace == 'replicas':
+            return 0,value
+        return value
+
+
+    # cache return value if good
+    def _set(self,lookupName,args,ret):
+        if not _isGood(ret):
+            return
+        namespace,name,subKey = self._getCacheKey(lookupName,args)
+        nFiles = 0
+        if namespace == 'replicas':
+            value = ret[1]
+        else:
+            value = ret
+            # count files in the response to limit memory usage
+            if namespace == 'pd2pFiles':
+                nFiles = ret[1].count("'lfn'")
+        ddmCache.set(namespace,name,value,subKey,nFiles)
+
+
+    # update stats
+    def _addStats(self,name,value=1):
+        self.lock.acquire()
+        self.stats[name] += value
+        self.lock.release()
+
+
+    # look up. the return value is the same as the DDM function
+    def call(self,lookupName,*args):
+        func = self.lookupMap[lookupName][0]
+        if not self.isEnabled():
+            return apply(func,args)
+        ret = self._get(lookupName,args)
+        if ret != None:
+            return ret
+        self._addStats('nCalls')
+        ret = apply(func,args)
+        self._set(lookupName,args,ret)
+        return ret
+
+
+    # fill the cache for a list of args in advance. nothing is done when disabled
+    def prefetch(self,lookupName,argsList):
+        if not self.isEnabled() or not ddmCache.isEnabled():
+            return
+        # collect uncached args
+        missList = []
+        for args in argsList:
+            args = tuple(args)
+            if args in missList:
+                continue
+            if self._get(lookupName,args) == None:
+                missList.append(args)
+        if missList == []:
+            return
+        # one bulk call for replicas
+        if lookupName == 'listDatasetReplicas' and len(missList) > 1:
+            self._addStats('nBulkCalls')
+            status,out = rucioAPI.listDatasetReplicasBulk([args[0] for args in missList])
+            if status == 0:
+                for args in missList:
+                    # datasets without replicas are looked up later since they may not exist
+                    if out.has_key(args[0]) and out[args[0]] != {}:
+                        self._set(lookupName,args,(0,out[args[0]]))
+                return
+            _logger.debug('bulk replica lookup failed with {0}. use parallel lookups'.format(out))
+        # parallel lookups
+        func = self.lookupMap[lookupName][0]
+        self._addStats('nCalls',len(missList))
+        results = runParallel([(func,args,{}) for args in missList],self.nThreads)
+        for args,(isOK,ret) in zip(missList,results):
+            if isOK:
+                self._set(lookupName,args,ret)
+            else:
+                _logger.debug('{0}{1} failed with {2}'.format(lookupName,str(args),ret))
+
+
+    # get stats
+    def getStats(self):
+        self.lock.acquire()
+        retMap = dict(self.stats)
+        self.lock.release()
+        retMap['cache'] = ddmCache.getStats()
+        return retMap
+
+
+
+# Singleton
+pd2pDataAccess = PD2PDataAccess()
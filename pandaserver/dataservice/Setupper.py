@@ -6,13 +6,13 @@ setup dataset
 import re
 import sys
 import datetime
-import commands
 import threading
 
 
 from config import panda_config
 from pandalogger.PandaLogger import PandaLogger
 from pandalogger.LogWrapper import LogWrapper
+from SetupperPool import setupperPool,spoolJobs
 
 # logger
 _logger = PandaLogger().getLogger('Setupper')
@@ -102,15 +102,13 @@ class Setupper (threading.Thread):
                         errtype,errvalue = sys.exc_info()[:2]
                         tmpLog.error('plugin failed with {0}:{1}'.format(errtype,errvalue))
                 tmpLog.debug('main end')
+            elif setupperPool.submit(self.jobs,self.onlyTA,self.firstSubmission):
+                # sent to a long-lived worker process
+                tmpLog.debug('sent {0} jobs to setupper pool'.format(len(self.jobs)))
             else:
                 tmpLog.debug('fork start')
                 # write jobs to file
-                import os
-                import cPickle as pickle
-                outFileName = '%s/set.%s_%s' % (panda_config.logdir,self.jobs[0].PandaID,commands.getoutput('uuidgen'))
-                outFile = open(outFileName,'w')
-                pickle.dump(self.jobs,outFile)
-                outFile.close()
+                outFileName = spoolJobs(self.jobs)
                 # run main procedure in another process because python doesn't release memory
                 com =  'cd %s > /dev/null 2>&1; export HOME=%s; ' % (panda_config.home_dir_cwd,panda_config.home_dir_cwd)
                 com += 'source %s; ' % panda_config.glite_source
@@ -23,11 +23,13 @@ from taskbuffer.JobSpec import JobSpec
 from taskbuffer.FileSpec import FileSpec
 from taskbuffer.DatasetSpec import DatasetSpec
 from taskbuffer import retryModule
+from taskbuffer import JobUtils
 from brokerage.SiteMapper import SiteMapper
 from brokerage.PandaSiteIDs import PandaMoverIDs
 import brokerage.broker
 import brokerage.broker_util
 import DataServiceUtils
+from DDMCache import ddmCache
 from rucio.client import Client as RucioClient
 from rucio.common.exception import FileAlreadyExists,DataIdentifierAlreadyExists,Duplicate,\
     DataIdentifierNotFound
@@ -108,19 +110,7 @@ class SetupperAtlasPlugin (SetupperPluginBase):
                 self._memoryCheck()
                 # sort by site so that larger subs are created in the next step 
                 if self.jobs != [] and self.jobs[0].prodSourceLabel in ['managed','test']:
-                    tmpJobMap = {}
-                    for tmpJob in self.jobs:
-                        # add site
-                        if not tmpJobMap.has_key(tmpJob.computingSite):
-                            tmpJobMap[tmpJob.computingSite] = []
-                        # add job    
-                        tmpJobMap[tmpJob.computingSite].append(tmpJob)
-                    # make new list    
-                    tmpJobList = []
-                    for tmpSiteKey in tmpJobMap.keys():
-                        tmpJobList += tmpJobMap[tmpSiteKey]
-                    # set new list
-                    self.jobs = tmpJobList
+                    self.jobs = JobUtils.groupJobsBySite(self.jobs)
                 # create dataset for outputs and assign destination
                 if self.jobs != [] and self.jobs[0].prodSourceLabel in ['managed','test'] and self.jobs[0].getCloud() in ['DE']:
                     # count the number of jobs per _dis 
@@ -166,6 +156,8 @@ class SetupperAtlasPlugin (SetupperPluginBase):
                 self._memoryCheck()
             regTime = datetime.datetime.utcnow() - timeStart
             self.logger.debug('{0} took {1}sec'.format(bunchTag,regTime.seconds))
+            if ddmCache.isEnabled():
+                self.logger.debug('DDM cache {0}'.format(str(ddmCache.getStats())))
             self.logger.debug('end run()')
         except:
             errtype,errvalue = sys.exc_info()[:2]
@@ -221,14 +213,20 @@ class SetupperAtlasPlugin (SetupperPluginBase):
                 if not prodError.has_key(job.prodDBlock):
                     self.logger.debug('listDatasets '+job.prodDBlock)
                     prodError[job.prodDBlock] = ''
-                    for iDDMTry in range(3):
-                        status,out = ddm.DQ2.main('listDatasets',job.prodDBlock)
-                        if status != 0 or out.find("DQ2 internal server exception") != -1 \
-                               or out.find("An error occurred on the central catalogs") != -1 \
-                               or out.find("MySQL server has gone away") != -1:
-                            time.sleep(10)
-                        else:
-                            break
+                    cachedRes = ddmCache.get('vuid',job.prodDBlock)
+                    if cachedRes != None:
+                        status,out = cachedRes
+                    else:
+                        for iDDMTry in range(3):
+                            status,out = ddm.DQ2.main('listDatasets',job.prodDBlock)
+                            if status != 0 or out.find("DQ2 internal server exception") != -1 \
+                                   or out.find("An error occurred on the central catalogs") != -1 \
+                                   or out.find("MySQL server has gone away") != -1:
+                                time.sleep(10)
+                            else:
+                                break
+                        if status == 0 and out.find('Error') == -1:
+                            ddmCache.set('vuid',job.prodDBlock,(status,out))
                     if status != 0 or out.find('Error') != -1:
                         prodError[job.prodDBlock] = "Setupper._setupSource() could not get VUID of prodDBlock"
                         self.logger.error(out)                                            
@@ -378,6 +376,7 @@ class SetupperAtlasPlugin (SetupperPluginBase):
                 vuidStr = str(out)
                 # freezeDataset dispatch dataset
                 self.logger.debug('freezeDataset '+dispatchDBlock)
+                ddmCache.invalidate(dispatchDBlock)
                 for iDDMTry in range(3):            
                     status,out = ddm.DQ2.main('freezeDataset',dispatchDBlock)
                     if status != 0 or out.find("DQ2 internal server exception") != -1 \
@@ -574,6 +573,7 @@ class SetupperAtlasPlugin (SetupperPluginBase):
                                                                                                                              rse=None,
                                                                                                                              force_backend=ddmBackEnd))
                                 atFailed = 0
+                                ddmCache.invalidate(name)
                                 for iDDMTry in range(3):
                                     status,out = ddm.DQ2.main('registerNewDataset',name,[],[],[],[],
                                                               None,None,None,tmpHiddenFlag,
@@ -620,6 +620,7 @@ class SetupperAtlasPlugin (SetupperPluginBase):
                                                    'purge_replicas': 0}
                                     self.logger.debug('set metadata {0} to {1}'.format(str(subMetadata),name)) 
                                     tmpStat,tmpErrStr = rucioAPI.setMetaData(name,subMetadata)
+                                    ddmCache.invalidate(name)
                                     self.logger.debug('{0} {1}'.format(tmpStat,tmpErrStr))
                                 # register dataset locations
                                 if (job.lockedby == 'jedi' and job.getDdmBackEnd() == 'rucio' and job.prodSourceLabel in ['panda','user']) or \
@@ -655,6 +656,7 @@ class SetupperAtlasPlugin (SetupperPluginBase):
                                                                         activity=activity,
                                                                         acl_alias=acl_alias,
                                                                         ))
+                                        ddmCache.invalidate(name)
                                         for iDDMTry in range(3):                            
                                             status,out = ddm.DQ2.main('registerDatasetLocation',name,dq2ID,0,0,None,None,acl_alias,repLifeTime,
                                                                       None,activity,force_backend=ddmBackEnd)
@@ -963,6 +965,7 @@ class SetupperAtlasPlugin (SetupperPluginBase):
                                                              'wait_for_sources':0,'destination':None,'query_more_sources':0,'sshare':optShare,'group':None,
                                                              'activity':optActivity,'acl_alias':None,'replica_lifetime':"7 days",
                                                              'force_backend':ddmBackEnd}))
+                            ddmCache.invalidate(job.dispatchDBlock)
                             for iDDMTry in range(3):                                                                
                                 status,out = ddm.DQ2.main('registerDatasetSubscription',job.dispatchDBlock,dq2ID,version=0,archived=0,callbacks=optSub,
                                                           sources=optSource,sources_policy=optSrcPolicy,wait_for_sources=0,destination=None,
@@ -1767,10 +1770,31 @@ class SetupperAtlasPlugin (SetupperPluginBase):
 
 
     # get list of files in dataset
-    def getListFilesInDataset(self,dataset,fileList=None,useCache=True):
+    def getListFilesInDataset(self,dataset,fileList=None,useCache=True,useDDMCache=True):
         # use cache data
         if useCache and self.lfnDatasetMap.has_key(dataset):
             return 0,self.lfnDatasetMap[dataset]
+        # use process-wide cache which keeps all files in the dataset
+        if useDDMCache and ddmCache.isEnabled():
+            allItems = None
+            if useCache:
+                allItems = ddmCache.get('files',dataset)
+            if allItems == None:
+                status,allItems = self.getListFilesInDataset(dataset,useCache=False,useDDMCache=False)
+                if status != 0:
+                    return status,allItems
+                ddmCache.set('files',dataset,allItems,nFiles=len(allItems))
+            # filter files in the same way as rucioAPI.listFilesInDataset
+            if fileList == None:
+                items = allItems
+            else:
+                items = {}
+                for tmpLFN,tmpAttrs in allItems.iteritems():
+                    if tmpLFN in fileList or re.sub('\.\d+$','',tmpLFN) in fileList:
+                        items[tmpLFN] = tmpAttrs
+            # keep to avoid redundant lookup
+            self.lfnDatasetMap[dataset] = items
+            return 0,items
         for iDDMTry in range(3):
             try:
                 self.logger.debug('listFilesInDataset '+dataset)
@@ -1798,6 +1822,10 @@ class SetupperAtlasPlugin (SetupperPluginBase):
         
     # get list of datasets in container
     def getListDatasetInContainer(self,container):
+        # use cache data
+        datasets = ddmCache.get('containers',container)
+        if datasets != None:
+            return True,datasets
         # get datasets in container
         self.logger.debug('listDatasetsInContainer '+container)
         for iDDMTry in range(3):
@@ -1815,30 +1843,35 @@ class SetupperAtlasPlugin (SetupperPluginBase):
             exec "datasets = %s" % out
         except:
             return False,out
+        ddmCache.set('containers',container,datasets)
         return True,datasets
 
         
     def getListDatasetReplicasInContainer(self,container,getMap=False):
-        # get datasets in container
-        self.logger.debug('listDatasetsInContainer '+container)
-        for iDDMTry in range(3):
-            status,out = ddm.DQ2.main('listDatasetsInContainer',container)
-            if status != 0 or out.find("DQ2 internal server exception") != -1 \
-                   or out.find("An error occurred on the central catalogs") != -1 \
-                   or out.find("MySQL server has gone away") != -1 \
-                   or out == '()':
-                time.sleep(10)
-            else:
-                break
-        self.logger.debug(out)
-        if status != 0 or out.startswith('Error'):
-            return status,out
-        datasets = []
-        try:
-            # convert to list
-            exec "datasets = %s" % out
-        except:
-            return status,out
+        # use cache data
+        datasets = ddmCache.get('containers',container)
+        if datasets == None:
+            # get datasets in container
+            self.logger.debug('listDatasetsInContainer '+container)
+            for iDDMTry in range(3):
+                status,out = ddm.DQ2.main('listDatasetsInContainer',container)
+                if status != 0 or out.find("DQ2 internal server exception") != -1 \
+                       or out.find("An error occurred on the central catalogs") != -1 \
+                       or out.find("MySQL server has gone away") != -1 \
+                       or out == '()':
+                    time.sleep(10)
+                else:
+                    break
+            self.logger.debug(out)
+            if status != 0 or out.startswith('Error'):
+                return status,out
+            datasets = []
+            try:
+                # convert to list
+                exec "datasets = %s" % out
+            except:
+                return status,out
+            ddmCache.set('containers',container,datasets)
         # loop over all datasets
         allRepMap = {}
         for dataset in datasets:
@@ -1885,14 +1918,21 @@ class SetupperAtlasPlugin (SetupperPluginBase):
 
     # get list of replicas for a dataset
     def getListDatasetReplicas(self,dataset,getMap=True):
-        nTry = 3
-        for iDDMTry in range(nTry):
-            self.logger.debug("%s/%s listDatasetReplicas %s" % (iDDMTry,nTry,dataset))
-            status,out = rucioAPI.listDatasetReplicas(dataset)
-            if status != 0:
-                time.sleep(10)
-            else:
-                break
+        # use cache data
+        out = ddmCache.get('replicas',dataset)
+        if out != None:
+            status = 0
+        else:
+            nTry = 3
+            for iDDMTry in range(nTry):
+                self.logger.debug("%s/%s listDatasetReplicas %s" % (iDDMTry,nTry,dataset))
+                status,out = rucioAPI.listDatasetReplicas(dataset)
+                if status != 0:
+                    time.sleep(10)
+                else:
+                    break
+            if status == 0:
+                ddmCache.set('replicas',dataset,out)
         # result    
         if status != 0:
             self.logger.error(out)
@@ -1936,6 +1976,7 @@ class SetupperAtlasPlugin (SetupperPluginBase):
             if delSites == []:
                 continue
             # delete
+            ddmCache.invalidate(dataset,['replicas','metadata'])
             nTry = 3
             for iDDMTry in range(nTry):
                 self.logger.debug("%s/%s deleteDatasetReplicas %s %s" % (iDDMTry,nTry,dataset,str(delSites)))
@@ -2142,6 +2183,7 @@ class SetupperAtlasPlugin (SetupperPluginBase):
                             continue
                         # freezeDataset dispatch dataset
                         self.logger.debug('freezeDataset '+disDBlock)
+                        ddmCache.invalidate(disDBlock)
                         for iDDMTry in range(3):            
                             status,out = ddm.DQ2.main('freezeDataset',disDBlock)
                             if status != 0 or out.find("DQ2 internal server exception") != -1 \
@@ -2359,6 +2401,7 @@ class SetupperAtlasPlugin (SetupperPluginBase):
         retFailed = False
         # make subscription    
         optSrcPolicy = 000001
+        ddmCache.invalidate(dataset,['replicas','metadata'])
         nTry = 3
         for iDDMTry in range(nTry):
             # register subscription
@@ -2392,6 +2435,10 @@ class SetupperAtlasPlugin (SetupperPluginBase):
     def getReplicaMetadata(self,datasetName,locationName):
         # response for failure
         resForFailure = False,{}
+        # use cache data
+        metadata = ddmCache.get('metadata',datasetName,locationName)
+        if metadata != None:
+            return True,metadata
         # get metadata
         nTry = 3
         for iDDMTry in range(nTry):
@@ -2416,6 +2463,7 @@ class SetupperAtlasPlugin (SetupperPluginBase):
             return resForFailure
         # return
         self.logger.debug('getReplicaMetadata -> %s' % str(metadata))
+        ddmCache.set('metadata',datasetName,metadata,locationName)
         return True,metadata
 
 
@@ -2423,6 +2471,7 @@ class SetupperAtlasPlugin (SetupperPluginBase):
     def setReplicaMetadata(self,datasetName,locationName,attrname,attrvalue):
         # response for failure
         resForFailure = False
+        ddmCache.invalidate(datasetName,['metadata'])
         # get metadata
         nTry = 3
         for iDDMTry in range(nTry):
@@ -2496,6 +2545,7 @@ class SetupperAtlasPlugin (SetupperPluginBase):
         # metadata
         metadata = {'hidden':True,
                     'purge_replicas': 0}
+        ddmCache.invalidate(dsn)
         # register dataset
         client = RucioClient()
         try:
@@ -2532,6 +2582,7 @@ class SetupperAtlasPlugin (SetupperPluginBase):
         # set activity
         if activity == None:
             activity = 'Production Input'
+        ddmCache.invalidate(dsn)
         # check if a replication rule already exists
         client = RucioClient()
         for rule in client.list_did_rules(scope=scope, name=dsn):
@@ -2624,6 +2675,7 @@ class SetupperAtlasPlugin (SetupperPluginBase):
                 try:
                     self.logger.debug('registering jumbo dis dataset {0} with {1} files'.format(dispatchDBlock,
                                                                                                 len(lfns)))
+                    ddmCache.invalidate(dispatchDBlock)
                     out = rucioAPI.registerDatasetWithOldFiles(dispatchDBlock,lfns,guids,sizes,
                                                                checksums,lifetime=14)
                     vuid = out['vuid']
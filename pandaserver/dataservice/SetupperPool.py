@@ -0,0 +1,330 @@
+"""
+pool of long-lived Setupper worker processes
+
+Workers are started with the same environment as forkSetupper, initialize the
+taskbuffer and DDM clients once, and then receive job batches through a pipe.
+Batches are queued in a bounded queue so that submitters are blocked when all
+workers are busy. Each batch is spooled to a setpool.<PID>.* file before being
+queued, and the file is deleted once a worker has processed the batch. The file
+is renamed to set.* when the batch failed so that add.py picks it up as it does
+for forkSetupper. add.py does the same for files left by dead server processes
+
+"""
+
+import os
+import sys
+import time
+import Queue
+import select
+import struct
+import commands
+import threading
+import subprocess
+import cPickle as pickle
+
+from config import panda_config
+from pandalogger.PandaLogger import PandaLogger
+
+# logger
+_logger = PandaLogger().getLogger('SetupperPool')
+
+
+# write a length-prefixed pickle
+def writeMessage(fileObj,obj):
+    data = pickle.dumps(obj,pickle.HIGHEST_PROTOCOL)
+    fileObj.write(struct.pack('!I',len(data)))
+    fileObj.write(data)
+    fileObj.flush()
+
+
+# read exact bytes from a file descriptor. None on EOF or timeout
+def _readExact(fd,size,deadline):
+    chunks = []
+    while size > 0:
+        if deadline != None:
+            timeLeft = deadline - time.time()
+            if timeLeft <= 0:
+                return None
+            readable,writable,exceptional = select.select([fd],[],[],timeLeft)
+            if readable == []:
+                return None
+        chunk = os.read(fd,size)
+        if chunk == '':
+            return None
+        chunks.append(chunk)
+        size -= len(chunk)
+    return ''.join(chunks)
+
+
+# read a length-prefixed pickle. None on EOF or timeout
+def readMessage(fileObj,timeout=None):
+    if timeout == None:
+        deadline = None
+    else:
+        deadline = time.time() + timeout
+    fd = fileObj.fileno()
+    header = _readExact(fd,4,deadline)
+    if header == None:
+        return None
+    data = _readExact(fd,struct.unpack('!I',header)[0],deadline)
+    if data == None:
+        return None
+    return pickle.loads(data)
+
+
+# prefix of files spooled by the pool in this process
+def getPoolPrefix(pid=None):
+    if pid == None:
+        pid = os.getpid()
+    return 'setpool.%s.' % pid
+
+
+# write jobs to a set.* file to be processed by forkSetupper
+def spoolJobs(jobs,prefix='set.'):
+    outFileName = '%s/%s%s_%s' % (panda_config.logdir,prefix,jobs[0].PandaID,commands.getoutput('uuidgen'))
+    outFile = open(outFileName,'w')
+    pickle.dump(jobs,outFile)
+    outFile.close()
+    return outFileName
+
+
+# rename a file spooled by the pool to set.* so that add.py picks it up
+def releaseSpooledJobs(fileName):
+    dirName,baseName = os.path.split(fileName)
+    newFileName = os.path.join(dirName,'set.'+baseName.split('.',2)[-1])
+    os.rename(fileName,newFileName)
+    # add.py takes care of only recent files
+    os.utime(newFileName,None)
+    return newFileName
+
+
+# worker process
+class SetupperWorker:
+    # constructor
+    def __init__(self,workerID):
+        self.workerID = workerID
+        self.proc = None
+        self.nBatches = 0
+        self.lastUsed = 0
+
+
+    # start process
+    def start(self):
+        com =  'cd %s > /dev/null 2>&1; export HOME=%s; ' % (panda_config.home_dir_cwd,panda_config.home_dir_cwd)
+        com += 'source %s; ' % panda_config.glite_source
+        com += 'exec env PYTHONPATH=%s:%s %s/python -Wignore %s/dataservice/setupperWorker.py' % \
+               (panda_config.pandaCommon_dir,panda_config.pandaPython_dir,panda_config.native_python,
+                panda_config.pandaPython_dir)
+        self.proc = subprocess.Popen(com,shell=True,executable='/bin/bash',stdin=subprocess.PIPE,
+                                     stdout=subprocess.PIPE,close_fds=True)
+        self.nBatches = 0
+        self.lastUsed = time.time()
+        _logger.debug('worker {0} started with PID={1}'.format(self.workerID,self.proc.pid))
+
+
+    # stop process
+    def stop(self,graceful=True):
+        if self.proc == None:
+            return
+        try:
+            self.proc.stdin.close()
+        except:
+            pass
+        # give a chance to exit gracefully
+        if graceful:
+            for i in range(10):
+                if self.proc.poll() != None:
+                    break
+                time.sleep(0.5)
+        if self.proc.poll() == None:
+            try:
+                self.proc.kill()
+                self.proc.wait()
+            except:
+                pass
+        _logger.debug('worker {0} stopped PID={1}'.format(self.workerID,self.proc.pid))
+        self.proc = None
+
+
+    # check if alive
+    def isAlive(self):
+        return self.proc != None and self.proc.poll() == None
+
+
+    # send a message and wait for the reply
+    def call(self,message,timeout):
+        writeMessage(self.proc.stdin,message)
+        self.lastUsed = time.time()
+        return readMessage(self.proc.stdout,timeout)
+
+
+    # health check
+    def ping(self,timeout=60):
+        try:
+            ret = self.call({'type':'ping'},timeout)
+            return ret != None and ret['type'] == 'pong'
+        except:
+            return False
+
+
+
+# pool
+class SetupperPool:
+    # constructor
+    def __init__(self):
+        # number of worker processes
+        self.nWorkers = 2
+        if hasattr(panda_config,'setupperPoolWorkers'):
+            self.nWorkers = panda_config.setupperPoolWorkers
+        # max number of queued batches
+        self.maxQueued = 10
+        if hasattr(panda_config,'setupperPoolMaxQueued'):
+            self.maxQueued = panda_config.setupperPoolMaxQueued
+        # how long submitters wait for a free slot in sec before falling back to fork
+        self.submitTimeout = 60
+        # timeout for a batch in sec
+        self.batchTimeout = 3600
+        if hasattr(panda_config,'setupperPoolBatchTimeout'):
+            self.batchTimeout = panda_config.setupperPoolBatchTimeout
+        # workers are restarted after this number of batches since python doesn't release memory
+        self.maxBatches = 100
+        # idle workers are checked after this period in sec
+        self.pingInterval = 300
+        # batch queue
+        self.queue = Queue.Queue(self.maxQueued)
+        self.threads = []
+        self.lock = threading.Lock()
+        self.stats = {'nSubmitted':0,'nDone':0,'nFailed':0,'nRejected':0,'nStarted':0}
+
+
+    # check if enabled
+    def isEnabled(self):
+        return hasattr(panda_config,'useSetupperPool') and panda_config.useSetupperPool == True
+
+
+    # update stats
+    def _addStats(self,name,value=1):
+        self.lock.acquire()
+        self.stats[name] += value
+        self.lock.release()
+
+
+    # get stats
+    def getStats(self):
+        self.lock.acquire()
+        retMap = dict(self.stats)
+        self.lock.release()
+        retMap['nQueued'] = self.queue.qsize()
+        return retMap
+
+
+    # start dispatcher threads
+    def _startThreads(self):
+        self.lock.acquire()
+        try:
+            if self.threads == []:
+                for workerID in range(self.nWorkers):
+                    thr = threading.Thread(target=self.runDispatcher,args=(workerID,),
+                                           name='SetupperPool-{0}'.format(workerID))
+                    thr.setDaemon(True)
+                    thr.start()
+                    self.threads.append(thr)
+        finally:
+            self.lock.release()
+
+
+    # submit a batch. return False when the pool is saturated so that the caller falls back to fork
+    def submit(self,jobs,onlyTA=False,firstSubmission=True):
+        if not self.isEnabled():
+            return False
+        self._startThreads()
+        # spool first not to lose jobs in the queue when the server is restarted
+        try:
+            fileName = spoolJobs(jobs,getPoolPrefix())
+        except:
+            errtype,errvalue = sys.exc_info()[:2]
+            _logger.error('failed to spool jobs with {0}:{1}'.format(errtype,errvalue))
+            return False
+        try:
+            self.queue.put((jobs,onlyTA,firstSubmission,fileName),True,self.submitTimeout)
+        except Queue.Full:
+            self._addStats('nRejected')
+            _logger.debug('queue is full. stats={0}'.format(str(self.getStats())))
+            try:
+                os.remove(fileName)
+            except:
+                pass
+            return False
+        self._addStats('nSubmitted')
+        return True
+
+
+    # get a healthy worker
+    def _prepareWorker(self,worker):
+        # recycle
+        if worker.isAlive() and worker.nBatches >= self.maxBatches:
+            worker.stop()
+        # check idle worker
+        if worker.isAlive() and time.time() - worker.lastUsed > self.pingInterval:
+            if not worker.ping():
+                _logger.error('worker {0} failed health check'.format(worker.workerID))
+                worker.stop(False)
+        if not worker.isAlive():
+            worker.stop(False)
+            worker.start()
+            self._addStats('nStarted')
+            if not worker.ping():
+                _logger.error('worker {0} failed to start'.format(worker.workerID))
+                worker.stop(False)
+                return False
+        return True
+
+
+    # dispatcher loop for a worker
+    def runDispatcher(self,workerID):
+        worker = SetupperWorker(workerID)
+        while True:
+            jobs,onlyTA,firstSubmission,fileName = self.queue.get()
+            timeStart = time.time()
+            isOK = False
+            try:
+                if self._prepareWorker(worker):
+                    ret = worker.call({'type':'setup','jobs':jobs,'onlyTA':onlyTA,
+                                       'firstSubmission':firstSubmission},
+                                      self.batchTimeout)
+                    worker.nBatches += 1
+                    if ret != None and ret['type'] == 'done':
+                        isOK = True
+                    else:
+                        _logger.error('worker {0} returned {1}'.format(workerID,str(ret)))
+                        # kill since the worker is stuck or dead
+                        worker.stop(False)
+            except:
+                errtype,errvalue = sys.exc_info()[:2]
+                _logger.error('worker {0} failed with {1}:{2}'.format(workerID,errtype,errvalue))
+                worker.stop(False)
+            if isOK:
+                self._addStats('nDone')
+                try:
+                    os.remove(fileName)
+                except:
+                    errtype,errvalue = sys.exc_info()[:2]
+                    _logger.error('failed to delete {0} with {1}:{2}'.format(fileName,errtype,errvalue))
+            else:
+                self._addStats('nFailed')
+                # leave jobs to add.py
+                try:
+                    fileName = releaseSpooledJobs(fileName)
+                    _logger.debug('spooled {0} jobs to {1}'.format(len(jobs),fileName))
+                except:
+                    errtype,errvalue = sys.exc_info()[:2]
+                    _logger.error('failed to release {0} with {1}:{2}'.format(fileName,errtype,errvalue))
+            _logger.debug('worker {0} processed {1} jobs in {2:.1f}sec OK={3} stats={4}'.format(workerID,len(jobs),
+                                                                                                 time.time()-timeStart,
+                                                                                                 isOK,
+                                                                                                 str(self.getStats())))
+
+
+
+# Singleton
+setupperPool = SetupperPool()
@@ -10,11 +10,14 @@ import types
 import random
 import commands
 import datetime
+import threading
 import brokerage.broker_util
 from DDM import ddm
 from DDM import dq2Common
 from DDM import toa
 from DDM import rucioAPI
+from DDMCache import ddmCache
+from DDMClientPool import runParallel
 from config import panda_config
 from taskbuffer import ProcessGroups
 from pandalogger.PandaLogger import PandaLogger
@@ -50,6 +53,49 @@ taskTypesAgg = ['evgen','simul']
 # dataset type to ignore file availability check
 datasetTypeToSkipCheck = ['log']
 
+# pilot statistics shared by TaskAssigners in the process
+_siteDataCache = {'data':None,'timestamp':None}
+_siteDataLock = threading.Lock()
+
+
+# check if cached and parallel DDM lookups are enabled
+def _isDataAccessEnabled():
+    return hasattr(panda_config,'useTaskAssignerDataAccess') and panda_config.useTaskAssignerDataAccess == True
+
+
+# get cached value. None if disabled or not cached
+def _getCache(namespace,name,subKey=None):
+    if not _isDataAccessEnabled():
+        return None
+    return ddmCache.get(namespace,name,subKey)
+
+
+# set value to cache
+def _setCache(namespace,name,value,subKey=None):
+    if not _isDataAccessEnabled():
+        return
+    ddmCache.set(namespace,name,value,subKey)
+
+
+# get pilot statistics. reused within the lifetime when enabled
+def _getCurrentSiteData(taskBuffer):
+    if not _isDataAccessEnabled():
+        return taskBuffer.getCurrentSiteData()
+    lifetime = 60
+    if hasattr(panda_config,'taskAssignerSiteDataLifetime'):
+        lifetime = panda_config.taskAssignerSiteDataLifetime
+    _siteDataLock.acquire()
+    try:
+        timeNow = time.time()
+        if _siteDataCache['data'] == None or timeNow - _siteDataCache['timestamp'] > lifetime:
+            _siteDataCache['data'] = taskBuffer.getCurrentSiteData()
+            _siteDataCache['timestamp'] = timeNow
+        return _siteDataCache['data']
+    finally:
+        _siteDataLock.release()
+
+
+
 class TaskAssigner:
     # constructor
     def __init__(self,taskBuffer,siteMapper,taskID,prodSourceLabel,job):
@@ -62,6 +108,10 @@ class TaskAssigner:
         self.job = job
         self.metadataMap = {}
         self.contDsMap = {}
+        # max number of threads for parallel DDM lookups
+        self.nThreads = 4
+        if hasattr(panda_config,'taskAssignerDDMThreads'):
+            self.nThreads = panda_config.taskAssignerDDMThreads
         
 
     # check cloud
@@ -94,6 +144,7 @@ class TaskAssigner:
             _logger.info('%s metadata="%s"' % (self.taskID,metadata))
             _logger.info('%s fileCounts="%s"' % (self.taskID,fileCounts))            
             _logger.info('%s dsSizeMap="%s"' % (self.taskID,dsSizeMap))
+            timeStart = datetime.datetime.utcnow()
             taskType = None
             RWs      = {}
             expRWs   = {}
@@ -144,7 +195,7 @@ class TaskAssigner:
             # get cloud list
             cloudList = self.siteMapper.getCloudList()
             # get pilot statistics
-            nWNmap = self.taskBuffer.getCurrentSiteData()
+            nWNmap = _getCurrentSiteData(self.taskBuffer)
             # get process group
             myTaskGroup = ProcessGroups.getProcessGroup(tt2Map[self.taskID])
             # recalculate RWs
@@ -178,6 +229,7 @@ class TaskAssigner:
                 RWs[tmpCloudInDB] += tmpExpRW
             _logger.info('%s newRWs  =%s' % (self.taskID,str(RWs)))
             _logger.info('%s fullRWs =%s' % (self.taskID,str(fullRWs)))            
+            timeStart = self.logPhaseTime('RW calculation',timeStart)
             # remove offline clouds and check validation/fasttrack
             tmpCloudList = []
             badClouds = []
@@ -217,6 +269,11 @@ class TaskAssigner:
                 self.cloudForSubs.append(tmpCloudName)
             goodClouds = tmpCloudList
             cloudList = goodClouds + badClouds
+            timeStart = self.logPhaseTime('cloud check',timeStart)
+            # look up replicas, metadata and T1 space in parallel
+            if _isDataAccessEnabled():
+                self.prefetchDDMInfo(locations,cloudList)
+                timeStart = self.logPhaseTime('DDM lookup',timeStart)
             # DQ2 location info
             _logger.info('%s DQ2 locations %s' % (self.taskID,str(locations)))
             # check immutable datasets
@@ -236,6 +293,8 @@ class TaskAssigner:
                     _logger.info('%s listFileReplicasBySites %s:%s' % (self.taskID,tmpDataset,str(sitesForRefresh)))
                     tmpStat,tmpOut = ddm.DQ2_iter.listFileReplicasBySites(tmpDataset,0,sitesForRefresh,0,300)
                     _logger.info('%s listFileReplicasBySites end with %s:%s' % (self.taskID,tmpStat,tmpOut))
+                    # replicas are being refreshed
+                    ddmCache.invalidate(tmpDataset,['replicas'])
                     # reset tmod to shorten retry interval
                     self.taskBuffer.resetTmodCloudTask(self.taskID)
             removedDQ2Map = {}
@@ -303,7 +362,7 @@ class TaskAssigner:
                                         minFound = tmpStat['found']
                                         foundSE  = tmpSE
                                     # check if disk copy is available
-                                    tmpStatusSE,tmpRetSE = toa.getSiteProperty(tmpSE,'tape')
+                                    tmpStatusSE,tmpRetSE = self.getSiteProperty(tmpSE,'tape')
                                     if tmpRetSE != 'True':
                                         if tmpStat['found'] != None and tmpStat['found'] == tmpStat['total']:
                                             tmpDiskCopyCloud.append(tmpCloudName)
@@ -382,6 +441,7 @@ class TaskAssigner:
                     if tmpCloudName in cloudList:
                         #cloudList.remove(tmpCloudName)
                         pass
+            timeStart = self.logPhaseTime('data location check',timeStart)
             #_logger.info('%s new locations after DQ2 filter %s' % (self.taskID,str(cloudList)))
             #_logger.info('%s clouds where complete disk copies are available %s' % (self.taskID,str(diskCopyCloud)))
             #_logger.info('%s removed DQ2 map %s' % (self.taskID,str(removedDQ2Map)))
@@ -448,10 +508,10 @@ class TaskAssigner:
                 weightParams[tmpCloudName]['nPilot'] = nPilot
                 _logger.info('%s  # of pilots %s' % (self.taskID,nPilot))
                 # available space
-                tmpMap = rucioAPI.getRseUsage(tmpT1Site.ddm)
+                tmpMap = self.getRseUsage(tmpT1Site.ddm)
                 weightParams[tmpCloudName]['freeSpace'] = tmpMap['free']
                 # take volume of secondary data into account
-                tmpMap = rucioAPI.getRseUsage(tmpT1Site.ddm, 'expired')
+                tmpMap = self.getRseUsage(tmpT1Site.ddm, 'expired')
                 weightParams[tmpCloudName]['secSpace'] = tmpMap['used']
                 _logger.info('{0}  T1 space    free:{1}GB secondary:{2}GB'.format(self.taskID,weightParams[tmpCloudName]['freeSpace'],
                                                                                   weightParams[tmpCloudName]['secSpace']))
@@ -504,6 +564,7 @@ class TaskAssigner:
                     weightParams[tmpCloudName]['dsSize'] = 0
                 _logger.info('%s  data size at T1 %sGB' % (self.taskID,weightParams[tmpCloudName]['dsSize']))
                 foundCandidateWithT1.append(tmpCloudName)
+            timeStart = self.logPhaseTime('weight calculation',timeStart)
             # compare parameters
             maxClouds = []
             useMcShare = False
@@ -645,6 +706,7 @@ class TaskAssigner:
                 pinSiteList = [self.siteMapper.getCloud(definedCloud)['tier1']]
             if pinSiteList != []:
                 self.pinDataset(locations,pinSiteList,definedCloud)
+            timeStart = self.logPhaseTime('cloud decision',timeStart)
             message = '%s set Cloud -> %s' % (self.taskID,retCloudTask.cloud)
             _logger.info(message)
             self.sendMesg(message)
@@ -686,6 +748,108 @@ class TaskAssigner:
         time.sleep(1)
 
 
+    # log time of phase and return the new start time
+    def logPhaseTime(self,phase,timeStart):
+        timeNow = datetime.datetime.utcnow()
+        regTime = timeNow - timeStart
+        _logger.debug('%s %s took %s.%03d sec' % (self.taskID,phase,regTime.seconds,regTime.microseconds/1000))
+        return timeNow
+
+
+    # get ToA property of SE
+    def getSiteProperty(self,tmpSE,propName):
+        cachedRes = _getCache('toaProperties',tmpSE,propName)
+        if cachedRes != None:
+            return cachedRes
+        status,out = toa.getSiteProperty(tmpSE,propName)
+        if status == 0:
+            _setCache('toaProperties',tmpSE,(status,out),propName)
+        return status,out
+
+
+    # get space usage of RSE
+    def getRseUsage(self,rse,src='srm'):
+        # the default source is cached with None to share with PD2P
+        subKey = None
+        if src != 'srm':
+            subKey = src
+        tmpMap = _getCache('rseUsage',rse,subKey)
+        if tmpMap != None:
+            return tmpMap
+        tmpMap = rucioAPI.getRseUsage(rse,src)
+        if tmpMap != {}:
+            _setCache('rseUsage',rse,tmpMap,subKey)
+        return tmpMap
+
+
+    # get replicas of dataset
+    def getListDatasetReplicas(self,dataset):
+        out = _getCache('replicas',dataset)
+        if out != None:
+            return 0,out
+        for iDDMTry in range(3):
+            status,out = rucioAPI.listDatasetReplicas(dataset)
+            if status != 0:
+                time.sleep(10)
+            else:
+                break
+        if status == 0:
+            _setCache('replicas',dataset,out)
+        return status,out
+
+
+    # run lookups in parallel and log failures
+    def runLookups(self,func,argsList):
+        if argsList == []:
+            return
+        results = runParallel([(func,args,{}) for args in argsList],self.nThreads)
+        for args,(isOK,ret) in zip(argsList,results):
+            if not isOK:
+                _logger.error('%s %s%s failed with %s' % (self.taskID,func.__name__,str(args),ret))
+
+
+    # look up replicas, replica metadata and ToA properties of input datasets and T1 space in parallel
+    def prefetchDDMInfo(self,locations,cloudList):
+        # contents of containers. replicas of constituents are looked up in parallel
+        contList = []
+        for tmpDataset in locations.keys():
+            if tmpDataset.endswith('/') and not DataServiceUtils.isDBR(tmpDataset):
+                contList.append(tmpDataset)
+                self.getListDatasetReplicasInContainer(tmpDataset)
+        # replica metadata at all locations
+        metaList = []
+        seList = []
+        for tmpDataset,tmpSites in locations.iteritems():
+            if DataServiceUtils.isDBR(tmpDataset):
+                continue
+            for tmpSE in tmpSites.keys():
+                if not tmpSE in seList:
+                    seList.append(tmpSE)
+                if tmpDataset.endswith('/'):
+                    if not self.contDsMap.has_key(tmpDataset):
+                        continue
+                    for tmpDS,tmpRepMap in self.contDsMap[tmpDataset].iteritems():
+                        if tmpRepMap.has_key(tmpSE):
+                            metaList.append((tmpDS,tmpSE))
+                else:
+                    metaList.append((tmpDataset,tmpSE))
+        self.runLookups(self.getReplicaMetadata,metaList)
+        # ToA properties and space usage are reused only through the DDM cache
+        rseList = []
+        if ddmCache.isEnabled():
+            # tape or not
+            self.runLookups(self.getSiteProperty,[(tmpSE,'tape') for tmpSE in seList])
+            # space at T1s
+            for tmpCloudName in cloudList:
+                tmpT1Site = self.siteMapper.getSite(self.siteMapper.getCloud(tmpCloudName)['source'])
+                if not (tmpT1Site.ddm,) in rseList:
+                    rseList.append((tmpT1Site.ddm,))
+                    rseList.append((tmpT1Site.ddm,'expired'))
+            self.runLookups(self.getRseUsage,rseList)
+        _logger.debug('%s DDM lookups for %s containers, %s replica metadata, %s SEs, %s RSE usages' % \
+                          (self.taskID,len(contList),len(metaList),len(seList),len(rseList)))
+
+
     # check disk count
     def checkDiskCount(self,diskCount,cloud):
         scanSiteList = self.siteMapper.getCloud(cloud)['sites']
@@ -1054,6 +1218,12 @@ class TaskAssigner:
         # use cached data
         if self.metadataMap.has_key(datasetName) and self.metadataMap[datasetName].has_key(locationName):
             return True,self.metadataMap[datasetName][locationName]
+        metadata = _getCache('metadata',datasetName,locationName)
+        if metadata != None:
+            if not self.metadataMap.has_key(datasetName):
+                self.metadataMap[datasetName] = {}
+            self.metadataMap[datasetName][locationName] = metadata
+            return True,metadata
         # response for failure
         resForFailure = False,{}
         # get metadata
@@ -1083,6 +1253,7 @@ class TaskAssigner:
         if not self.metadataMap.has_key(datasetName):
             self.metadataMap[datasetName] = {}
         self.metadataMap[datasetName][locationName] = metadata    
+        _setCache('metadata',datasetName,metadata,locationName)
         # return
         return True,metadata
 
@@ -1144,6 +1315,8 @@ class TaskAssigner:
         if status != 0 or out.startswith('Error'):
             _logger.error("%s %s" % (self.taskID,out))
             return resForFailure
+        # metadata was changed
+        ddmCache.invalidate(datasetName,['metadata'])
         # return
         _logger.info('%s setReplicaMetadata done for %s:%s' % (self.taskID,datasetName,locationName))
         return True
@@ -1155,35 +1328,37 @@ class TaskAssigner:
         if self.contDsMap.has_key(container):
             return True,self.contDsMap[container]
         # get datasets in container
-        for iDDMTry in range(3):
-            status,out = ddm.DQ2.main('listDatasetsInContainer',container)
-            if status != 0 or (not DataServiceUtils.isDQ2ok(out)):
-                time.sleep(60)
-            else:
-                break
-        if status != 0 or out.startswith('Error'):
-            _logger.debug((self.taskID,'listDatasetsInContainer',container))
-            _logger.error('%s %s' % (self.taskID,out))
-            return False,out
-        datasets = []
-        try:
-            # convert to list
-            exec "datasets = %s" % out
-        except:
-            return False,out
+        datasets = _getCache('containers',container)
+        if datasets == None:
+            for iDDMTry in range(3):
+                status,out = ddm.DQ2.main('listDatasetsInContainer',container)
+                if status != 0 or (not DataServiceUtils.isDQ2ok(out)):
+                    time.sleep(60)
+                else:
+                    break
+            if status != 0 or out.startswith('Error'):
+                _logger.debug((self.taskID,'listDatasetsInContainer',container))
+                _logger.error('%s %s' % (self.taskID,out))
+                return False,out
+            datasets = []
+            try:
+                # convert to list
+                exec "datasets = %s" % out
+            except:
+                return False,out
+            _setCache('containers',container,datasets)
+        # look up replicas in parallel when enabled
+        if _isDataAccessEnabled():
+            results = runParallel([(self.getListDatasetReplicas,(dataset,),{}) for dataset in datasets],self.nThreads)
+        else:
+            results = [(True,self.getListDatasetReplicas(dataset)) for dataset in datasets]
         # loop over all datasets
         allRepMap = {}
-        for dataset in datasets:
-            allFileList = []
-            for iDDMTry in range(3):
-                status,outList = ddm.DQ2.listFilesInDataset(dataset)
-                if status == 0:
-                    exec "allFileList = %s[0]" % outList
-                    status,out = rucioAPI.listDatasetReplicas(dataset)
-                    if status != 0:
-                        time.sleep(10)
-                    else:
-                        break
+        for dataset,(isOK,ret) in zip(datasets,results):
+            if isOK:
+                status,out = ret
+            else:
+                status,out = 1,ret
             if status != 0:
                 _logger.debug((self.taskID,'listDatasetReplicas',dataset))
                 _logger.error('%s %s' % (self.taskID,out))
@@ -0,0 +1,174 @@
+"""
+fixed pool of worker threads shared by periodic sweeps
+
+Each sweep has a quota of concurrent tasks and a priority. Tasks of higher
+priority (smaller value) are taken first, and submit() blocks while the
+sweep already has as many outstanding tasks as its quota
+
+"""
+
+import sys
+import time
+import heapq
+import traceback
+import threading
+
+from pandalogger.PandaLogger import PandaLogger
+
+# logger
+_logger = PandaLogger().getLogger('TaskExecutor')
+
+
+# executor
+class TaskExecutor:
+    # constructor
+    def __init__(self,nWorkers=5):
+        self.nWorkers  = nWorkers
+        self.cond      = threading.Condition()
+        # queue of (priority,serial,sweepName,func,args,nItems,submitTime)
+        self.queue     = []
+        self.serial    = 0
+        # sweep name -> {'quota','priority','nQueued','nRunning'}
+        self.sweeps    = {}
+        # sweep name -> metrics
+        self.metrics   = {}
+        self.stopped   = False
+        self.workers   = []
+        for i in range(nWorkers):
+            thr = threading.Thread(target=self.runWorker,name='TaskExecutor-%s' % i)
+            thr.setDaemon(True)
+            thr.start()
+            self.workers.append(thr)
+
+
+    # register sweep
+    def addSweep(self,sweepName,quota,priority=100):
+        self.cond.acquire()
+        self.sweeps[sweepName] = {'quota':quota,'priority':priority,'nQueued':0,'nRunning':0}
+        self.metrics[sweepName] = {'nTasks':0,'nItems':0,'nFailed':0,'waitTime':0.0,'execTime':0.0,
+                                   'maxLatency':0.0,'firstSubmit':None,'lastEnd':None}
+        self.cond.release()
+
+
+    # submit a task. nItems is the number of datasets or jobs handled by the task
+    def submit(self,sweepName,func,args=(),nItems=1):
+        self.cond.acquire()
+        try:
+            sweep = self.sweeps[sweepName]
+            # back pressure
+            while sweep['nQueued'] + sweep['nRunning'] >= sweep['quota']:
+                self.cond.wait()
+            submitTime = time.time()
+            if self.metrics[sweepName]['firstSubmit'] == None:
+                self.metrics[sweepName]['firstSubmit'] = submitTime
+            self.serial += 1
+            heapq.heappush(self.queue,(sweep['priority'],self.serial,sweepName,func,args,nItems,submitTime))
+            sweep['nQueued'] += 1
+            self.cond.notifyAll()
+        finally:
+            self.cond.release()
+
+
+    # get a task which doesn't exceed the quota
+    def _getTask(self):
+        skipped = []
+        task = None
+        while self.queue != []:
+            tmpTask = heapq.heappop(self.queue)
+            sweep = self.sweeps[tmpTask[2]]
+            if sweep['nRunning'] < sweep['quota']:
+                task = tmpTask
+                break
+            skipped.append(tmpTask)
+        for tmpTask in skipped:
+            heapq.heappush(self.queue,tmpTask)
+        return task
+
+
+    # worker
+    def runWorker(self):
+        while True:
+            self.cond.acquire()
+            task = self._getTask()
+            while task == None:
+                if self.stopped:
+                    self.cond.release()
+                    return
+                self.cond.wait()
+                task = self._getTask()
+            priority,serial,sweepName,func,args,nItems,submitTime = task
+            sweep = self.sweeps[sweepName]
+            sweep['nQueued']  -= 1
+            sweep['nRunning'] += 1
+            self.cond.release()
+            startTime = time.time()
+            isFailed = False
+            try:
+                apply(func,args)
+            except:
+                isFailed = True
+                errtype,errvalue = sys.exc_info()[:2]
+                _logger.error("%s failed with %s %s %s" % (sweepName,errtype,errvalue,traceback.format_exc()))
+            endTime = time.time()
+            self.cond.acquire()
+            sweep['nRunning'] -= 1
+            tmpMetrics = self.metrics[sweepName]
+            tmpMetrics['nTasks'] += 1
+            tmpMetrics['nItems'] += nItems
+            if isFailed:
+                tmpMetrics['nFailed'] += 1
+            tmpMetrics['waitTime'] += startTime - submitTime
+            tmpMetrics['execTime'] += endTime - startTime
+            tmpMetrics['maxLatency'] = max(tmpMetrics['maxLatency'],endTime - submitTime)
+            tmpMetrics['lastEnd'] = endTime
+            self.cond.notifyAll()
+            self.cond.release()
+
+
+    # wait until all tasks of the sweep or all sweeps are done
+    def join(self,sweepName=None):
+        self.cond.acquire()
+        while True:
+            nActive = 0
+            for tmpName,sweep in self.sweeps.iteritems():
+                if sweepName == None or tmpName == sweepName:
+                    nActive += sweep['nQueued'] + sweep['nRunning']
+            if nActive == 0:
+                break
+            self.cond.wait()
+        self.cond.release()
+
+
+    # stop workers after all tasks are done
+    def shutdown(self):
+        self.join()
+        self.cond.acquire()
+        self.stopped = True
+        self.cond.notifyAll()
+        self.cond.release()
+        for thr in self.workers:
+            thr.join()
+
+
+    # get metrics of the sweep
+    def getMetrics(self,sweepName):
+        self.cond.acquire()
+        tmpMetrics = dict(self.metrics[sweepName])
+        self.cond.release()
+        retMap = {'nTasks':tmpMetrics['nTasks'],'nItems':tmpMetrics['nItems'],'nFailed':tmpMetrics['nFailed'],
+                  'maxLatency':round(tmpMetrics['maxLatency'],3)}
+        if tmpMetrics['nTasks'] > 0:
+            retMap['avgWait'] = round(tmpMetrics['waitTime'] / tmpMetrics['nTasks'],3)
+            retMap['avgExec'] = round(tmpMetrics['execTime'] / tmpMetrics['nTasks'],3)
+        if tmpMetrics['firstSubmit'] != None and tmpMetrics['lastEnd'] != None \
+                and tmpMetrics['lastEnd'] > tmpMetrics['firstSubmit']:
+            retMap['itemsPerSec'] = round(tmpMetrics['nItems'] / (tmpMetrics['lastEnd'] - tmpMetrics['firstSubmit']),3)
+        return retMap
+
+
+    # dump metrics of all sweeps
+    def dumpMetrics(self,logger=None):
+        if logger == None:
+            logger = _logger
+        for sweepName in sorted(self.metrics.keys()):
+            logger.debug("metrics %s : %s" % (sweepName,str(self.getMetrics(sweepName))))
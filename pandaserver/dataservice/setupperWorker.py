@@ -0,0 +1,44 @@
+import os
+import sys
+
+# exec
+def run(inFile,outFile):
+    # config
+    from config import panda_config
+    # initialize cx_Oracle using dummy connection
+    from taskbuffer.Initializer import initializer
+    initializer.init()
+    # instantiate TB once to reuse the DB connection
+    from taskbuffer.TaskBuffer import taskBuffer
+    taskBuffer.init(panda_config.dbhost,panda_config.dbpasswd,nDBConnection=1)
+    from dataservice.Setupper import Setupper
+    from dataservice.SetupperPool import readMessage,writeMessage
+    # loop over all batches until the pool closes the pipe
+    while True:
+        message = readMessage(inFile)
+        if message == None:
+            break
+        if message['type'] == 'ping':
+            writeMessage(outFile,{'type':'pong'})
+        elif message['type'] == 'setup':
+            # run Setupper
+            thr = Setupper(taskBuffer,message['jobs'],onlyTA=message['onlyTA'],
+                           firstSubmission=message['firstSubmission'])
+            thr.start()
+            thr.join()
+            writeMessage(outFile,{'type':'done'})
+    return
+
+
+####################################################################
+# main
+def main():
+    # keep stdout for messages and send other outputs to stderr
+    outFile = os.fdopen(os.dup(sys.stdout.fileno()),'wb')
+    os.dup2(sys.stderr.fileno(),sys.stdout.fileno())
+    run(sys.stdin,outFile)
+    sys.exit(0)
+
+
+if __name__ == "__main__":
+    main()
@@ -23,6 +23,8 @@ from pandalogger.LogWrapper import LogWrapper
 import DispatcherUtils
 from taskbuffer import EventServiceUtils
 from taskbuffer import retryModule
+from taskbuffer.JobStatsSnapshot import jobStatsSnapshot
+from PilotRequestCounter import pilotRequestCounter
 from brokerage.SiteMapper import SiteMapper
 
 # logger
@@ -144,6 +146,10 @@ class JobDipatcher:
         # site mapper cache
         if self.siteMapperCache == None:
             self.siteMapperCache = CachedObject(60*30,self.getSiteMapper)
+        # snapshot of job statistics for fairshare
+        jobStatsSnapshot.init(self.taskBuffer)
+        # accounting of pilot requests
+        pilotRequestCounter.init(self.taskBuffer)
         # release
         self.lock.release()
         
@@ -266,6 +272,7 @@ class JobDipatcher:
                 # no available jobs
                 response=Protocol.Response(Protocol.SC_NoJobs)
                 _pilotReqLogger.info('method=noJob,site=%s,node=%s,type=%s' % (siteName, node, prodSourceLabel))
+                pilotRequestCounter.record('noJob',siteName,node)
         # return
         _logger.debug("getJob : %s %s useGLEXEC=%s ret -> %s" % (siteName,node,useGLEXEC,response.encode(acceptJson)))
         return response.encode(acceptJson)
@@ -537,6 +544,12 @@ class JobDipatcher:
 
     # get site mapper
     def getSiteMapper(self):
+        # refresh only changed sites in the cached one
+        if hasattr(panda_config,'useIncrementalSiteMapper') and panda_config.useIncrementalSiteMapper == True \
+               and self.siteMapperCache != None and self.siteMapperCache.cachedObj != None:
+            siteMapper = self.siteMapperCache.cachedObj
+            siteMapper.refresh(self.taskBuffer)
+            return siteMapper
         return SiteMapper(self.taskBuffer)
 
     
@@ -695,6 +708,7 @@ def getJob(req,siteName,token=None,timeout=60,cpu=None,mem=None,diskSpace=None,p
                      computingElement,AtlasRelease,prodUserID,getProxyKey,countryGroup,workingGroup,
                      allowOtherCountry,taskID,realDN,prodManager,token,validToken,str(fqans),req.acceptJson()))
     _pilotReqLogger.info('method=getJob,site=%s,node=%s,type=%s' % (siteName,node,prodSourceLabel))    
+    pilotRequestCounter.record('getJob',siteName,node)
     # invalid role
     if (not prodManager) and (not prodSourceLabel in ['user']):
         _logger.warning("getJob(%s) : invalid role" % siteName)
@@ -737,6 +751,7 @@ def updateJob(req,jobId,state,token=None,transExitCode=None,pilotErrorCode=None,
                    maxRSS,maxVMEM,maxSWAP,maxPSS,avgRSS,avgVMEM,avgSWAP,avgPSS,xml,pilotLog,metaData,jobMetrics,
                    stdout))
     _pilotReqLogger.info('method=updateJob,site=%s,node=%s,type=None' % (siteName,node))
+    pilotRequestCounter.record('updateJob',siteName,node)
     # invalid role
     if not prodManager:
         _logger.warning("updateJob(%s) : invalid role" % jobId)
@@ -0,0 +1,178 @@
+"""
+accounting of pilot requests per site and node
+
+Each process counts getJob/updateJob/noJob requests in memory and periodically
+adds them to a sqlite file shared by all processes on the host. One of the
+processes then pushes the counts of the last hours to SiteData in bulk
+
+"""
+
+import sys
+import time
+import fcntl
+import sqlite3
+import threading
+
+from config import panda_config
+from pandalogger.PandaLogger import PandaLogger
+
+# logger
+_logger = PandaLogger().getLogger('PilotRequestCounter')
+
+
+class PilotRequestCounter:
+
+    # constructor
+    def __init__(self):
+        # taskbuffer
+        self.taskBuffer = None
+        # counts not yet synced : (minute,site,method,node) -> count
+        self.counts = {}
+        # local store
+        if hasattr(panda_config,'pilotRequestDB'):
+            self.dbPath = panda_config.pilotRequestDB
+        else:
+            self.dbPath = '%s/pilot_requests.db' % panda_config.logdir
+        # interval in sec to sync the store
+        self.syncInterval = 10
+        # interval in sec to update SiteData
+        self.flushInterval = 60
+        if hasattr(panda_config,'pilotRequestFlushInterval'):
+            self.flushInterval = panda_config.pilotRequestFlushInterval
+        # time window in hours, which is the same as HOURS in SiteData
+        self.hours = 3
+        # host ID used as FLAG in SiteData
+        self.hostID = panda_config.pserverhost.split('.')[0]
+        # thread
+        self.thread = None
+        # lock
+        self.lock = threading.Lock()
+
+
+    # check if enabled
+    def isEnabled(self):
+        return hasattr(panda_config,'usePilotRequestCounter') and panda_config.usePilotRequestCounter == True
+
+
+    # set task buffer and start sync thread
+    def init(self,taskBuffer):
+        if not self.isEnabled():
+            return
+        self.lock.acquire()
+        if self.taskBuffer == None:
+            self.taskBuffer = taskBuffer
+        if self.thread == None:
+            self.thread = threading.Thread(target=self.run,name='PilotRequestCounter')
+            self.thread.setDaemon(True)
+            self.thread.start()
+        self.lock.release()
+
+
+    # count a request
+    def record(self,method,site,node):
+        if self.thread == None:
+            return
+        # use the same string representation as PilotRequests.log
+        key = (int(time.time())/60,str(site),method,str(node))
+        self.lock.acquire()
+        if self.counts.has_key(key):
+            self.counts[key] += 1
+        else:
+            self.counts[key] = 1
+        self.lock.release()
+
+
+    # get connection to the local store
+    def getConnection(self):
+        conn = sqlite3.connect(self.dbPath,timeout=60)
+        conn.text_factory = str
+        conn.execute("CREATE TABLE IF NOT EXISTS pilot_requests (minute INTEGER,site TEXT,method TEXT,node TEXT,"
+                     "nRequests INTEGER,PRIMARY KEY (minute,site,method,node))")
+        conn.execute("CREATE TABLE IF NOT EXISTS flush_time (id INTEGER PRIMARY KEY,lastFlush INTEGER)")
+        conn.commit()
+        return conn
+
+
+    # add in-memory counts to the local store
+    def sync(self,conn):
+        self.lock.acquire()
+        counts = self.counts
+        self.counts = {}
+        self.lock.release()
+        sqlI = "INSERT OR IGNORE INTO pilot_requests (minute,site,method,node,nRequests) VALUES (?,?,?,?,0)"
+        sqlU = "UPDATE pilot_requests SET nRequests=nRequests+? WHERE minute=? AND site=? AND method=? AND node=?"
+        sqlD = "DELETE FROM pilot_requests WHERE minute<?"
+        try:
+            conn.executemany(sqlI,counts.keys())
+            conn.executemany(sqlU,[(nReq,)+key for key,nReq in counts.iteritems()])
+            conn.execute(sqlD,(int(time.time())/60-self.hours*60,))
+            conn.commit()
+        except:
+            conn.rollback()
+            # put counts back to retry
+            self.lock.acquire()
+            for key,nReq in counts.iteritems():
+                self.counts[key] = self.counts.get(key,0) + nReq
+            self.lock.release()
+            raise
+
+
+    # get counts in the time window with the same format as the one parsed from PilotRequests.log
+    def getPilotCounts(self,conn):
+        sql  = "SELECT site,method,node,SUM(nRequests) FROM pilot_requests WHERE minute>=? "
+        sql += "GROUP BY site,method,node"
+        pilotCounts = {}
+        for tmpSite,tmpMethod,tmpNode,nReq in conn.execute(sql,(int(time.time())/60-self.hours*60,)):
+            pilotCounts.setdefault(tmpSite,{})
+            pilotCounts[tmpSite].setdefault(tmpMethod,{})
+            pilotCounts[tmpSite][tmpMethod][tmpNode] = nReq
+        return pilotCounts
+
+
+    # update SiteData if no other process on the host did it recently
+    def flush(self,conn):
+        # serialize among processes. skip if another process is flushing
+        lockFile = open(self.dbPath+'.lock','w')
+        try:
+            fcntl.flock(lockFile,fcntl.LOCK_EX|fcntl.LOCK_NB)
+        except IOError:
+            lockFile.close()
+            return
+        try:
+            timeNow = int(time.time())
+            res = conn.execute("SELECT lastFlush FROM flush_time WHERE id=0").fetchone()
+            if res != None and timeNow-res[0] < self.flushInterval:
+                return
+            pilotCounts = self.getPilotCounts(conn)
+            tmpStat = self.taskBuffer.updateSiteDataBulk(self.hostID,pilotCounts)
+            _logger.debug("flush %s sites -> %s" % (len(pilotCounts),tmpStat))
+            conn.execute("INSERT OR REPLACE INTO flush_time (id,lastFlush) VALUES (0,?)",(timeNow,))
+            conn.commit()
+        finally:
+            fcntl.flock(lockFile,fcntl.LOCK_UN)
+            lockFile.close()
+
+
+    # loop
+    def run(self):
+        conn = None
+        while True:
+            time.sleep(self.syncInterval)
+            try:
+                if conn == None:
+                    conn = self.getConnection()
+                self.sync(conn)
+                self.flush(conn)
+            except:
+                errtype,errvalue = sys.exc_info()[:2]
+                _logger.error("run : %s %s" % (errtype,errvalue))
+                try:
+                    conn.close()
+                except:
+                    pass
+                conn = None
+
+
+
+# Singleton
+pilotRequestCounter = PilotRequestCounter()
@@ -39,10 +39,11 @@ if panda_config.nDBConnection != 0:
 allowedMethods = []
 
 from taskbuffer.Utils            import isAlive,putFile,deleteFile,getServer,updateLog,fetchLog,\
-     touchFile,getVomsAttr,putEventPickingRequest,getAttr,getFile,uploadLog
+     touchFile,getVomsAttr,putEventPickingRequest,getAttr,getFile,uploadLog,getCacheFile,\
+     getCacheStats
 allowedMethods += ['isAlive','putFile','deleteFile','getServer','updateLog','fetchLog',
                    'touchFile','getVomsAttr','putEventPickingRequest','getAttr','getFile',
-                   'uploadLog']
+                   'uploadLog','getCacheFile','getCacheStats']
 
 from dataservice.DataService     import datasetCompleted,updateFileStatusInDisp
 allowedMethods += ['datasetCompleted','updateFileStatusInDisp']
@@ -94,8 +95,10 @@ import taskbuffer.ErrorCode
 if panda_config.useFastCGI or panda_config.useWSGI:
 
     import os
+    import re
     import cgi
     import sys
+    import email.utils
     from pandalogger.PandaLogger import PandaLogger
 
     # logger
@@ -128,6 +131,70 @@ if panda_config.useFastCGI or panda_config.useWSGI:
             return False
         
 
+    # read a part of file in blocks
+    def readBlocks(fileObj,length,blockSize=1024*1024):
+        try:
+            while length > 0:
+                tmpStr = fileObj.read(min(blockSize,length))
+                if not tmpStr:
+                    break
+                length -= len(tmpStr)
+                yield tmpStr
+        finally:
+            fileObj.close()
+
+
+    # send file with ETag and single byte-range support
+    def sendFile(environ,start_response,fileSpec):
+        try:
+            fileObj = open(fileSpec.path,'rb')
+        except IOError:
+            start_response('404 Not Found', [('Content-Type', 'text/plain')])
+            return ['not found']
+        fileStat = os.fstat(fileObj.fileno())
+        fileSize = fileStat.st_size
+        eTag = '"%x-%x-%x"' % (fileStat.st_ino,fileSize,int(fileStat.st_mtime))
+        headers = [('Content-Type',fileSpec.contentType),
+                   ('ETag',eTag),
+                   ('Last-Modified',email.utils.formatdate(fileStat.st_mtime,usegmt=True)),
+                   ('Accept-Ranges','bytes')]
+        # conditional request
+        if environ.has_key('HTTP_IF_NONE_MATCH'):
+            tmpTags = [tmpTag.strip() for tmpTag in environ['HTTP_IF_NONE_MATCH'].split(',')]
+            if eTag in tmpTags or '*' in tmpTags:
+                fileObj.close()
+                start_response('304 Not Modified',headers)
+                return []
+        # range request. multiple ranges are ignored and the whole file is sent
+        status = '200 OK'
+        start,end = 0,fileSize-1
+        tmpMatch = re.search('^bytes=(\d*)-(\d*)$',environ.get('HTTP_RANGE','').strip())
+        if tmpMatch != None and tmpMatch.group(1)+tmpMatch.group(2) != '' and \
+                environ.get('HTTP_IF_RANGE',eTag) == eTag:
+            if tmpMatch.group(1) == '':
+                # suffix
+                start = max(0,fileSize-long(tmpMatch.group(2)))
+            else:
+                start = long(tmpMatch.group(1))
+                if tmpMatch.group(2) != '':
+                    end = min(end,long(tmpMatch.group(2)))
+            if start > end:
+                fileObj.close()
+                start_response('416 Requested Range Not Satisfiable',
+                               [('Content-Range','bytes */%s' % fileSize)])
+                return []
+            status = '206 Partial Content'
+            headers.append(('Content-Range','bytes %s-%s/%s' % (start,end,fileSize)))
+        length = end-start+1
+        headers.append(('Content-Length',str(length)))
+        start_response(status,headers)
+        # zero-copy transfer of the whole file
+        if length == fileSize and environ.has_key('wsgi.file_wrapper'):
+            return environ['wsgi.file_wrapper'](fileObj,1024*1024)
+        fileObj.seek(start)
+        return readBlocks(fileObj,length)
+
+
     # application
     def application(environ, start_response):
         # get method name
@@ -203,6 +270,8 @@ if panda_config.useFastCGI or panda_config.useWSGI:
         elif isinstance(exeRes,taskbuffer.ErrorCode.EC_Redirect):
             start_response('302 Redirect', [('Location', exeRes.url)])
             return ['redirect']
+        elif isinstance(exeRes,taskbuffer.ErrorCode.EC_SendFile):
+            return sendFile(environ,start_response,exeRes)
         else:                
             if retType == 'json':
                 start_response('200 OK', [('Content-Type', 'application/json')])
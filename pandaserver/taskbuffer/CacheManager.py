@@ -0,0 +1,329 @@
+"""
+size-aware LRU management of the sandbox cache directory
+
+Accesses through the server are recorded in a sqlite index together with
+hit/miss counters. Files in cache_dir are grouped by inode since the sandbox
+store hard-links the same content to many names, and the least recently
+used groups are evicted when the usage exceeds the high watermark. Eviction
+runs in the cron and in a background thread of the server at most once per
+interval, so that uploads don't wait for scanning the directory
+
+"""
+
+import os
+import sys
+import time
+import fcntl
+import sqlite3
+import threading
+
+from config import panda_config
+from pandalogger.PandaLogger import PandaLogger
+from pandalogger.LogWrapper import LogWrapper
+
+# logger
+_logger = PandaLogger().getLogger('CacheManager')
+
+
+# manager of cache_dir
+class CacheManager:
+
+    # constructor
+    def __init__(self):
+        # index
+        if hasattr(panda_config,'cacheIndexDB'):
+            self.dbPath = panda_config.cacheIndexDB
+        else:
+            self.dbPath = '%s/cache_index.db' % panda_config.logdir
+        # disk budget in bytes. None to evict only by age
+        self.sizeLimit = None
+        if hasattr(panda_config,'cacheSizeLimit') and panda_config.cacheSizeLimit not in [None,'',0]:
+            self.sizeLimit = long(panda_config.cacheSizeLimit) * 1024 * 1024 * 1024
+        # watermarks as fractions of the budget
+        self.highWatermark = 0.9
+        if hasattr(panda_config,'cacheHighWatermark'):
+            self.highWatermark = panda_config.cacheHighWatermark
+        self.lowWatermark = 0.8
+        if hasattr(panda_config,'cacheLowWatermark'):
+            self.lowWatermark = panda_config.cacheLowWatermark
+        # files not accessed for this period in sec are always deleted
+        self.maxAge = 7 * 24 * 60 * 60
+        if hasattr(panda_config,'cacheMaxAge'):
+            self.maxAge = panda_config.cacheMaxAge * 24 * 60 * 60
+        # files younger than this in sec are not evicted since jobs are about to use them
+        self.minAge = 10 * 60
+        # special test files
+        self.protectedFiles = set(['sources.72c48dc5-f055-43e5-a86e-4ae9f8ea3497.tar.gz',
+                                   'sources.090f3f51-fc81-4e80-9749-a5e4b2bd58de.tar.gz'])
+        # sub directories in the sandbox store
+        self.storeDirs = ['%s/sandbox/data' % panda_config.cache_dir,
+                          '%s/sandbox/index' % panda_config.cache_dir]
+        # min interval in sec between evictions triggered by uploads
+        self.evictionInterval = 10 * 60
+        if hasattr(panda_config,'cacheEvictionInterval'):
+            self.evictionInterval = panda_config.cacheEvictionInterval * 60
+        # connection shared by threads to record accesses
+        self.conn = None
+        self.hasTables = False
+        self.evictionRequested = False
+        self.evictionThread = None
+        self.lock = threading.Lock()
+
+
+    # check if enabled
+    def isEnabled(self):
+        return hasattr(panda_config,'useCacheManager') and panda_config.useCacheManager == True
+
+
+    # get connection to the index
+    def getConnection(self):
+        conn = sqlite3.connect(self.dbPath,timeout=10,check_same_thread=False)
+        conn.text_factory = str
+        # tables are made once per process
+        if not self.hasTables:
+            conn.execute("CREATE TABLE IF NOT EXISTS files (name TEXT PRIMARY KEY,lastAccess INTEGER,"
+                         "nAccess INTEGER)")
+            conn.execute("CREATE TABLE IF NOT EXISTS stats (name TEXT PRIMARY KEY,value INTEGER)")
+            conn.commit()
+            self.hasTables = True
+        return conn
+
+
+    # get the shared connection. the lock must be held
+    def _getSharedConnection(self):
+        if self.conn == None:
+            self.conn = self.getConnection()
+        return self.conn
+
+
+    # close the shared connection after errors. the lock must be held
+    def _closeSharedConnection(self):
+        if self.conn != None:
+            try:
+                self.conn.close()
+            except:
+                pass
+            self.conn = None
+
+
+    # increment counters
+    def _addStats(self,conn,valMap):
+        for tmpKey,tmpVal in valMap.iteritems():
+            conn.execute("INSERT OR IGNORE INTO stats (name,value) VALUES (?,0)",(tmpKey,))
+            conn.execute("UPDATE stats SET value=value+? WHERE name=?",(tmpVal,tmpKey))
+
+
+    # record an access to a file. newBytes is the size of content newly added to the disk
+    def record(self,fileName,hit,newBytes=0):
+        if not self.isEnabled():
+            return
+        try:
+            self.lock.acquire()
+            try:
+                conn = self._getSharedConnection()
+                if fileName != None:
+                    conn.execute("INSERT OR IGNORE INTO files (name,lastAccess,nAccess) VALUES (?,0,0)",
+                                 (fileName,))
+                    conn.execute("UPDATE files SET lastAccess=?,nAccess=nAccess+1 WHERE name=?",
+                                 (int(time.time()),fileName))
+                if hit:
+                    tmpStats = {'nHits':1}
+                else:
+                    tmpStats = {'nMisses':1}
+                if newBytes != 0:
+                    tmpStats['usedBytes'] = newBytes
+                self._addStats(conn,tmpStats)
+                conn.commit()
+                usedBytes = conn.execute("SELECT value FROM stats WHERE name='usedBytes'").fetchone()
+            except:
+                self._closeSharedConnection()
+                raise
+            finally:
+                self.lock.release()
+            # evict when an upload burst exceeds the high watermark
+            if newBytes != 0 and self.sizeLimit != None and usedBytes != None and \
+                    usedBytes[0] > self.sizeLimit * self.highWatermark:
+                self.requestEviction()
+        except:
+            errtype,errvalue = sys.exc_info()[:2]
+            _logger.error("record %s : %s %s" % (fileName,errtype,errvalue))
+
+
+    # request eviction in the background thread
+    def requestEviction(self):
+        self.lock.acquire()
+        try:
+            self.evictionRequested = True
+            if self.evictionThread == None:
+                self.evictionThread = threading.Thread(target=self._runEviction)
+                self.evictionThread.setDaemon(True)
+                self.evictionThread.start()
+        finally:
+            self.lock.release()
+
+
+    # evict when requested, at most once per interval
+    def _runEviction(self):
+        while True:
+            self.lock.acquire()
+            isRequested = self.evictionRequested
+            self.evictionRequested = False
+            self.lock.release()
+            if isRequested:
+                try:
+                    self.evict()
+                except:
+                    errtype,errvalue = sys.exc_info()[:2]
+                    _logger.error("eviction in background : %s %s" % (errtype,errvalue))
+            time.sleep(self.evictionInterval)
+
+
+    # get stats
+    def getStats(self):
+        self.lock.acquire()
+        try:
+            conn = self._getSharedConnection()
+            retMap = {'nHits':0,'nMisses':0,'usedBytes':0,'nFiles':0,
+                      'nEvictedFiles':0,'evictedBytes':0,'lastEviction':0}
+            try:
+                for tmpKey,tmpVal in conn.execute("SELECT name,value FROM stats"):
+                    retMap[tmpKey] = tmpVal
+            except:
+                self._closeSharedConnection()
+                raise
+        finally:
+            self.lock.release()
+        nLookup = retMap['nHits'] + retMap['nMisses']
+        if nLookup > 0:
+            retMap['hitRate'] = float(retMap['nHits']) / float(nLookup)
+        else:
+            retMap['hitRate'] = None
+        retMap['sizeLimit'] = self.sizeLimit
+        if self.sizeLimit != None:
+            retMap['occupancy'] = float(retMap['usedBytes']) / float(self.sizeLimit)
+        else:
+            retMap['occupancy'] = None
+        return retMap
+
+
+    # check if files are requests which are not yet processed by daemons
+    def isPending(self,fileNames):
+        for tmpName in fileNames:
+            if tmpName.startswith('evp.'):
+                return True
+        return False
+
+
+    # group files in cache_dir by inode
+    def scan(self,conn):
+        # last access recorded in the index
+        accessMap = {}
+        for tmpName,tmpAccess in conn.execute("SELECT name,lastAccess FROM files"):
+            accessMap[tmpName] = tmpAccess
+        groups = {}
+        # top level files
+        for tmpName in os.listdir(panda_config.cache_dir):
+            tmpPath = '%s/%s' % (panda_config.cache_dir,tmpName)
+            try:
+                tmpStat = os.lstat(tmpPath)
+            except OSError:
+                continue
+            if not os.path.isfile(tmpPath) or os.path.islink(tmpPath):
+                continue
+            tmpKey = (tmpStat.st_dev,tmpStat.st_ino)
+            if not groups.has_key(tmpKey):
+                # atime catches downloads through the web server with relatime granularity
+                groups[tmpKey] = {'size':tmpStat.st_size,'names':[],'paths':[],
+                                  'lastAccess':max(tmpStat.st_atime,tmpStat.st_mtime)}
+            groups[tmpKey]['names'].append(tmpName)
+            groups[tmpKey]['paths'].append(tmpPath)
+            groups[tmpKey]['lastAccess'] = max(groups[tmpKey]['lastAccess'],accessMap.get(tmpName,0))
+        # sandbox store
+        for tmpDir in self.storeDirs:
+            for tmpRoot,tmpDirs,tmpFiles in os.walk(tmpDir):
+                for tmpName in tmpFiles:
+                    tmpPath = os.path.join(tmpRoot,tmpName)
+                    try:
+                        tmpStat = os.lstat(tmpPath)
+                    except OSError:
+                        continue
+                    tmpKey = (tmpStat.st_dev,tmpStat.st_ino)
+                    if not groups.has_key(tmpKey):
+                        groups[tmpKey] = {'size':tmpStat.st_size,'names':[],'paths':[],
+                                          'lastAccess':max(tmpStat.st_atime,tmpStat.st_mtime)}
+                    groups[tmpKey]['paths'].append(tmpPath)
+        return groups.values()
+
+
+    # evict expired and least recently used files. skip if another process is running
+    def evict(self,dryRun=False):
+        tmpLog = LogWrapper(_logger,'evict')
+        lockFile = open(self.dbPath+'.lock','w')
+        try:
+            fcntl.flock(lockFile,fcntl.LOCK_EX|fcntl.LOCK_NB)
+        except IOError:
+            lockFile.close()
+            return
+        try:
+            conn = self.getConnection()
+            try:
+                timeNow = time.time()
+                groups = self.scan(conn)
+                usedBytes = 0
+                for tmpGroup in groups:
+                    usedBytes += tmpGroup['size']
+                tmpLog.debug("start with %s groups %s bytes" % (len(groups),usedBytes))
+                overWatermark = self.sizeLimit != None and usedBytes > self.sizeLimit * self.highWatermark
+                # least recently used first
+                groups.sort(key=lambda tmpGroup: tmpGroup['lastAccess'])
+                nEvicted = 0
+                evictedBytes = 0
+                for tmpGroup in groups:
+                    tmpAge = timeNow - tmpGroup['lastAccess']
+                    if self.protectedFiles.intersection(tmpGroup['names']) != set():
+                        continue
+                    if tmpAge > self.maxAge:
+                        # expired
+                        pass
+                    elif overWatermark and usedBytes > self.sizeLimit * self.lowWatermark \
+                            and tmpAge > self.minAge and not self.isPending(tmpGroup['names']):
+                        # down to the low watermark
+                        pass
+                    else:
+                        continue
+                    tmpLog.debug("delete %s size=%s age=%ds" % (','.join(tmpGroup['names']),
+                                                                tmpGroup['size'],tmpAge))
+                    if not dryRun:
+                        for tmpPath in tmpGroup['paths']:
+                            try:
+                                os.remove(tmpPath)
+                            except OSError:
+                                pass
+                        for tmpName in tmpGroup['names']:
+                            conn.execute("DELETE FROM files WHERE name=?",(tmpName,))
+                    nEvicted += 1
+                    evictedBytes += tmpGroup['size']
+                    usedBytes -= tmpGroup['size']
+                # update stats
+                if not dryRun:
+                    conn.execute("DELETE FROM files WHERE lastAccess<?",(int(timeNow-self.maxAge),))
+                    self._addStats(conn,{'nEvictedFiles':nEvicted,'evictedBytes':evictedBytes})
+                    conn.execute("INSERT OR REPLACE INTO stats (name,value) VALUES ('usedBytes',?)",
+                                 (usedBytes,))
+                    conn.execute("INSERT OR REPLACE INTO stats (name,value) VALUES ('nFiles',?)",
+                                 (len(groups)-nEvicted,))
+                    conn.execute("INSERT OR REPLACE INTO stats (name,value) VALUES ('lastEviction',?)",
+                                 (int(timeNow),))
+                    conn.commit()
+                tmpLog.debug("done evicted %s groups %s bytes, remaining %s bytes" % (nEvicted,evictedBytes,
+                                                                                      usedBytes))
+            finally:
+                conn.close()
+        finally:
+            fcntl.flock(lockFile,fcntl.LOCK_UN)
+            lockFile.close()
+
+
+
+# Singleton
+cacheManager = CacheManager()
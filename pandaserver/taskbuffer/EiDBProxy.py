@@ -23,6 +23,18 @@ class EiDBProxy(OraDBProxy.DBProxy):
     # constructor
     def __init__(self,useOtherError=False):
         OraDBProxy.DBProxy.__init__(self,useOtherError)
+        # max number of events per transaction
+        self.queryChunkSize = 50000
+        if hasattr(panda_config,'eiQueryChunkSize'):
+            self.queryChunkSize = panda_config.eiQueryChunkSize
+        # max number of rows per executemany
+        self.insertChunkSize = 10000
+        if hasattr(panda_config,'eiInsertChunkSize'):
+            self.insertChunkSize = panda_config.eiInsertChunkSize
+        # number of rows per fetch
+        self.fetchSize = 10000
+        if hasattr(panda_config,'eiFetchSize'):
+            self.fetchSize = panda_config.eiFetchSize
 
 
 
@@ -36,6 +48,31 @@ class EiDBProxy(OraDBProxy.DBProxy):
 
 
 
+    # split list to chunks
+    def getChunks(self,itemList,chunkSize):
+        for idx in range(0,len(itemList),chunkSize):
+            yield itemList[idx:idx+chunkSize]
+
+
+
+    # insert rows with executemany in chunks
+    def insertInChunks(self,sql,varMaps):
+        for tmpVarMaps in self.getChunks(varMaps,self.insertChunkSize):
+            self.cur.executemany(sql,tmpVarMaps)
+
+
+
+    # iterate over rows of the last query without loading all of them
+    def fetchInChunks(self):
+        while True:
+            tmpRes = self.cur.fetchmany(self.fetchSize)
+            if not tmpRes:
+                break
+            for tmpItem in tmpRes:
+                yield tmpItem
+
+
+
     # get index of AMI tag
     def getIndexAmiTag(self,tagList,amiTag):
         for idxTag,tagPattern in enumerate(tagList):
@@ -62,17 +99,17 @@ class EiDBProxy(OraDBProxy.DBProxy):
             sqlRE  = "INSERT INTO {0}.TMP_RUN_EVENT_PAIRS (runNumber,eventNumber) ".format(panda_config.schemaEI)
             sqlRE += "VALUES (:runNumber,:eventNumber) "
             varMaps = []
+            tmpRunEventSet = set()
             for runNumber,eventNumber in runEventList:
+                # remove duplication
+                if (runNumber,eventNumber) in tmpRunEventSet:
+                    continue
+                tmpRunEventSet.add((runNumber,eventNumber))
                 varMap = {}
                 varMap[':runNumber'] = runNumber
                 varMap[':eventNumber'] = eventNumber
                 varMaps.append(varMap)
-            # begin transaction
-            self.conn.begin()
-            self.cur.arraysize = 100000
-            # insert runs and events
-            self.cur.executemany(sqlRE+comment, varMaps)
-            # read GUIDs
+            # sql to read GUIDs
             varMap = {}
             if amiTags in [None,'']:
                 sqlRG  = "SELECT runNumber,eventNumber,guid_{0} ".format(dataType)
@@ -83,31 +120,37 @@ class EiDBProxy(OraDBProxy.DBProxy):
             if streamName != None:
                 sqlRG += "WHERE streamName=:streamName "
                 varMap[':streamName'] = streamName
-            self.cur.execute(sqlRG+comment, varMap)
-            resRG = self.cur.fetchall()
-            # commit
-            if not self._commit():
-                raise RuntimeError, 'Commit error'
             retValue = {}
             keyAmiIdxMap = {}
-            for tmpItem in resRG:
-                if amiTags in [None,'']:
-                    runNumber,eventNumber,guid = tmpItem
-                    # dummy
-                    idxTag = 0
-                else:
-                    runNumber,eventNumber,guid,amiTag = tmpItem
-                    # get index number for the AMI tag in the list
-                    idxTag = self.getIndexAmiTag(amiTags,amiTag)
-                    # didn't match
-                    if idxTag == None:
+            # the temporary table is cleared at commit
+            for tmpVarMaps in self.getChunks(varMaps,self.queryChunkSize):
+                # begin transaction
+                self.conn.begin()
+                # insert runs and events
+                self.insertInChunks(sqlRE+comment,tmpVarMaps)
+                # read GUIDs
+                self.cur.execute(sqlRG+comment, varMap)
+                for tmpItem in self.fetchInChunks():
+                    if amiTags in [None,'']:
+                        runNumber,eventNumber,guid = tmpItem
+                        # dummy
+                        idxTag = 0
+                    else:
+                        runNumber,eventNumber,guid,amiTag = tmpItem
+                        # get index number for the AMI tag in the list
+                        idxTag = self.getIndexAmiTag(amiTags,amiTag)
+                        # didn't match
+                        if idxTag == None:
+                            continue
+                    tmpKey = (runNumber,eventNumber)
+                    # use AMI tag in a preference orde
+                    if tmpKey in keyAmiIdxMap and keyAmiIdxMap[tmpKey] < idxTag:
                         continue
-                tmpKey = (runNumber,eventNumber)
-                # use AMI tag in a preference orde
-                if tmpKey in keyAmiIdxMap and keyAmiIdxMap[tmpKey] < idxTag:
-                    continue
-                keyAmiIdxMap[tmpKey] = idxTag
-                retValue[tmpKey] = [guid]
+                    keyAmiIdxMap[tmpKey] = idxTag
+                    retValue[tmpKey] = [guid]
+                # commit
+                if not self._commit():
+                    raise RuntimeError, 'Commit error'
             tmpLog.debug("found {0} events".format(len(retValue)))
             return True,retValue
         except:
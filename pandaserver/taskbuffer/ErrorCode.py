@@ -80,3 +80,9 @@ class EC_NotFound:
 class EC_Redirect:
     def __init__(self,url):
         self.url = url
+
+# file to be sent by the entry
+class EC_SendFile:
+    def __init__(self,path,contentType='application/octet-stream'):
+        self.path = path
+        self.contentType = contentType
@@ -1,4 +1,7 @@
 import re
+import datetime
+import threading
+import traceback
 
 from taskbuffer.TaskBuffer import taskBuffer
 from config import panda_config
@@ -86,51 +89,157 @@ class Share(Node):
         return
 
 
-class GlobalShares:
+# characters which make a share attribute a regular expression rather than a plain value
+_regex_chars = re.compile(r'[\\.^$*+?{}\[\]|()]')
+
+
+def compile_matcher(pattern):
     """
-    Class to manage the tree of shares
+    Return a function equivalent to re.match(pattern, value) is not None.
+    Plain values are compared with startswith since re.match anchors only at the beginning
     """
+    if _regex_chars.search(pattern) is None:
+        return lambda value: value is not None and value.startswith(pattern)
+    compiled = re.compile(pattern)
+    return lambda value: value is not None and compiled.match(value) is not None
 
-    def __init__(self):
 
-        # Initialize DB connection
-        taskBuffer.init(panda_config.dbhost, panda_config.dbpasswd, nDBConnection=1)
-        self.__task_buffer = taskBuffer
+class GlobalShares(object):
+    """
+    Class to manage the tree of shares
+    """
+
+    # share attributes and the corresponding task attributes
+    attribute_map = (('prodsourcelabel', 'prodSourceLabel'),
+                     ('workinggroup', 'workingGroup'),
+                     ('campaign', 'campaign'),
+                     ('processingtype', 'processingType'))
 
-        # Root dummy node
-        self.tree = Share('root', 100, None, None, None, None, None)
+    # maximum number of cached resolutions
+    max_cache_size = 10000
 
-        # Get top level shares from DB
-        shares_top_level = self.__task_buffer.getShares(parents=None)
+    def __init__(self):
 
-        # Load branches
-        for (name, value, parent, prodsourcelabel, workinggroup, campaign, processingtype) in shares_top_level:
-            share = Share(name, value, parent, prodsourcelabel, workinggroup, campaign, processingtype)
-            self.tree.children.append(self.__load_branch(share))
+        self.__task_buffer = None
 
-        # Normalize the values in the database
-        self.tree.normalize()
+        # the tree is loaded lazily at the first access
+        self.__tree = None
+        self.__leave_shares = []
+        self.__leave_names = set()
+        self.__matchers = []
+        self.__resolved = {}
+        self.__last_load = None
 
-        # get the leave shares (the ones not having more children)
-        self.leave_shares = self.tree.get_leaves()
+        # reload interval
+        self.__reload_interval = datetime.timedelta(minutes=10)
+        if hasattr(panda_config, 'global_shares_reload_interval'):
+            self.__reload_interval = datetime.timedelta(seconds=panda_config.global_shares_reload_interval)
 
+        self.__lock = threading.Lock()
+        self.__reloading = False
 
-    def __load_branch(self, share):
+    def __load(self):
         """
-        Recursively load a branch
+        Load the whole tree with one query and build the decision index
         """
-        node = Share(share.name, share.value, share.parent, share.prodsourcelabel,
-                     share.workinggroup, share.campaign, share.processingtype)
+        if self.__task_buffer is None:
+            # Initialize DB connection
+            taskBuffer.init(panda_config.dbhost, panda_config.dbpasswd, nDBConnection=1)
+            self.__task_buffer = taskBuffer
 
-        children = self.__task_buffer.getShares(parents=share.name)
-        if not children:
-            return node
+        # Get all shares from DB
+        shares_all = self.__task_buffer.getShares(parents='')
 
-        for (name, value, parent, prodsourcelabel, workinggroup, campaign, processingtype) in children:
-            child = Share(name, value, parent, prodsourcelabel, workinggroup, campaign, processingtype)
-            node.children.append(self.__load_branch(child))
+        # Root dummy node
+        tree = Share('root', 100, None, None, None, None, None)
+
+        # Build nodes keeping the order of rows among siblings
+        nodes = {}
+        for (name, value, parent, prodsourcelabel, workinggroup, campaign, processingtype) in shares_all:
+            nodes[name] = Share(name, value, parent, prodsourcelabel, workinggroup, campaign, processingtype)
+        for (name, value, parent, prodsourcelabel, workinggroup, campaign, processingtype) in shares_all:
+            if parent is None:
+                tree.add_child(nodes[name])
+            elif parent in nodes:
+                nodes[parent].add_child(nodes[name])
+            else:
+                _logger.warning("Share {0} has unknown parent {1}".format(name, parent))
 
-        return node
+        # Normalize the values in the database
+        tree.normalize()
+
+        # get the leave shares (the ones not having more children)
+        leave_shares = tree.get_leaves([])
+
+        # compile the matchers of the leaves in the order of evaluation
+        matchers = []
+        for share in leave_shares:
+            share_matchers = []
+            for share_attribute, task_attribute in self.attribute_map:
+                pattern = getattr(share, share_attribute)
+                if pattern is not None:
+                    share_matchers.append((task_attribute, compile_matcher(pattern)))
+            matchers.append((share.name, share_matchers))
+
+        # swap
+        with self.__lock:
+            self.__tree = tree
+            self.__leave_shares = leave_shares
+            self.__leave_names = set([share.name for share in leave_shares])
+            self.__matchers = matchers
+            self.__resolved = {}
+            self.__last_load = datetime.datetime.utcnow()
+
+    def __reload_in_background(self):
+        """
+        Reload the tree while callers keep using the current one
+        """
+        try:
+            self.__load()
+        except Exception:
+            _logger.error("Failed to reload global shares: {0}".format(traceback.format_exc()))
+        finally:
+            self.__reloading = False
+
+    def __check_loaded(self):
+        """
+        Load the tree at the first access and trigger a reload when it is old
+        """
+        if self.__tree is None:
+            with self.__lock:
+                if self.__tree is not None:
+                    return
+                self.__reloading = True
+            try:
+                self.__load()
+            finally:
+                self.__reloading = False
+            return
+
+        if datetime.datetime.utcnow() - self.__last_load > self.__reload_interval:
+            with self.__lock:
+                if self.__reloading:
+                    return
+                self.__reloading = True
+            thr = threading.Thread(target=self.__reload_in_background)
+            thr.setDaemon(True)
+            thr.start()
+
+    @property
+    def tree(self):
+        self.__check_loaded()
+        return self.__tree
+
+    @property
+    def leave_shares(self):
+        self.__check_loaded()
+        return self.__leave_shares
+
+    def reload(self):
+        """
+        Force to reload the tree
+        """
+        self.__load()
 
     def compare_share_task(self, share, task):
         """
@@ -156,12 +265,28 @@ class GlobalShares:
         Return the share based on a task specification
         """
 
-        selected_share_name = 'Undefined'
+        self.__check_loaded()
+
+        key = tuple([getattr(task, task_attribute) for share_attribute, task_attribute in self.attribute_map])
+
+        # matchers and cache are swapped together at reload
+        matchers, resolved = self.__matchers, self.__resolved
+
+        selected_share_name = resolved.get(key)
+        if selected_share_name is None:
+            selected_share_name = 'Undefined'
+            values = dict(zip([task_attribute for share_attribute, task_attribute in self.attribute_map], key))
+            for share_name, share_matchers in matchers:
+                for task_attribute, matcher in share_matchers:
+                    if not matcher(values[task_attribute]):
+                        break
+                else:
+                    selected_share_name = share_name
+                    break
 
-        for share in self.leave_shares:
-            if self.compare_share_task(share, task):
-                selected_share_name = share.name
-                break
+            if len(resolved) >= self.max_cache_size:
+                resolved.clear()
+            resolved[key] = selected_share_name
 
         if selected_share_name=='Undefined':
             _logger.warning("No share matching jediTaskId={0} (prodSourceLabel={1} workingGroup={2} campaign={3} )".
@@ -173,13 +298,9 @@ class GlobalShares:
         """
         Checks whether the share is a valid leave share
         """
-        for share in self.leave_shares:
-            if share_name == share.name:
-                # Share found
-                return True
+        self.__check_loaded()
 
-        # Share not found
-        return False
+        return share_name in self.__leave_names
 
 # Singleton
 GlobalShares = GlobalShares()
@@ -0,0 +1,212 @@
+"""
+in-process snapshot of job statistics shared by brokerage and fairshare
+
+"""
+
+import sys
+import copy
+import time
+import datetime
+import threading
+
+from config import panda_config
+from pandalogger.PandaLogger import PandaLogger
+
+# logger
+_logger = PandaLogger().getLogger('JobStatsSnapshot')
+
+
+# key for the raw rows of MV_JOBSACTIVE4_STATS
+_ACTIVE_STATS_KEY = ('getActiveJobStatsSnapshot',())
+
+
+# snapshot of aggregated job statistics
+class JobStatsSnapshot:
+
+    # constructor
+    def __init__(self):
+        # taskbuffer
+        self.taskBuffer = None
+        # cached entries : key -> {'value':obj,'lastUpdated':datetime,'lastAccess':datetime}
+        self.entries = {}
+        # refresh interval in sec
+        self.interval = 60
+        if hasattr(panda_config,'jobStatsSnapshotInterval'):
+            self.interval = panda_config.jobStatsSnapshotInterval
+        # entries which are not accessed for this period are dropped
+        self.expiration = datetime.timedelta(seconds=self.interval*10)
+        # refresh thread
+        self.thread = None
+        # lock
+        self.lock = threading.Lock()
+
+
+    # check if snapshot is enabled
+    def isEnabled(self):
+        return hasattr(panda_config,'useJobStatsSnapshot') and panda_config.useJobStatsSnapshot == True
+
+
+    # set task buffer and start refresh thread
+    def init(self,taskBuffer):
+        if not self.isEnabled():
+            return
+        self.lock.acquire()
+        if self.taskBuffer == None:
+            self.taskBuffer = taskBuffer
+        if self.thread == None:
+            self.thread = threading.Thread(target=self.run,name='JobStatsSnapshot')
+            self.thread.setDaemon(True)
+            self.thread.start()
+        self.lock.release()
+
+
+    # get object to read statistics from, i.e. taskbuffer itself if snapshot is disabled
+    def getSource(self,taskBuffer):
+        if not self.isEnabled():
+            return taskBuffer
+        self.init(taskBuffer)
+        return self
+
+
+    # call the taskbuffer method corresponding to a key
+    def _fetch(self,key):
+        methodName,args = key
+        return apply(getattr(self.taskBuffer,methodName),args)
+
+
+    # get a copy of the cached value. load it synchronously if it is not yet cached
+    def _get(self,methodName,*args):
+        key = (methodName,args)
+        self.lock.acquire()
+        entry = self.entries.get(key)
+        if entry != None:
+            entry['lastAccess'] = datetime.datetime.utcnow()
+        self.lock.release()
+        if entry == None:
+            _logger.debug("load %s%s" % key)
+            value = self._fetch(key)
+            timeNow = datetime.datetime.utcnow()
+            entry = {'value':value,'lastUpdated':timeNow,'lastAccess':timeNow}
+            self.lock.acquire()
+            self.entries[key] = entry
+            self.lock.release()
+        # callers modify returned dicts in place
+        return copy.deepcopy(entry['value'])
+
+
+    # refresh loop
+    def run(self):
+        while True:
+            try:
+                self.refresh()
+            except:
+                errtype,errvalue = sys.exc_info()[:2]
+                _logger.error("refresh : %s %s" % (errtype,errvalue))
+            time.sleep(self.interval)
+
+
+    # refresh all entries which were accessed recently
+    def refresh(self):
+        timeNow = datetime.datetime.utcnow()
+        self.lock.acquire()
+        # drop unused entries
+        for key in self.entries.keys():
+            if key != _ACTIVE_STATS_KEY and timeNow-self.entries[key]['lastAccess'] > self.expiration:
+                del self.entries[key]
+        keys = self.entries.keys()
+        self.lock.release()
+        # the raw rows are always kept since pilot requests read them without loading
+        if not _ACTIVE_STATS_KEY in keys:
+            keys.append(_ACTIVE_STATS_KEY)
+        for key in keys:
+            try:
+                value = self._fetch(key)
+            except:
+                errtype,errvalue = sys.exc_info()[:2]
+                _logger.error("refresh %s%s : %s %s" % (key[0],key[1],errtype,errvalue))
+                continue
+            # keep the old value when the query failed
+            if value == None:
+                continue
+            self.lock.acquire()
+            if self.entries.has_key(key):
+                self.entries[key]['value'] = value
+                self.entries[key]['lastUpdated'] = datetime.datetime.utcnow()
+            else:
+                self.entries[key] = {'value':value,'lastUpdated':datetime.datetime.utcnow(),
+                                     'lastAccess':timeNow}
+            self.lock.release()
+        _logger.debug("refreshed %s entries in %s" % (len(keys),datetime.datetime.utcnow()-timeNow))
+
+
+    # get job statistics
+    def getJobStatistics(self,forAnal=None):
+        return self._get('getJobStatistics',False,False,'','','',forAnal)
+
+
+    # get job statistics for brokerage
+    def getJobStatisticsBrokerage(self,minPrio=None,maxPrio=None):
+        return self._get('getJobStatisticsBrokerage',minPrio,maxPrio)
+
+
+    # get job statistics for analysis brokerage
+    def getJobStatisticsAnalBrokerage(self,minPriority=None):
+        return self._get('getJobStatisticsAnalBrokerage',minPriority)
+
+
+    # get nRunning in site data
+    def getnRunningInSiteData(self):
+        return self._get('getnRunningInSiteData')
+
+
+    # get fareshare policy
+    def getFaresharePolicy(self):
+        return self._get('getFaresharePolicy')
+
+
+    # get raw rows of active job statistics without loading. None if not yet available
+    def getActiveJobStats(self):
+        self.lock.acquire()
+        entry = self.entries.get(_ACTIVE_STATS_KEY)
+        self.lock.release()
+        if entry == None:
+            return None
+        return entry['value']
+
+
+    # get the number of active jobs for given site/cloud/status/label. None matches everything
+    def getCounts(self,computingSite=None,cloud=None,jobStatus=None,prodSourceLabel=None):
+        rows = self.getActiveJobStats()
+        if rows == None:
+            return None
+        nJobs = 0
+        for tmpSite,tmpCloud,tmpLabel,tmpStatus,tmpGroup,tmpType,tmpID,tmpPrio,tmpCnt,tmpMaxPrio,tmpHS06 in rows:
+            if computingSite != None and tmpSite != computingSite:
+                continue
+            if cloud != None and tmpCloud != cloud:
+                continue
+            if jobStatus != None and tmpStatus != jobStatus:
+                continue
+            if prodSourceLabel != None and tmpLabel != prodSourceLabel:
+                continue
+            nJobs += tmpCnt
+        return nJobs
+
+
+    # get the number of active jobs per site, label and status
+    def getCountsPerSite(self):
+        rows = self.getActiveJobStats()
+        if rows == None:
+            return None
+        retMap = {}
+        for tmpSite,tmpCloud,tmpLabel,tmpStatus,tmpGroup,tmpType,tmpID,tmpPrio,tmpCnt,tmpMaxPrio,tmpHS06 in rows:
+            retMap.setdefault(tmpSite,{})
+            retMap[tmpSite].setdefault(tmpLabel,{})
+            retMap[tmpSite][tmpLabel].setdefault(tmpStatus,0)
+            retMap[tmpSite][tmpLabel][tmpStatus] += tmpCnt
+        return retMap
+
+
+
+# Singleton
+jobStatsSnapshot = JobStatsSnapshot()
@@ -41,3 +41,19 @@ def getHS06sec(startTime,endTime,baseWalltime,cpuEfficiency,corePower,coreCount)
     except:
         return None
     
+
+
+
+# group jobs by computingSite keeping the order of first appearance of sites and the order of jobs in each site
+def groupJobsBySite(jobs):
+    siteList = []
+    jobMap = {}
+    for tmpJob in jobs:
+        if not jobMap.has_key(tmpJob.computingSite):
+            siteList.append(tmpJob.computingSite)
+            jobMap[tmpJob.computingSite] = []
+        jobMap[tmpJob.computingSite].append(tmpJob)
+    retList = []
+    for tmpSite in siteList:
+        retList += jobMap[tmpSite]
+    return retList
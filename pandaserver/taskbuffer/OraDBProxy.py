@@ -33,6 +33,7 @@ from DatasetSpec import DatasetSpec
 from CloudTaskSpec import CloudTaskSpec
 from WrappedCursor import WrappedCursor
 from Utils import create_shards
+from JobStatsSnapshot import jobStatsSnapshot
 from pandalogger.PandaLogger import PandaLogger
 from pandalogger.LogWrapper import LogWrapper
 from config import panda_config
@@ -6177,6 +6178,116 @@ class DBProxy:
             return []
 
 
+    # update status of datasets in bulk. only modificationdate is updated if newStatus is None
+    def updateDatasetStatusBulk(self,vuids,newStatus,oldStatus=None):
+        comment = ' /* DBProxy.updateDatasetStatusBulk */'
+        methodName = comment.split(' ')[-2].split('.')[-1]
+        tmpLog = LogWrapper(_logger,methodName+' <{0}>'.format(newStatus))
+        tmpLog.debug("start for {0} datasets".format(len(vuids)))
+        try:
+            nRows = 0
+            self.conn.begin()
+            for tmpShard in create_shards(vuids,500):
+                varMap = {}
+                sql  = "UPDATE ATLAS_PANDA.Datasets SET modificationdate=CURRENT_DATE"
+                if newStatus != None:
+                    sql += ",status=:newStatus"
+                    varMap[':newStatus'] = newStatus
+                sql += " WHERE vuid IN ("
+                for idx,vuid in enumerate(tmpShard):
+                    varMap[':vuid{0}'.format(idx)] = vuid
+                sql += ",".join([':vuid{0}'.format(idx) for idx in range(len(tmpShard))]) + ") "
+                if oldStatus != None:
+                    sql += "AND status=:oldStatus "
+                    varMap[':oldStatus'] = oldStatus
+                self.cur.execute(sql+comment,varMap)
+                nRows += self.cur.rowcount
+            if not self._commit():
+                raise RuntimeError, 'Commit error'
+            tmpLog.debug("updated {0} rows".format(nRows))
+            return nRows
+        except:
+            self._rollback()
+            self.dumpErrorMessage(_logger,methodName)
+            return None
+
+
+    # get output datasets which still have files to be processed
+    def getDatasetsWithPendingFiles(self,names):
+        comment = ' /* DBProxy.getDatasetsWithPendingFiles */'
+        methodName = comment.split(' ')[-2].split('.')[-1]
+        tmpLog = LogWrapper(_logger,methodName)
+        tmpLog.debug("start for {0} datasets".format(len(names)))
+        try:
+            retSet = set()
+            self.conn.begin()
+            self.cur.arraysize = 10000
+            for tmpShard in create_shards(names,500):
+                varMap = {}
+                varMap[':status1'] = 'ready'
+                varMap[':status2'] = 'failed'
+                varMap[':status3'] = 'skipped'
+                varMap[':status4'] = 'merging'
+                varMap[':status5'] = 'finished'
+                sql  = "SELECT /*+ index(tab FILESTABLE4_DESTDBLOCK_IDX) */ DISTINCT destinationDBlock "
+                sql += "FROM ATLAS_PANDA.filesTable4 tab WHERE destinationDBlock IN ("
+                for idx,name in enumerate(tmpShard):
+                    varMap[':name{0}'.format(idx)] = name
+                sql += ",".join([':name{0}'.format(idx) for idx in range(len(tmpShard))]) + ") "
+                sql += "AND NOT status IN (:status1,:status2,:status3,:status4,:status5) "
+                self.cur.execute(sql+comment,varMap)
+                for destinationDBlock, in self.cur.fetchall():
+                    retSet.add(destinationDBlock)
+            if not self._commit():
+                raise RuntimeError, 'Commit error'
+            tmpLog.debug("{0} datasets have pending files".format(len(retSet)))
+            return retSet
+        except:
+            self._rollback()
+            self.dumpErrorMessage(_logger,methodName)
+            return None
+
+
+    # get datasets and the number of unfinished files in bulk. return {name:(DatasetSpec,nUnfinished)}
+    def queryDatasetsWithUnfinishedFiles(self,names,fileStatus='unknown'):
+        comment = ' /* DBProxy.queryDatasetsWithUnfinishedFiles */'
+        methodName = comment.split(' ')[-2].split('.')[-1]
+        tmpLog = LogWrapper(_logger,methodName)
+        tmpLog.debug("start for {0} datasets".format(len(names)))
+        try:
+            retMap = {}
+            self.conn.begin()
+            self.cur.arraysize = 10000
+            for tmpShard in create_shards(list(names),500):
+                varMap = {}
+                varMap[':fileStatus'] = fileStatus
+                for idx,name in enumerate(tmpShard):
+                    varMap[':name{0}'.format(idx)] = name
+                nameList = ",".join([':name{0}'.format(idx) for idx in range(len(tmpShard))])
+                sql  = "SELECT {0},NVL(cnt.nFiles,0) ".format(DatasetSpec.columnNames())
+                sql += "FROM ATLAS_PANDA.Datasets tab LEFT OUTER JOIN "
+                sql += "(SELECT /*+ index(f FILESTABLE4_DESTDBLOCK_IDX) */ destinationDBlock,COUNT(*) nFiles "
+                sql += "FROM ATLAS_PANDA.filesTable4 f WHERE destinationDBlock IN ({0}) ".format(nameList)
+                sql += "AND status=:fileStatus GROUP BY destinationDBlock) cnt "
+                sql += "ON cnt.destinationDBlock=tab.name "
+                sql += "WHERE tab.name IN ({0}) ".format(nameList)
+                self.cur.execute(sql+comment,varMap)
+                for tmpItem in self.cur.fetchall():
+                    dataset = DatasetSpec()
+                    dataset.pack(tmpItem[:-1])
+                    # same as queryDatasetWithMap which takes the first one
+                    if not retMap.has_key(dataset.name):
+                        retMap[dataset.name] = (dataset,tmpItem[-1])
+            if not self._commit():
+                raise RuntimeError, 'Commit error'
+            tmpLog.debug("got {0} datasets".format(len(retMap)))
+            return retMap
+        except:
+            self._rollback()
+            self.dumpErrorMessage(_logger,methodName)
+            return None
+
+
     # query dataset with map
     def queryDatasetWithMap(self,map):
         comment = ' /* DBProxy.queryDatasetWithMap */'               
@@ -7289,6 +7400,83 @@ class DBProxy:
         return []
 
 
+    # update input files in dispatch dataset and move ready jobs to jobsActive4 without loading JobSpecs
+    def activateJobsInDispatchBlock(self,dispatchDBlock,chunkSize=500):
+        comment = ' /* DBProxy.activateJobsInDispatchBlock */'
+        methodName = comment.split(' ')[-2].split('.')[-1]
+        tmpLog = LogWrapper(_logger,methodName+' <dispatchDBlock={0}>'.format(dispatchDBlock))
+        tmpLog.debug("start")
+        # update input files
+        pandaIDs = self.updateInFilesReturnPandaIDs(dispatchDBlock,'ready')
+        tmpLog.debug("{0} jobs with updated files".format(len(pandaIDs)))
+        # copy rows with new status
+        colExprs = []
+        for attr in JobSpec._attributes:
+            if attr == 'jobStatus':
+                colExprs.append(':newJobStatus')
+            elif attr == 'modificationTime':
+                colExprs.append('CURRENT_DATE')
+            elif attr == 'stateChangeTime':
+                # set stateChangeTime for defined->activated but not for assigned->activated
+                colExprs.append('CASE WHEN jobStatus=:oldJobStatus2 THEN CURRENT_DATE ELSE stateChangeTime END')
+            else:
+                colExprs.append(attr)
+        sqlI  = "INSERT INTO ATLAS_PANDA.jobsActive4 ({0}) ".format(JobSpec.columnNames())
+        sqlI += "SELECT {0} FROM ATLAS_PANDA.jobsDefined4 WHERE PandaID=:PandaID ".format(','.join(colExprs))
+        sqlD  = "DELETE FROM ATLAS_PANDA.jobsDefined4 WHERE PandaID=:PandaID "
+        sqlL  = "INSERT INTO ATLAS_PANDA.jobs_StatusLog "
+        sqlL += "(PandaID,modificationTime,jobStatus,prodSourceLabel,cloud,computingSite,modificationHost) "
+        sqlL += "SELECT PandaID,CURRENT_DATE,jobStatus,prodSourceLabel,cloud,computingSite,:modificationHost "
+        sqlL += "FROM ATLAS_PANDA.jobsActive4 WHERE PandaID=:PandaID "
+        recordStatus = hasattr(panda_config,'record_statuschange') and panda_config.record_statuschange == True
+        activatedIDs = []
+        try:
+            for tmpShard in create_shards(pandaIDs,chunkSize):
+                # begin transaction
+                self.conn.begin()
+                # lock jobs which have all input files ready
+                varMap = {}
+                varMap[':oldJobStatus1'] = 'assigned'
+                varMap[':oldJobStatus2'] = 'defined'
+                varMap[':type']    = 'input'
+                varMap[':status1'] = 'ready'
+                varMap[':status2'] = 'cached'
+                for idx,pandaID in enumerate(tmpShard):
+                    varMap[':PandaID{0}'.format(idx)] = pandaID
+                sqlS  = "SELECT PandaID FROM ATLAS_PANDA.jobsDefined4 tab "
+                sqlS += "WHERE PandaID IN ({0}) ".format(','.join([':PandaID{0}'.format(idx) for idx in range(len(tmpShard))]))
+                sqlS += "AND jobStatus IN (:oldJobStatus1,:oldJobStatus2) AND commandToPilot IS NULL "
+                sqlS += "AND NOT EXISTS (SELECT 1 FROM ATLAS_PANDA.filesTable4 f WHERE f.PandaID=tab.PandaID "
+                sqlS += "AND f.type=:type AND NOT f.status IN (:status1,:status2)) "
+                sqlS += "FOR UPDATE "
+                self.cur.arraysize = chunkSize
+                self.cur.execute(sqlS+comment,varMap)
+                readyIDs = [pandaID for pandaID, in self.cur.fetchall()]
+                if readyIDs != []:
+                    # insert
+                    varMaps = []
+                    for pandaID in readyIDs:
+                        varMaps.append({':PandaID':pandaID,':newJobStatus':'activated',':oldJobStatus2':'defined'})
+                    self.cur.executemany(sqlI+comment,varMaps)
+                    # delete
+                    self.cur.executemany(sqlD+comment,[{':PandaID':pandaID} for pandaID in readyIDs])
+                    # record status change
+                    if recordStatus:
+                        self.cur.executemany(sqlL+comment,[{':PandaID':pandaID,':modificationHost':self.myHostName}
+                                                           for pandaID in readyIDs])
+                # commit
+                if not self._commit():
+                    raise RuntimeError, 'Commit error'
+                activatedIDs += readyIDs
+            tmpLog.debug("activated {0} jobs".format(len(activatedIDs)))
+            return activatedIDs
+        except:
+            # roll back
+            self._rollback()
+            self.dumpErrorMessage(_logger,methodName)
+            return None
+
+
     # update file status in dispatch dataset
     def updateFileStatusInDisp(self,dataset,fileStatusMap):
         comment = ' /* DBProxy.updateFileStatusInDisp */'                                
@@ -8967,6 +9155,97 @@ class DBProxy:
             return False
         
         
+    # update site data with pilot counts in bulk
+    def updateSiteDataBulk(self,hostID,pilotRequests):
+        comment = ' /* DBProxy.updateSiteDataBulk */'
+        methodName = comment.split(' ')[-2].split('.')[-1]
+        tmpLog = LogWrapper(_logger,methodName+' <{0}>'.format(hostID))
+        tmpLog.debug("start for {0} sites".format(len(pilotRequests)))
+
+        sqlDel =  "DELETE FROM ATLAS_PANDAMETA.SiteData WHERE LASTMOD<:LASTMOD"
+
+        sqlRst =  "UPDATE ATLAS_PANDAMETA.SiteData "
+        sqlRst += "SET GETJOB=:GETJOB,UPDATEJOB=:UPDATEJOB,NOJOB=:NOJOB,GETJOBABS=:GETJOBABS,UPDATEJOBABS=:UPDATEJOBABS,NOJOBABS=:NOJOBABS "
+        sqlRst += "WHERE HOURS=:HOURS AND LASTMOD<:LASTMOD"
+
+        # columns set by merge
+        countCols = ['GETJOB','UPDATEJOB','NOJOB','GETJOBABS','UPDATEJOBABS','NOJOBABS']
+        sqlSet  = ",".join(["tabD.{0}=tabS.{0}".format(tmpCol) for tmpCol in countCols])
+        sqlSet += ",tabD.LASTMOD=CURRENT_DATE "
+        sqlIns  = "INSERT (SITE,FLAG,HOURS,{0},LASTMOD,NSTART,FINISHED,FAILED,DEFINED,ASSIGNED,WAITING,".format(",".join(countCols))
+        sqlIns += "ACTIVATED,HOLDING,RUNNING,TRANSFERRING) "
+        sqlIns += "VALUES (tabS.SITE,tabS.FLAG,tabS.HOURS,{0},CURRENT_DATE,0,0,0,0,0,0,0,0,0,0)".format(
+            ",".join(["tabS.{0}".format(tmpCol) for tmpCol in countCols]))
+
+        # per-host rows
+        sqlMH  = "MERGE INTO ATLAS_PANDAMETA.SiteData tabD USING ("
+        sqlMH += "SELECT :SITE SITE,:FLAG FLAG,:HOURS HOURS,"
+        sqlMH += ",".join([":{0} {0}".format(tmpCol) for tmpCol in countCols]) + " FROM dual) tabS "
+        sqlMH += "ON (tabD.SITE=tabS.SITE AND tabD.FLAG=tabS.FLAG AND tabD.HOURS=tabS.HOURS) "
+        sqlMH += "WHEN MATCHED THEN UPDATE SET " + sqlSet
+        sqlMH += "WHEN NOT MATCHED THEN " + sqlIns
+
+        # summed rows, which contain averages over hosts
+        sqlAvg = "CASE WHEN SUM(NVL({0},0))>=COUNT(*) THEN TRUNC(SUM(NVL({0},0))/COUNT(*)) ELSE SUM(NVL({0},0)) END {0}"
+        sqlMS  = "MERGE INTO ATLAS_PANDAMETA.SiteData tabD USING ("
+        sqlMS += "SELECT SITE,CASE WHEN SUBSTR(SITE,1,6)='ANALY_' THEN 'analysis' ELSE 'production' END FLAG,HOURS,"
+        sqlMS += ",".join([sqlAvg.format(tmpCol) for tmpCol in countCols]) + " "
+        sqlMS += "FROM ATLAS_PANDAMETA.SiteData WHERE HOURS=:HOURS AND FLAG NOT IN (:flag1,:flag2,:flag3) "
+        sqlMS += "GROUP BY SITE,HOURS) tabS "
+        sqlMS += "ON (tabD.SITE=tabS.SITE AND tabD.FLAG=tabS.FLAG AND tabD.HOURS=tabS.HOURS) "
+        sqlMS += "WHEN MATCHED THEN UPDATE SET " + sqlSet
+        sqlMS += "WHEN NOT MATCHED THEN " + sqlIns
+        try:
+            self.conn.begin()
+            # delete old records
+            varMap = {}
+            varMap[':LASTMOD'] = datetime.datetime.utcnow()-datetime.timedelta(hours=48)
+            self.cur.execute(sqlDel+comment,varMap)
+            # set 0 to old records
+            varMap = {}
+            varMap[':HOURS'] = 3
+            for tmpCol in countCols:
+                varMap[':'+tmpCol] = 0
+            varMap[':LASTMOD'] = datetime.datetime.utcnow()-datetime.timedelta(hours=varMap[':HOURS'])
+            self.cur.execute(sqlRst+comment,varMap)
+            # getJob, updateJob and noJob entries contain the number of slots/nodes that submitted the request
+            # getJobAbs, updateJobAbs and noJobAbs entries contain the absolute number of requests
+            varMaps = []
+            for tmpSite,tmpVal in pilotRequests.iteritems():
+                varMap = {}
+                varMap[':SITE']  = tmpSite
+                varMap[':FLAG']  = hostID
+                varMap[':HOURS'] = 3
+                for tmpMethod in ['getJob','updateJob','noJob']:
+                    tmpKey = ':' + tmpMethod.upper()
+                    if tmpVal.has_key(tmpMethod):
+                        varMap[tmpKey] = len(tmpVal[tmpMethod])
+                        varMap[tmpKey+'ABS'] = sum(tmpVal[tmpMethod].values())
+                    else:
+                        varMap[tmpKey] = 0
+                        varMap[tmpKey+'ABS'] = 0
+                varMaps.append(varMap)
+            for tmpShard in create_shards(varMaps,1000):
+                self.cur.executemany(sqlMH+comment,tmpShard)
+            # update summed rows
+            varMap = {}
+            varMap[':HOURS'] = 3
+            varMap[':flag1'] = 'production'
+            varMap[':flag2'] = 'analysis'
+            varMap[':flag3'] = 'test'
+            self.cur.execute(sqlMS+comment,varMap)
+            # commit
+            if not self._commit():
+                raise RuntimeError, 'Commit error'
+            tmpLog.debug("done")
+            return True
+        except:
+            # roll back
+            self._rollback()
+            self.dumpErrorMessage(_logger,methodName)
+            return False
+
+
     # get site data
     def getCurrentSiteData(self):
         comment = ' /* DBProxy.getCurrentSiteData */'
@@ -9193,8 +9472,42 @@ class DBProxy:
             return {}
 
 
-    # get site info
-    def getSiteInfo(self):
+    # get lastmod of sites to detect changes in schedconfig
+    def getSiteModTimes(self):
+        comment = ' /* DBProxy.getSiteModTimes */'
+        _logger.debug("getSiteModTimes start")
+        try:
+            # set autocommit on
+            self.conn.begin()
+            # select
+            sql = "SELECT nickname,siteid,lastmod FROM ATLAS_PANDAMETA.schedconfig WHERE siteid IS NOT NULL"
+            self.cur.arraysize = 10000
+            self.cur.execute(sql+comment)
+            res = self.cur.fetchall()
+            # commit
+            if not self._commit():
+                raise RuntimeError, 'Commit error'
+            retMap = {}
+            for nickname,siteid,lastmod in res:
+                # skip invalid siteid
+                if siteid in [None,'']:
+                    continue
+                # change None to '' as getSiteInfo does
+                if lastmod == None:
+                    lastmod = ''
+                retMap[nickname] = (siteid,lastmod)
+            _logger.debug("getSiteModTimes done with {0} sites".format(len(retMap)))
+            return retMap
+        except:
+            type, value, traceBack = sys.exc_info()
+            _logger.error("getSiteModTimes : %s %s" % (type,value))
+            # roll back
+            self._rollback()
+            return None
+
+
+    # get site info. siteIDs is a list of siteIDs to get only some sites
+    def getSiteInfo(self,siteIDs=None):
         comment = ' /* DBProxy.getSiteInfo */'
         _logger.debug("getSiteInfo start")
         try:
@@ -9239,8 +9552,17 @@ class DBProxy:
             sql+= "LEFT JOIN ATLAS_PANDA.panda_site b ON a.siteid=b.panda_site_name) "
             sql+= "LEFT JOIN ATLAS_PANDA.site c ON b.site_name=c.site_name "
             sql+= "WHERE siteid IS NOT NULL "
+            varMap = {}
+            if siteIDs != None:
+                sql += "AND siteid IN ("
+                for idxSite,tmpSiteID in enumerate(siteIDs):
+                    tmpKey = ':siteid{0}'.format(idxSite)
+                    sql += '{0},'.format(tmpKey)
+                    varMap[tmpKey] = tmpSiteID
+                sql = sql[:-1]
+                sql += ") "
             self.cur.arraysize = 10000            
-            self.cur.execute(sql+comment)
+            self.cur.execute(sql+comment,varMap)
             resList = self.cur.fetchall()
             # commit
             if not self._commit():
@@ -9704,28 +10026,38 @@ class DBProxy:
                 sqlT += ',workqueue_id'
             if usingPrio:
                 sqlT += ',currentPriority'
-            # set autocommit on
-            self.conn.begin()
-            self.cur.arraysize = 100000
-            # get site info
-            varMap = {}
-            for tmpKey,tmpVal in varMapAll.iteritems():
-                varMap[tmpKey] = tmpVal
-            for tmpKey,tmpVal in varMapSite.iteritems():
-                varMap[tmpKey] = tmpVal
-            sql = sqlH + sqlSite + sqlT
-            self.cur.execute(sql+comment,varMap)
-            res = self.cur.fetchall()
-            # commit
-            if not self._commit():
-                raise RuntimeError, 'Commit error'
+            # use the snapshot of job statistics if available
+            statRows = jobStatsSnapshot.getActiveJobStats()
+            if statRows != None:
+                res = self.aggregateActiveJobStats(statRows,[siteName]+aggSites,None,usingGroup,
+                                                   usingType,usingID,usingPrio)
+            else:
+                # set autocommit on
+                self.conn.begin()
+                self.cur.arraysize = 100000
+                # get site info
+                varMap = {}
+                for tmpKey,tmpVal in varMapAll.iteritems():
+                    varMap[tmpKey] = tmpVal
+                for tmpKey,tmpVal in varMapSite.iteritems():
+                    varMap[tmpKey] = tmpVal
+                sql = sqlH + sqlSite + sqlT
+                self.cur.execute(sql+comment,varMap)
+                res = self.cur.fetchall()
+                # commit
+                if not self._commit():
+                    raise RuntimeError, 'Commit error'
             # no info about the site
             if res == None or len(res) == 0:
                 _logger.debug("getCriteriaForProdShare %s : ret=None - no jobs" % siteName)
                 return retForNone
             nSiteRow = len(res)
             # get cloud info
-            if usingCloud != '':
+            if usingCloud != '' and statRows != None:
+                resC = self.aggregateActiveJobStats(statRows,None,usingCloud,usingGroup,
+                                                    usingType,usingID,usingPrio)
+                res += resC
+            elif usingCloud != '':
                 # set autocommit on
                 self.conn.begin()
                 self.cur.arraysize = 100000
@@ -10209,6 +10541,74 @@ class DBProxy:
             return retForNone
 
 
+    # get active job statistics for the snapshot shared by brokerage and fairshare
+    def getActiveJobStatsSnapshot(self):
+        comment = ' /* DBProxy.getActiveJobStatsSnapshot */'
+        _logger.debug("getActiveJobStatsSnapshot start")
+        sql  = "SELECT computingSite,cloud,prodSourceLabel,jobStatus,workingGroup,processingType,workqueue_id,"
+        sql += "currentPriority,SUM(num_of_jobs),MAX(currentPriority),SUM(num_of_jobs*coreCount*corePower) FROM ("
+        sql += "SELECT num_of_jobs,computingSite,tabS.cloud,prodSourceLabel,jobStatus,workingGroup,processingType,"
+        sql += "workqueue_id,currentPriority,tabS.corePower,"
+        sql += "CASE WHEN tabS.coreCount IS NULL THEN 1 ELSE tabS.corecount END coreCount "
+        sql += "FROM ATLAS_PANDA.MV_JOBSACTIVE4_STATS tabJ,ATLAS_PANDAMETA.schedconfig tabS "
+        sql += "WHERE computingSite=tabS.siteid) "
+        sql += "GROUP BY computingSite,cloud,prodSourceLabel,jobStatus,workingGroup,processingType,"
+        sql += "workqueue_id,currentPriority"
+        try:
+            # start transaction
+            self.conn.begin()
+            self.cur.arraysize = 100000
+            self.cur.execute(sql+comment,{})
+            res = self.cur.fetchall()
+            # commit
+            if not self._commit():
+                raise RuntimeError, 'Commit error'
+            _logger.debug("getActiveJobStatsSnapshot got %s rows" % len(res))
+            return res
+        except:
+            # roll back
+            self._rollback()
+            errtype,errvalue = sys.exc_info()[:2]
+            _logger.error("getActiveJobStatsSnapshot : %s %s" % (errtype,errvalue))
+            return None
+
+
+    # aggregate snapshot rows in the same format as the query in getCriteriaForProdShare
+    def aggregateActiveJobStats(self,statRows,siteList,cloud,usingGroup,usingType,usingID,usingPrio):
+        aggMap = {}
+        for computingSite,tmpCloud,prodSourceLabel,jobStatus,workingGroup,processingType,workqueue_id,\
+                currentPriority,cnt,maxPriority,hs06 in statRows:
+            if prodSourceLabel != 'managed':
+                continue
+            if siteList != None and not computingSite in siteList:
+                continue
+            if cloud != None and cloud != 'WORLD' and tmpCloud != cloud:
+                continue
+            aggKey = [jobStatus]
+            if usingGroup:
+                aggKey.append(workingGroup)
+            if usingType:
+                aggKey.append(processingType)
+            if usingID:
+                aggKey.append(workqueue_id)
+            if usingPrio:
+                aggKey.append(currentPriority)
+            aggKey = tuple(aggKey)
+            if not aggMap.has_key(aggKey):
+                aggMap[aggKey] = [0,None,None]
+            aggMap[aggKey][0] += cnt
+            if maxPriority != None and (aggMap[aggKey][1] == None or maxPriority > aggMap[aggKey][1]):
+                aggMap[aggKey][1] = maxPriority
+            if hs06 != None:
+                if aggMap[aggKey][2] == None:
+                    aggMap[aggKey][2] = 0
+                aggMap[aggKey][2] += hs06
+        res = []
+        for aggKey,aggVal in aggMap.iteritems():
+            res.append(aggKey+tuple(aggVal))
+        return res
+
+
     # get beyond pledge resource ratio
     def getPledgeResourceRatio(self):
         comment = ' /* DBProxy.getPledgeResourceRatio */'
@@ -16713,8 +17113,13 @@ class DBProxy:
     # get error definitions from DB (values cached for 1 hour)
     @memoize
     def getRetrialRules(self):
+        return self.loadRetrialRules()
+
+
+    # load error definitions from DB without caching
+    def loadRetrialRules(self):
         #Logging
-        comment = ' /* DBProxy.getRetrialRules */'
+        comment = ' /* DBProxy.loadRetrialRules */'
         methodName = comment.split(' ')[-2].split('.')[-1]
         _logger.debug("%s start"%methodName)
         
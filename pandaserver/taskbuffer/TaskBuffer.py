@@ -1461,6 +1461,18 @@ class TaskBuffer:
         return retList
 
 
+    # update input files in dispatch dataset and activate ready jobs
+    def activateJobsInDispatchBlock(self,dispatchDBlock):
+        # get DBproxy
+        proxy = self.proxyPool.getProxy()
+        # exec
+        ret = proxy.activateJobsInDispatchBlock(dispatchDBlock)
+        # release proxy
+        self.proxyPool.putProxy(proxy)
+        # return
+        return ret
+
+
     # update file status in dispatch dataset
     def updateFileStatusInDisp(self,dataset,fileStatusMap):
         # get DBproxy
@@ -1622,6 +1634,42 @@ class TaskBuffer:
         return retList
     
 
+    # update status of datasets in bulk
+    def updateDatasetStatusBulk(self,vuids,newStatus,oldStatus=None):
+        # get DBproxy
+        proxy = self.proxyPool.getProxy()
+        # exec
+        ret = proxy.updateDatasetStatusBulk(vuids,newStatus,oldStatus)
+        # release proxy
+        self.proxyPool.putProxy(proxy)
+        # return
+        return ret
+
+
+    # get output datasets which still have files to be processed
+    def getDatasetsWithPendingFiles(self,names):
+        # get DBproxy
+        proxy = self.proxyPool.getProxy()
+        # exec
+        ret = proxy.getDatasetsWithPendingFiles(names)
+        # release proxy
+        self.proxyPool.putProxy(proxy)
+        # return
+        return ret
+
+
+    # get datasets and the number of unfinished files in bulk
+    def queryDatasetsWithUnfinishedFiles(self,names,fileStatus='unknown'):
+        # get DBproxy
+        proxy = self.proxyPool.getProxy()
+        # exec
+        ret = proxy.queryDatasetsWithUnfinishedFiles(names,fileStatus)
+        # release proxy
+        self.proxyPool.putProxy(proxy)
+        # return
+        return ret
+
+
     # delete dataset
     def deleteDatasets(self,datasets):
         # get DBproxy
@@ -1838,6 +1886,18 @@ class TaskBuffer:
         return conRet
 
 
+    # get active job statistics for the snapshot
+    def getActiveJobStatsSnapshot(self):
+        # get DBproxy
+        proxy = self.proxyPool.getProxy()
+        # get stat
+        ret = proxy.getActiveJobStatsSnapshot()
+        # release proxy
+        self.proxyPool.putProxy(proxy)
+        # return
+        return ret
+
+
     # get the number of waiting jobs per site and user
     def getJobStatisticsPerUserSite(self):
         # get DBproxy
@@ -2010,6 +2070,18 @@ class TaskBuffer:
         return ret
 
 
+    # update site data with pilot counts in bulk
+    def updateSiteDataBulk(self,hostID,pilotRequests):
+        # get DBproxy
+        proxy = self.proxyPool.getProxy()
+        # update
+        ret = proxy.updateSiteDataBulk(hostID,pilotRequests)
+        # release proxy
+        self.proxyPool.putProxy(proxy)
+        # return
+        return ret
+
+
     # get current site data
     def getCurrentSiteData(self):
         # get DBproxy
@@ -2058,12 +2130,24 @@ class TaskBuffer:
         return ret
 
 
+    # get lastmod of sites
+    def getSiteModTimes(self):
+        # get DBproxy
+        proxy = self.proxyPool.getProxy()
+        # get lastmod
+        ret = proxy.getSiteModTimes()
+        # release proxy
+        self.proxyPool.putProxy(proxy)
+        # return
+        return ret
+
+
     # get site info
-    def getSiteInfo(self):
+    def getSiteInfo(self,siteIDs=None):
         # get DBproxy
         proxy = self.proxyPool.getProxy()
         # get site info
-        ret = proxy.getSiteInfo()
+        ret = proxy.getSiteInfo(siteIDs)
         # release proxy
         self.proxyPool.putProxy(proxy)
         # return
@@ -2853,6 +2937,18 @@ class TaskBuffer:
         return ret
 
 
+    # retry module: load the defined rules without caching
+    def loadRetrialRules(self):
+        # get proxy
+        proxy = self.proxyPool.getProxy()
+        # exec
+        ret = proxy.loadRetrialRules()
+        # release proxy
+        self.proxyPool.putProxy(proxy)
+        # return
+        return ret
+
+
     # retry module action: set max number of retries
     def setMaxAttempt(self, jobID, jediTaskID, files, attemptNr):
         # get proxy
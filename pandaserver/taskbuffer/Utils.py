@@ -5,16 +5,20 @@ utility service
 import os
 import re
 import sys
+import json
 import zlib
 import uuid
 import time
 import socket
+import errno
 import struct
+import hashlib
 import datetime
 import jobdispatcher.Protocol as Protocol
 import ErrorCode
 from userinterface import Client
 from config import panda_config
+from CacheManager import cacheManager
 
 from pandalogger.PandaLogger import PandaLogger
 from pandalogger.LogWrapper import LogWrapper
@@ -108,6 +112,121 @@ def touchFileCassa(filefamily,fileKeyName,timeNow):
         return False
     
 
+# insert sandbox file info, directly through UserIF when running in the server
+def insertSandboxFileInfo(username,fileName,fileSize,checkSum):
+    # imported here since UserIF imports this module
+    from userinterface.UserIF import userIF
+    if userIF.taskBuffer == None:
+        # loop back over HTTP
+        return Client.insertSandboxFileInfo(username,fileName,fileSize,checkSum)
+    try:
+        return 0,str(userIF.insertSandboxFileInfo(username,panda_config.pserverhost,fileName,
+                                                  fileSize,checkSum))
+    except:
+        errtype,errvalue = sys.exc_info()[:2]
+        return 1,"ERROR : %s %s" % (errtype,errvalue)
+
+
+# check if the content-addressed sandbox store is used
+def useSandboxStore():
+    return hasattr(panda_config,'useSandboxStore') and panda_config.useSandboxStore == True
+
+
+# get path of sandbox content in the store
+def getSandboxStorePath(digest):
+    return '%s/sandbox/data/%s/%s' % (panda_config.cache_dir,digest[:2],digest)
+
+
+# get path of index entry for size and checksum in the store. entries are per user since
+# the checksum is given by the client and only the same user can reuse the content
+def getSandboxIndexPath(username,fileSize,checkSum):
+    return '%s/sandbox/index/%s/%s_%s' % (panda_config.cache_dir,hashlib.sha256(username).hexdigest(),
+                                          long(fileSize),long(checkSum))
+
+
+# make a hard link ignoring existing destination
+def _linkFile(srcPath,dstPath):
+    try:
+        os.makedirs(os.path.dirname(dstPath))
+    except OSError,e:
+        if e.errno != errno.EEXIST:
+            raise
+    try:
+        os.link(srcPath,dstPath)
+    except OSError,e:
+        if e.errno != errno.EEXIST:
+            raise
+
+
+# write uploaded content to a temporary file in chunks and return path,size,digest,gzip footer
+def writeSandboxFile(fileObj,sizeLimit,chunkSize=1024*1024):
+    tmpPath = '%s/.upload.%s' % (panda_config.cache_dir,str(uuid.uuid4()))
+    fileSize = 0
+    tail = ''
+    digest = hashlib.sha256()
+    fo = open(tmpPath,'wb')
+    try:
+        while True:
+            chunk = fileObj.read(chunkSize)
+            if not chunk:
+                break
+            fileSize += len(chunk)
+            if fileSize > sizeLimit:
+                raise IOError,'exceeded size limit %s>%s' % (fileSize,sizeLimit)
+            fo.write(chunk)
+            digest.update(chunk)
+            tail = (tail+chunk)[-8:]
+        fo.close()
+    except:
+        fo.close()
+        os.remove(tmpPath)
+        raise
+    return tmpPath,fileSize,digest.hexdigest(),tail
+
+
+# move uploaded file into the store and link it to the file name. return False if already stored
+def putSandboxToStore(tmpPath,fileFullPath,digest,fileSize,checkSum,username):
+    storePath = getSandboxStorePath(digest)
+    if os.path.exists(storePath):
+        # the same content was uploaded before
+        os.utime(storePath,None)
+        isNew = False
+    else:
+        _linkFile(tmpPath,storePath)
+        isNew = True
+    _linkFile(storePath,fileFullPath)
+    if checkSum != None:
+        _linkFile(storePath,getSandboxIndexPath(username,fileSize,checkSum))
+    # the temporary file is kept until all links are made so that the caller can fall back
+    os.remove(tmpPath)
+    return isNew
+
+
+# link a sandbox stored by the same user with the same size and checksum to a new file name
+def getSandboxFromStore(dn,fileSize,checkSum):
+    tmpLog = LogWrapper(_logger,'getSandboxFromStore {0} {1}'.format(fileSize,checkSum))
+    try:
+        username = cleanUserID(dn)
+        indexPath = getSandboxIndexPath(username,fileSize,checkSum)
+        if not os.path.exists(indexPath):
+            cacheManager.record(None,False)
+            return None
+        # the name is given by the server since the client skips uploading
+        fileName = 'sources.%s.tar.gz' % str(uuid.uuid4())
+        _linkFile(indexPath,'%s/%s' % (panda_config.cache_dir,fileName))
+        os.utime(indexPath,None)
+        cacheManager.record(fileName,True)
+        statClient,outClient = insertSandboxFileInfo(username,fileName,fileSize,checkSum)
+        if statClient != 0 or outClient.startswith("ERROR"):
+            tmpLog.error("failed to put sandbox to DB with %s %s" % (statClient,outClient))
+        tmpLog.debug("linked to %s for %s" % (fileName,username))
+        return fileName
+    except:
+        errtype,errvalue = sys.exc_info()[:2]
+        tmpLog.error("%s %s" % (errtype,errvalue))
+        return None
+
+
 # upload file 
 def putFile(req,file):
     if not Protocol.isSecure(req):
@@ -148,25 +267,23 @@ def putFile(req,file):
         if os.path.exists(fileFullPath):
             # touch
             os.utime(fileFullPath,None)
+            cacheManager.record(file.filename.split('/')[-1],True)
             # send error message
             errStr = "ERROR : Cannot overwrite file"
             _logger.debug('putFile : cannot overwrite file %s' % file.filename)  
             _logger.debug("putFile : end")
             return errStr
-        # write
-        fo = open(fileFullPath,'wb')
-        fileContent = file.file.read()
-        fo.write(fileContent)
-        fo.close()
+        # write in chunks
+        tmpPath,fileSize,digest,footer = writeSandboxFile(file.file,sizeLimit)
     except:
+        errtype,errvalue = sys.exc_info()[:2]
         errStr = "ERROR : Cannot write file"
-        _logger.error(errStr)
+        _logger.error("%s due to %s %s" % (errStr,errtype,errvalue))
         _logger.debug("putFile : end")
         return errStr
     # checksum
     try:
         # decode Footer
-        footer = fileContent[-8:]
         checkSum,isize = struct.unpack("II",footer)
         _logger.debug("CRC from gzip Footer %s" % checkSum)
     except:
@@ -178,15 +295,38 @@ def putFile(req,file):
         # use None to avoid delay for now
         checkSum = None
         _logger.debug("CRC calculated %s" % checkSum)
-    # file size
-    fileSize = len(fileContent)
+    try:
+        isNew = True
+        if useSandboxStore():
+            try:
+                isNew = putSandboxToStore(tmpPath,fileFullPath,digest,fileSize,checkSum,
+                                          cleanUserID(req.subprocess_env['SSL_CLIENT_S_DN']))
+                _logger.debug("putFile : stored %s as %s new=%s" % (file.filename,digest,isNew))
+            except OSError:
+                errtype,errvalue = sys.exc_info()[:2]
+                _logger.warning("putFile : failed to use sandbox store for %s due to %s %s" % \
+                                (file.filename,errtype,errvalue))
+        if os.path.exists(tmpPath):
+            os.rename(tmpPath,fileFullPath)
+        # an upload is a miss unless the same content was already stored
+        if isNew:
+            cacheManager.record(file.filename.split('/')[-1],False,fileSize)
+        else:
+            cacheManager.record(file.filename.split('/')[-1],True)
+    except:
+        errtype,errvalue = sys.exc_info()[:2]
+        if os.path.exists(tmpPath):
+            os.remove(tmpPath)
+        errStr = "ERROR : Cannot write file"
+        _logger.error("%s due to %s %s" % (errStr,errtype,errvalue))
+        _logger.debug("putFile : end")
+        return errStr
     # user name
     username = cleanUserID(req.subprocess_env['SSL_CLIENT_S_DN'])    
     _logger.debug("putFile : written dn=%s file=%s size=%s crc=%s" % \
                   (username,file.filename,fileSize,checkSum))
     # put file info to DB
-    statClient,outClient = Client.insertSandboxFileInfo(username,file.filename,
-                                                        fileSize,checkSum)
+    statClient,outClient = insertSandboxFileInfo(username,file.filename,fileSize,checkSum)
     if statClient != 0 or outClient.startswith("ERROR"):
         _logger.error("putFile : failed to put sandbox to DB with %s %s" % (statClient,outClient))
         #_logger.debug("putFile : end")
@@ -203,8 +343,6 @@ def putFile(req,file):
             username = req.subprocess_env['SSL_CLIENT_S_DN']
             username = username.replace('/CN=proxy','')
             username = username.replace('/CN=limited proxy','')
-            # file size
-            fileSize = len(fileContent)
             # key
             fileKeyName = file.filename.split('/')[-1]
             sizeCheckSum = '%s:%s' % (fileSize,checkSum)
@@ -263,13 +401,14 @@ def putFile(req,file):
             if gotoNextCassa:
                 splitIdx = 0
                 splitSize = 5 * 1024 * 1024
-                nSplit,tmpMod = divmod(len(fileContent),splitSize)
+                nSplit,tmpMod = divmod(fileSize,splitSize)
                 if tmpMod != 0:
                     nSplit += 1
                 _logger.debug('Inserting %s with %s blocks' % (fileKeyName,nSplit))                    
+                fileObj = open(fileFullPath,'rb')
                 for splitIdx in range(nSplit): 
                     # split to small chunks since cassandra is not good at large files
-                    tmpFileContent = fileContent[splitSize*splitIdx:splitSize*(splitIdx+1)]
+                    tmpFileContent = fileObj.read(splitSize)
                     tmpFileKeyName = fileKeyName
                     tmpAttMap = {'file':tmpFileContent,
                                  'user':username,
@@ -287,6 +426,7 @@ def putFile(req,file):
                     # insert with retry
                     insertWithRetryCassa(filefamily,tmpFileKeyName,tmpAttMap,
                                          'putFile : insert %s' % file.filename)
+                fileObj.close()
                 # set time
                 touchFileCassa(filefamily,fileKeyName,timeNow)
         except:
@@ -447,6 +587,7 @@ def touchFile(req,filename):
         return 'False'
     try:
         os.utime('%s/%s' % (panda_config.cache_dir,filename.split('/')[-1]),None)
+        cacheManager.record(filename.split('/')[-1],True)
         return 'True'
     except:
         errtype,errvalue = sys.exc_info()[:2]
@@ -454,6 +595,16 @@ def touchFile(req,filename):
         return 'False'        
                         
 
+# get occupancy and hit rate of cache_dir
+def getCacheStats(req):
+    try:
+        return json.dumps(cacheManager.getStats())
+    except:
+        errtype,errvalue = sys.exc_info()[:2]
+        _logger.error("getCacheStats : %s %s" % (errtype,errvalue))
+        return "ERROR : %s %s" % (errtype,errvalue)
+
+
 # get server name:port for SSL
 def getServer(req):
     return "%s:%s" % (panda_config.pserverhost,panda_config.pserverport)
@@ -483,18 +634,30 @@ def updateLog(req,file):
     return True
 
 
-# fetch stdout
-def fetchLog(req,logName,offset=0):
-    _logger.debug("fetchLog : %s start offset=%s" % (logName,offset))
+# fetch stdout. return the slice from offset or the last tail bytes, up to length bytes
+def fetchLog(req,logName,offset=0,length=None,tail=None):
+    _logger.debug("fetchLog : %s start offset=%s length=%s tail=%s" % (logName,offset,length,tail))
     # put dummy char to avoid Internal Server Error
     retStr = ' '
     try:
+        # upper limit of the slice
+        maxLength = 16*1024*1024
+        if hasattr(panda_config,'fetchLogMaxSize'):
+            maxLength = panda_config.fetchLogMaxSize
+        if length in [None,'']:
+            length = maxLength
+        else:
+            length = min(long(length),maxLength)
         # stdout name
         fullLogName  = '%s/%s' % (panda_config.cache_dir,logName.split('/')[-1])
         # read
         ft = open(fullLogName,'r')
-        ft.seek(long(offset))
-        retStr += ft.read()
+        if tail in [None,'']:
+            ft.seek(long(offset))
+        else:
+            ft.seek(0,os.SEEK_END)
+            ft.seek(max(0,ft.tell()-long(tail)))
+        retStr += ft.read(length)
         ft.close()
     except:
         type, value, traceBack = sys.exc_info()
@@ -503,6 +666,19 @@ def fetchLog(req,logName,offset=0):
     return retStr
 
 
+# get file in cache_dir which is sent by the entry with Range and ETag support
+def getCacheFile(req,fileName):
+    _logger.debug("getCacheFile : %s start" % fileName)
+    fileFullPath = '%s/%s' % (panda_config.cache_dir,fileName.split('/')[-1])
+    if not os.path.isfile(fileFullPath):
+        _logger.debug("getCacheFile : %s not found" % fileName)
+        cacheManager.record(None,False)
+        return ErrorCode.EC_NotFound
+    cacheManager.record(fileName.split('/')[-1],True)
+    _logger.debug("getCacheFile : %s end" % fileName)
+    return ErrorCode.EC_SendFile(fileFullPath)
+
+
 # get VOMS attributes
 def getVomsAttr(req):
     vomsAttrs = []
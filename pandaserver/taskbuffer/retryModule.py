@@ -1,5 +1,7 @@
 import sys
 import time
+import datetime
+import threading
 from pandalogger.PandaLogger import PandaLogger
 from config import panda_config
 import re
@@ -50,7 +52,7 @@ def timeit(method):
 
 def safe_match(pattern, message):
     """
-    Wrapper around re.search with simple exception handling
+    Wrapper around re.search with simple exception handling. The pattern can be precompiled
     """
     matches = False
     try:
@@ -67,17 +69,129 @@ def conditions_apply(errordiag_job, architecture_job, release_job, wqid_job,
     Checks that the error regexp, architecture, release and work queue of rule and job match,
     only in case the attributes are defined for the rule
     """
-    _logger.debug("Entered conditions_apply %s"%(locals()))
     if ((errordiag_rule and not safe_match(errordiag_rule, errordiag_job))
         or (architecture_rule and architecture_rule != architecture_job) 
         or (release_rule and release_rule != release_job)
         or (wqid_rule and wqid_rule != wqid_job)):
-        _logger.debug("Leaving conditions_apply: False")
         return False
-    _logger.debug("Leaving conditions_apply: True")
     return True
 
 
+def rule_applies(rule, errordiag_job, architecture_job, release_job, wqid_job):
+    """
+    conditions_apply for a rule, using the precompiled error regexp if the rule comes from the index
+    """
+    if rule.get('error_diag_invalid'):
+        return False
+    return conditions_apply(errordiag_job, architecture_job, release_job, wqid_job,
+                            rule.get('error_diag_re', rule['error_diag']), rule['architecture'],
+                            rule['release'], rule['wqid'])
+
+
+class RetrialRuleIndex:
+    """
+    Retrial rules indexed by (error_source, error_code) and then by (architecture, release),
+    with precompiled error regexps. The rules are re-read periodically and only the entries
+    whose definitions changed are rebuilt
+    """
+
+    def __init__(self, check_interval=300):
+        self.check_interval = check_interval
+        self.last_check = None
+        # (error_source, error_code) -> (raw rules, {(architecture, release): [(position, rule)]})
+        self.index = {}
+        self.lock = threading.Lock()
+
+    def compile_rule(self, rule):
+        """
+        Copy a rule with its error regexp compiled
+        """
+        compiled_rule = dict(rule)
+        if rule['error_diag']:
+            try:
+                compiled_rule['error_diag_re'] = re.compile(rule['error_diag'])
+            except ReError:
+                _logger.debug("Invalid regexp in rule. Pattern: %s" % rule['error_diag'])
+                compiled_rule['error_diag_invalid'] = True
+        return compiled_rule
+
+    def build_entry(self, rules):
+        """
+        Group compiled rules by architecture and release keeping their original order
+        """
+        entry = {}
+        for position, rule in enumerate(rules):
+            key = (rule['architecture'] or None, rule['release'] or None)
+            entry.setdefault(key, [])
+            entry[key].append((position, self.compile_rule(rule)))
+        return entry
+
+    def update(self, retrial_rules):
+        """
+        Rebuild the entries which changed since the last update
+        """
+        new_index = {}
+        n_rebuilt = 0
+        for error_source, rules_per_code in retrial_rules.iteritems():
+            for error_code, rules in rules_per_code.iteritems():
+                key = (error_source, error_code)
+                if key in self.index and self.index[key][0] == rules:
+                    new_index[key] = self.index[key]
+                else:
+                    new_index[key] = (rules, self.build_entry(rules))
+                    n_rebuilt += 1
+        n_removed = len([key for key in self.index if key not in new_index])
+        self.index = new_index
+        if n_rebuilt or n_removed:
+            _logger.debug("Retrial rule index updated: %s entries rebuilt, %s removed, %s in total"
+                          % (n_rebuilt, n_removed, len(new_index)))
+
+    def refresh(self, task_buffer):
+        """
+        Re-read the rules if the index is old. Only one caller reads them while others use the current index.
+        Callers wait for the first load since there is no index to use yet
+        """
+        now = datetime.datetime.utcnow()
+        if self.last_check is not None and now - self.last_check < datetime.timedelta(seconds=self.check_interval):
+            return
+        if self.last_check is None:
+            self.lock.acquire()
+        elif not self.lock.acquire(False):
+            return
+        try:
+            if self.last_check is not None and now - self.last_check < datetime.timedelta(seconds=self.check_interval):
+                return
+            retrial_rules = task_buffer.loadRetrialRules()
+            if retrial_rules is not None:
+                self.update(retrial_rules)
+            self.last_check = now
+        finally:
+            self.lock.release()
+
+    def get_rules(self, task_buffer, error_source, error_code, architecture_job, release_job):
+        """
+        Get the rules for an error, which are not excluded by architecture or release
+        """
+        self.refresh(task_buffer)
+        entry = self.index.get((error_source, error_code))
+        if entry is None:
+            return []
+        candidates = []
+        for architecture in set([None, architecture_job or None]):
+            for release in set([None, release_job or None]):
+                candidates += entry[1].get((architecture, release), [])
+        candidates.sort()
+        return [rule for position, rule in candidates]
+
+
+# index shared in the process
+_rule_index = None
+if hasattr(panda_config, 'retrial_rules_check_interval'):
+    _rule_index = RetrialRuleIndex(panda_config.retrial_rules_check_interval)
+else:
+    _rule_index = RetrialRuleIndex()
+
+
 def compare_strictness(rule1, rule2):
     """
     Return 1 if rule1 is stricter, 0 if equal, -1 if rule2 is stricter
@@ -122,8 +236,7 @@ def preprocess_rules(rules, error_diag_job, release_job, architecture_job, wqid_
         # See if there is a  NO_RETRY rule. Effect of NO_RETRY rules is the same, so just take the first one that appears
         for rule in rules:
             if (rule['action']!= NO_RETRY or
-                not conditions_apply(error_diag_job, architecture_job, release_job, wqid_job, rule['error_diag'],
-                                     rule['architecture'], rule['release'], rule['wqid'])):
+                not rule_applies(rule, error_diag_job, architecture_job, release_job, wqid_job)):
                 continue
             else:
                 filtered_rules.append(rule)
@@ -131,8 +244,7 @@ def preprocess_rules(rules, error_diag_job, release_job, architecture_job, wqid_
         # See if there is a INCREASE_MEM rule. The effect of INCREASE_MEM rules is the same, so take the first one that appears
         for rule in rules:
             if (rule['action']!= INCREASE_MEM or
-                not conditions_apply(error_diag_job, architecture_job, release_job, wqid_job, rule['error_diag'],
-                                     rule['architecture'], rule['release'], rule['wqid'])):
+                not rule_applies(rule, error_diag_job, architecture_job, release_job, wqid_job)):
                 continue
             else:
                 filtered_rules.append(rule)
@@ -141,8 +253,7 @@ def preprocess_rules(rules, error_diag_job, release_job, architecture_job, wqid_
         # See if there is a INCREASE_CPU rule. The effect of INCREASE_CPU rules is the same, so take the first one that appears
         for rule in rules:
             if (rule['action']!= INCREASE_CPU or
-                not conditions_apply(error_diag_job, architecture_job, release_job, wqid_job, rule['error_diag'],
-                                     rule['architecture'], rule['release'], rule['wqid'])):
+                not rule_applies(rule, error_diag_job, architecture_job, release_job, wqid_job)):
                 continue
             else:
                 filtered_rules.append(rule)
@@ -152,8 +263,7 @@ def preprocess_rules(rules, error_diag_job, release_job, architecture_job, wqid_
         limit_retry_rule = {}
         for rule in rules:
             if (rule['action']!= LIMIT_RETRY or
-                not conditions_apply(error_diag_job, architecture_job, release_job, wqid_job, rule['error_diag'],
-                                     rule['architecture'], rule['release'], rule['wqid'])):
+                not rule_applies(rule, error_diag_job, architecture_job, release_job, wqid_job)):
                 continue
             elif not limit_retry_rule:
                 limit_retry_rule = rule
@@ -162,6 +272,9 @@ def preprocess_rules(rules, error_diag_job, release_job, architecture_job, wqid_
                 if comparison == 1:
                     limit_retry_rule = rule
                 elif comparison == 0:
+                    # copy not to modify the rule shared in the index
+                    limit_retry_rule = dict(limit_retry_rule)
+                    limit_retry_rule['params'] = dict(limit_retry_rule['params'])
                     limit_retry_rule['params']['maxAttempt'] = min(limit_retry_rule['params']['maxAttempt'],
                                                                    rule['params']['maxAttempt'])
                 elif comparison == -1:
@@ -177,12 +290,13 @@ def preprocess_rules(rules, error_diag_job, release_job, architecture_job, wqid_
 
 #TODO: Add a call to the retrial rules from the UserIF.killJob
 @timeit
-def apply_retrial_rules(task_buffer, jobID, error_source, error_code, error_diag, attemptNr):
+def apply_retrial_rules(task_buffer, jobID, error_source, error_code, error_diag, attemptNr, job=None):
     """
     Get rules from DB and applies them to a failed job. Actions can be:
     - flag the job so it is not retried again (error code is a final state and retrying will not help)
     - limit the number of retries
     - increase the memory of a job if it failed because of insufficient memory
+    The job is read from DB unless an already-loaded JobSpec is given
     """
     _logger.debug("Entered apply_retrial_rules for job %s, error_source %s, error_code %s, error_diag %s, attemptNr %s" 
                   %(jobID, error_source, error_code, error_diag, attemptNr))
@@ -193,14 +307,17 @@ def apply_retrial_rules(task_buffer, jobID, error_source, error_code, error_diag
         _logger.error("Error code ({0}) can not be casted to int".format(error_code))
         return
 
-    retrial_rules = task_buffer.getRetrialRules()
-    _logger.debug("Back from getRetrialRules: %s"%retrial_rules)
-    if not retrial_rules:
-        return
-
     try:
-        job = task_buffer.peekJobs([jobID], fromDefined=False, fromArchived=True, fromWaiting=False)[0]
-        applicable_rules = preprocess_rules(retrial_rules[error_source][error_code], error_diag, job.AtlasRelease,
+        if job is None:
+            # check the index before reading the job
+            _rule_index.refresh(task_buffer)
+            if (error_source, error_code) not in _rule_index.index:
+                raise KeyError((error_source, error_code))
+            job = task_buffer.peekJobs([jobID], fromDefined=False, fromArchived=True, fromWaiting=False)[0]
+        retrial_rules = _rule_index.get_rules(task_buffer, error_source, error_code, job.cmtConfig, job.AtlasRelease)
+        if not retrial_rules:
+            raise KeyError((error_source, error_code))
+        applicable_rules = preprocess_rules(retrial_rules, error_diag, job.AtlasRelease,
                                             job.cmtConfig, job.workQueue_ID)
         _logger.debug("Applicable rules for PandaID {0}: {1}".format(jobID, applicable_rules))
         for rule in applicable_rules:
@@ -219,8 +336,7 @@ def apply_retrial_rules(task_buffer, jobID, error_source, error_code, error_diag
                 
                 _logger.debug("Processing rule {0} for jobID {1}, error_source {2}, error_code {3}, attemptNr {4}".
                               format(rule, jobID, error_source, error_code, attemptNr))
-                if not conditions_apply(error_diag, job.cmtConfig, job.AtlasRelease, job.workQueue_ID,
-                                        error_diag_rule, architecture, release, wqid):
+                if not rule_applies(rule, error_diag, job.cmtConfig, job.AtlasRelease, job.workQueue_ID):
                     _logger.debug("Skipped rule {0}. cmtConfig ({1} : {2}) or Release ({3} : {4}) did NOT match"
                                   .format(rule, architecture, job.cmtConfig, release, job.AtlasRelease))
                     continue
@@ -15,6 +15,7 @@ from pandalogger.PandaLogger import PandaLogger
 from brokerage.SiteMapper import SiteMapper
 from pandautils import PandaUtils
 from pandalogger.LogWrapper import LogWrapper
+from dataservice.SetupperPool import releaseSpooledJobs
 
 # password
 from config import panda_config
@@ -98,7 +99,9 @@ try:
     # don't update when logrotate is running
     timeNow = datetime.datetime.utcnow()
     logRotateTime = timeNow.replace(hour=3,minute=2,second=0,microsecond=0)
-    if (timeNow > logRotateTime and (timeNow-logRotateTime) < datetime.timedelta(minutes=5)) or \
+    if hasattr(panda_config,'usePilotRequestCounter') and panda_config.usePilotRequestCounter == True:
+        tmpLog.debug("skip pilotCounts session since the dispatcher updates SiteData")
+    elif (timeNow > logRotateTime and (timeNow-logRotateTime) < datetime.timedelta(minutes=5)) or \
            (logRotateTime > timeNow and (logRotateTime-timeNow) < datetime.timedelta(minutes=5)):
         tmpLog.debug("skip pilotCounts session for logrotate")
     else:
@@ -261,6 +264,17 @@ class ForkThr (threading.Thread):
         tmpLog.debug(comStr)    
         commands.getstatusoutput(comStr)
 
+# release files spooled by setupper pools of dead server processes
+for tmpName in glob.glob(panda_config.logdir + '/' + 'setpool.*'):
+    try:
+        tmpPID = tmpName.split('/')[-1].split('.')[1]
+        if not os.path.exists('/proc/%s' % tmpPID):
+            tmpLog.debug("release %s" % tmpName)
+            releaseSpooledJobs(tmpName)
+    except:
+        errType,errValue = sys.exc_info()[:2]
+        tmpLog.error("%s %s" % (errType,errValue))
+
 # get set.* files
 filePatt = panda_config.logdir + '/' + 'set.*'
 fileList = glob.glob(filePatt)
@@ -0,0 +1,78 @@
+"""
+benchmark per-call latency of userinterface.Client transports against a local test server
+
+usage: python benchmarkClientTransport.py [nCalls]
+
+"""
+
+import sys
+import gzip
+import time
+import threading
+import cStringIO
+import BaseHTTPServer
+
+from userinterface import Client
+
+
+# small response like isAlive
+class Handler(BaseHTTPServer.BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    # send the response in one segment
+    wbufsize = -1
+
+    def respond(self):
+        # consume the request body
+        if self.headers.getheader('content-length'):
+            self.rfile.read(int(self.headers.getheader('content-length')))
+        body = 'alive=yes\n'
+        if 'gzip' in self.headers.getheader('accept-encoding',''):
+            tmpBuf = cStringIO.StringIO()
+            tmpFile = gzip.GzipFile(fileobj=tmpBuf,mode='wb')
+            tmpFile.write(body)
+            tmpFile.close()
+            body = tmpBuf.getvalue()
+            self.send_response(200)
+            self.send_header('Content-Encoding','gzip')
+        else:
+            self.send_response(200)
+        self.send_header('Content-Length',str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+        self.wfile.flush()
+
+    do_GET  = respond
+    do_POST = respond
+
+    def log_message(self,*args):
+        pass
+
+
+# start server
+server = BaseHTTPServer.HTTPServer(('127.0.0.1',0),Handler)
+thr = threading.Thread(target=server.serve_forever)
+thr.setDaemon(True)
+thr.start()
+url = 'http://127.0.0.1:%s/server/panda/isAlive' % server.server_port
+
+try:
+    nCalls = int(sys.argv[1])
+except:
+    nCalls = 200
+
+for transport in ['curl','native']:
+    Client._httpTransport = transport
+    curl = Client._Curl()
+    # warm up
+    status,output = curl.post(url,{'dummy':1})
+    if status != 0 or output != 'alive=yes':
+        print "%s : unexpected response %s %s" % (transport,status,output)
+        continue
+    for method in ['get','post']:
+        timeStart = time.time()
+        for i in range(nCalls):
+            getattr(curl,method)(url,{'dummy':i})
+        timeSpent = time.time() - timeStart
+        print "%-6s %-4s : %d calls %.2f ms/call" % (transport,method.upper(),nCalls,timeSpent*1000/nCalls)
+
+server.shutdown()
@@ -0,0 +1,201 @@
+"""
+benchmark EventIndex lookups in EiDBProxy against a sqlite stand-in
+
+usage: python benchmarkEiDBProxy.py [nEvents] [latency in msec per round trip]
+
+"""
+
+import sys
+import time
+import random
+import sqlite3
+
+from config import panda_config
+from taskbuffer.EiDBProxy import EiDBProxy
+
+streamNames = ['physics_Main','physics_Late']
+amiTagNames = ['f100','f101','r200']
+
+
+# connection to sqlite emulating the EventIndex schema
+class SqliteConnection:
+
+    # constructor
+    def __init__(self,latency):
+        self.conn = sqlite3.connect(':memory:')
+        self.conn.execute("ATTACH DATABASE ':memory:' AS {0}".format(panda_config.schemaEI))
+        self.latency = latency
+        self.nRoundTrips = 0
+
+    # count a round trip
+    def roundTrip(self):
+        self.nRoundTrips += 1
+        time.sleep(self.latency)
+
+    # begin transaction
+    def begin(self):
+        pass
+
+    # commit. the temporary table is cleared as global temporary tables in Oracle
+    def commit(self):
+        self.roundTrip()
+        self.conn.execute("DELETE FROM {0}.TMP_RUN_EVENT_PAIRS".format(panda_config.schemaEI))
+        self.conn.commit()
+
+    # rollback
+    def rollback(self):
+        self.roundTrip()
+        self.conn.rollback()
+
+    # make schema and events
+    def makeEvents(self,nRuns,nEventsPerRun):
+        schema = panda_config.schemaEI
+        self.conn.execute("CREATE TABLE {0}.EVENTS (runNumber,eventNumber,streamName,amiTag,"
+                          "guid_RAW,guid_ESD,guid_AOD)".format(schema))
+        self.conn.execute("CREATE INDEX {0}.EVENTS_IDX ON EVENTS (runNumber,eventNumber)".format(schema))
+        self.conn.execute("CREATE TABLE {0}.TMP_RUN_EVENT_PAIRS (runNumber,eventNumber)".format(schema))
+        for viewName,amiCol in [('V_PANDA_EVPICK_NOAMITAG_MANY',''),('V_PANDA_EVPICK_AMITAG_MANY',',e.amiTag')]:
+            self.conn.execute("CREATE VIEW {0}.{1} AS SELECT e.runNumber,e.eventNumber,e.streamName{2},"
+                              "e.guid_RAW,e.guid_ESD,e.guid_AOD FROM EVENTS e,TMP_RUN_EVENT_PAIRS t "
+                              "WHERE e.runNumber=t.runNumber AND e.eventNumber=t.eventNumber".format(schema,viewName,
+                                                                                                   amiCol))
+        rows = []
+        for runNumber in range(nRuns):
+            for eventNumber in range(nEventsPerRun):
+                for amiTag in amiTagNames:
+                    guid = 'GUID_%s_%s_%s' % (runNumber,eventNumber,amiTag)
+                    rows.append((runNumber,eventNumber,streamNames[eventNumber % 2],amiTag,guid,guid,guid))
+        self.conn.executemany("INSERT INTO {0}.EVENTS VALUES (?,?,?,?,?,?,?)".format(schema),rows)
+        self.conn.commit()
+
+
+# cursor taking bind variables with the Oracle style
+class SqliteCursor:
+
+    # constructor
+    def __init__(self,conn):
+        self.conn = conn
+        self.cur = conn.conn.cursor()
+        self.arraysize = 100
+
+    # convert bind variables
+    def convert(self,varMap):
+        newMap = {}
+        for tmpKey,tmpVal in varMap.iteritems():
+            newMap[tmpKey.lstrip(':')] = tmpVal
+        return newMap
+
+    # execute
+    def execute(self,sql,varMap={}):
+        self.conn.roundTrip()
+        return self.cur.execute(sql,self.convert(varMap))
+
+    # execute with array binding
+    def executemany(self,sql,varMaps):
+        self.conn.roundTrip()
+        return self.cur.executemany(sql,[self.convert(varMap) for varMap in varMaps])
+
+    # fetch all rows. one round trip per arraysize rows
+    def fetchall(self):
+        res = self.cur.fetchall()
+        for i in range(len(res)/self.arraysize+1):
+            self.conn.roundTrip()
+        return res
+
+    # fetch rows
+    def fetchmany(self,arraysize=1000):
+        self.arraysize = arraysize
+        self.conn.roundTrip()
+        return self.cur.fetchmany(arraysize)
+
+
+# lookup before chunking and streaming
+def oldGetGUIDsFromEventIndex(proxy,runEventList,streamName,amiTags,dataType):
+    if not amiTags in [None,'']:
+        amiTags = amiTags.replace('*','.*').split(',')
+    sqlRE  = "INSERT INTO {0}.TMP_RUN_EVENT_PAIRS (runNumber,eventNumber) ".format(panda_config.schemaEI)
+    sqlRE += "VALUES (:runNumber,:eventNumber) "
+    varMaps = []
+    for runNumber,eventNumber in runEventList:
+        varMaps.append({':runNumber':runNumber,':eventNumber':eventNumber})
+    proxy.conn.begin()
+    proxy.cur.arraysize = 100000
+    proxy.cur.executemany(sqlRE,varMaps)
+    varMap = {}
+    if amiTags in [None,'']:
+        sqlRG  = "SELECT runNumber,eventNumber,guid_{0} ".format(dataType)
+        sqlRG += "FROM {0}.V_PANDA_EVPICK_NOAMITAG_MANY ".format(panda_config.schemaEI)
+    else:
+        sqlRG  = "SELECT runNumber,eventNumber,guid_{0},amiTag ".format(dataType)
+        sqlRG += "FROM {0}.V_PANDA_EVPICK_AMITAG_MANY ".format(panda_config.schemaEI)
+    if streamName != None:
+        sqlRG += "WHERE streamName=:streamName "
+        varMap[':streamName'] = streamName
+    proxy.cur.execute(sqlRG,varMap)
+    resRG = proxy.cur.fetchall()
+    proxy.conn.commit()
+    retValue = {}
+    keyAmiIdxMap = {}
+    for tmpItem in resRG:
+        if amiTags in [None,'']:
+            runNumber,eventNumber,guid = tmpItem
+            idxTag = 0
+        else:
+            runNumber,eventNumber,guid,amiTag = tmpItem
+            idxTag = proxy.getIndexAmiTag(amiTags,amiTag)
+            if idxTag == None:
+                continue
+        tmpKey = (runNumber,eventNumber)
+        if tmpKey in keyAmiIdxMap and keyAmiIdxMap[tmpKey] < idxTag:
+            continue
+        keyAmiIdxMap[tmpKey] = idxTag
+        retValue[tmpKey] = [guid]
+    return True,retValue
+
+
+# look up events in slices as done by event picking
+def runLookup(func,proxy,runEventList,sliceSize,amiTags):
+    retMap = {}
+    for idx in range(0,len(runEventList),sliceSize):
+        tmpStat,tmpMap = func(proxy,runEventList[idx:idx+sliceSize],None,amiTags,'AOD')
+        retMap.update(tmpMap)
+    return retMap
+
+
+def main():
+    nEvents = 50000
+    latency = 1
+    if len(sys.argv) > 1:
+        nEvents = int(sys.argv[1])
+    if len(sys.argv) > 2:
+        latency = float(sys.argv[2])
+    random.seed(0)
+    nRuns = 10
+    conn = SqliteConnection(latency/1000.0)
+    conn.makeEvents(nRuns,nEvents/nRuns*2)
+    proxy = EiDBProxy()
+    proxy.conn = conn
+    proxy.cur = SqliteCursor(conn)
+    runEventList = [(random.randint(0,nRuns-1),random.randint(0,nEvents/nRuns*2-1)) for i in range(nEvents)]
+    amiTags = 'r2*,f10*'
+    print "%s events with %s msec per round trip" % (nEvents,latency)
+    # 500 events per lookup with fetchall
+    conn.nRoundTrips = 0
+    timeStart = time.time()
+    oldResults = runLookup(oldGetGUIDsFromEventIndex,proxy,runEventList,500,amiTags)
+    timeOld = time.time() - timeStart
+    print "  old lookups     : %8.2f msec round trips=%s" % (timeOld*1000,conn.nRoundTrips)
+    # chunked lookups with streaming
+    conn.nRoundTrips = 0
+    timeStart = time.time()
+    newResults = runLookup(lambda proxy,*args: apply(proxy.getGUIDsFromEventIndex,args),
+                           proxy,runEventList,nEvents,amiTags)
+    timeNew = time.time() - timeStart
+    print "  chunked lookups : %8.2f msec round trips=%s same=%s" % (timeNew*1000,conn.nRoundTrips,
+                                                                    oldResults == newResults)
+    if timeNew > 0:
+        print "  speedup         : %8.1f" % (timeOld/timeNew)
+
+
+if __name__ == "__main__":
+    main()
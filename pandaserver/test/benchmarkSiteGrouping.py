@@ -0,0 +1,94 @@
+"""
+benchmark grouping of jobs by computingSite in brokerage
+
+usage: python benchmarkSiteGrouping.py [nJobs] [nSites]
+
+"""
+
+import sys
+import time
+import random
+
+from taskbuffer.JobSpec import JobSpec
+from taskbuffer import JobUtils
+
+
+# comparator used by broker.schedule before JobUtils.groupJobsBySite
+def makeCompFunc(allSites):
+    def _compFunc(jobA,jobB):
+        # append site if not in list
+        if not jobA.computingSite in allSites:
+            allSites.append(jobA.computingSite)
+        if not jobB.computingSite in allSites:
+            allSites.append(jobB.computingSite)
+        # compare
+        indexA = allSites.index(jobA.computingSite)
+        indexB = allSites.index(jobB.computingSite)
+        if indexA > indexB:
+            return 1
+        elif indexA < indexB:
+            return -1
+        else:
+            return 0
+    return _compFunc
+
+
+# make jobs
+def makeJobs(nJobs,nSites):
+    jobs = []
+    for i in range(nJobs):
+        job = JobSpec()
+        job.PandaID = i
+        job.computingSite = 'SITE_%03d' % random.randint(0,nSites-1)
+        jobs.append(job)
+    return jobs
+
+
+# check if jobs are grouped by site and keep the original order in each site
+def isGrouped(origJobs,newJobs):
+    if len(origJobs) != len(newJobs):
+        return False
+    seenSites = set()
+    prevSite = None
+    for job in newJobs:
+        if job.computingSite != prevSite:
+            if job.computingSite in seenSites:
+                return False
+            seenSites.add(job.computingSite)
+            prevSite = job.computingSite
+    for site in seenSites:
+        if [job.PandaID for job in origJobs if job.computingSite == site] != \
+               [job.PandaID for job in newJobs if job.computingSite == site]:
+            return False
+    return True
+
+
+def main():
+    nJobs = 5000
+    nSites = 500
+    if len(sys.argv) > 1:
+        nJobs = int(sys.argv[1])
+    if len(sys.argv) > 2:
+        nSites = int(sys.argv[2])
+    random.seed(0)
+    jobs = makeJobs(nJobs,nSites)
+    # comparator sort
+    tmpJobs = list(jobs)
+    timeStart = time.time()
+    tmpJobs.sort(makeCompFunc([]))
+    timeComp = time.time() - timeStart
+    okComp = isGrouped(jobs,tmpJobs)
+    # grouping
+    timeStart = time.time()
+    tmpJobs = JobUtils.groupJobsBySite(jobs)
+    timeGroup = time.time() - timeStart
+    okGroup = isGrouped(jobs,tmpJobs)
+    print "%s jobs across %s sites" % (nJobs,nSites)
+    print "  comparator sort : %8.2f msec grouped=%s" % (timeComp*1000,okComp)
+    print "  groupJobsBySite : %8.2f msec grouped=%s" % (timeGroup*1000,okGroup)
+    if timeGroup > 0:
+        print "  speedup         : %8.1f" % (timeComp/timeGroup)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,227 @@
+"""
+benchmark SiteMapper lookups in a Setupper batch
+
+usage: python benchmarkSiteMapperLookup.py [nJobs] [nSites] [nFiles]
+
+"""
+
+import sys
+import time
+import random
+
+from taskbuffer.SiteSpec import SiteSpec
+from taskbuffer.CloudSpec import CloudSpec
+from taskbuffer.DdmSpec import DdmSpec
+from brokerage import SiteMapper
+from dataservice import DataServiceUtils
+
+cloudNames = ['CA','DE','ES','FR','IT','ND','NL','TW','UK','US']
+tokenNames = ['ATLASDATADISK','ATLASPRODDISK','ATLASSCRATCHDISK']
+
+
+# task buffer returning fake sites
+class FakeTaskBuffer:
+
+    # constructor
+    def __init__(self,nSites):
+        self.nSites = nSites
+
+    # get cloud list
+    def getCloudList(self):
+        retMap = {}
+        for cloudName in cloudNames+[SiteMapper.worldCloudName]:
+            cloudSpec = CloudSpec()
+            for tmpAttr in cloudSpec._attributes:
+                setattr(cloudSpec,tmpAttr,None)
+            cloudSpec.name = cloudName
+            cloudSpec.tier1 = 'SITE_%s_T1' % cloudName
+            cloudSpec.tier1SE = []
+            retMap[cloudName] = cloudSpec
+        return retMap
+
+    # get site list
+    def getSiteList(self):
+        retMap = {}
+        for idx in range(self.nSites):
+            siteName = self.getSiteName(idx)
+            retMap[siteName] = [siteName]
+        return retMap
+
+    # get site name
+    def getSiteName(self,idx):
+        if idx < len(cloudNames):
+            return 'SITE_%s_T1' % cloudNames[idx]
+        return 'SITE_%05d' % idx
+
+    # get site info
+    def getSiteInfo(self):
+        retMap = {}
+        for idx in range(self.nSites):
+            siteName = self.getSiteName(idx)
+            siteSpec = SiteSpec()
+            siteSpec.sitename = siteName
+            siteSpec.nickname = siteName
+            siteSpec.cloud = cloudNames[idx % len(cloudNames)]
+            siteSpec.cloudlist = [siteSpec.cloud]
+            siteSpec.status = 'online'
+            siteSpec.statusmodtime = ''
+            siteSpec.memory = 0
+            siteSpec.maxinputsize = 0
+            # some sites share the storage
+            storageName = 'STORAGE_%05d' % (idx/2)
+            siteSpec.ddm = storageName + '_DATADISK'
+            siteSpec.setokens = {}
+            siteSpec.ddm_endpoints = DdmSpec()
+            for tokenName in tokenNames:
+                endPoint = storageName + '_' + tokenName[5:]
+                siteSpec.setokens[tokenName] = endPoint
+                siteSpec.ddm_endpoints.add({'ddm_endpoint_name':endPoint,'is_local':'Y',
+                                            'is_default':'Y' if endPoint == siteSpec.ddm else 'N'},
+                                           {endPoint:{'ddm_endpoint_name':endPoint,'type':tokenName[5:]}})
+            # every fifth site is a nucleus and the rest are satellites
+            siteSpec.pandasite = 'NUCLEUS_%04d' % (idx/5)
+            siteSpec.pandasite_state = 'ACTIVE'
+            if idx % 5 == 0:
+                siteSpec.role = 'nucleus'
+            else:
+                siteSpec.role = 'satellite'
+            retMap[siteName] = siteSpec
+        return retMap
+
+
+# lookups before the tables were introduced
+def oldResolveSite(siteMapper,site):
+    try:
+        if site.startswith(SiteMapper.nucleusTag):
+            tmpName = site.split(':')[-1]
+            if tmpName in siteMapper.nuclei:
+                site = siteMapper.nuclei[tmpName].getOnePandaSite()
+            elif tmpName in siteMapper.satellites:
+                site = siteMapper.satellites[tmpName].getOnePandaSite()
+    except:
+        pass
+    return site
+
+def oldGetSite(siteMapper,site):
+    site = oldResolveSite(siteMapper,site)
+    if siteMapper.siteSpecList.has_key(site):
+        return siteMapper.siteSpecList[site]
+    return SiteMapper.defSite
+
+def oldCheckSite(siteMapper,site):
+    return siteMapper.siteSpecList.has_key(oldResolveSite(siteMapper,site))
+
+def oldResolveNucleus(siteMapper,site):
+    site = oldResolveSite(siteMapper,site)
+    if site == 'NULL':
+        site = None
+    return site
+
+def oldGetDdmEndpoint(siteMapper,siteID,storageToken):
+    if not oldCheckSite(siteMapper,siteID):
+        return None
+    siteSpec = oldGetSite(siteMapper,siteID)
+    if siteSpec.setokens.has_key(storageToken):
+        return siteSpec.setokens[storageToken]
+    return siteSpec.ddm
+
+def oldGetNucleus(siteMapper,tmpName):
+    if tmpName in siteMapper.nuclei:
+        return siteMapper.nuclei[tmpName]
+    if tmpName in siteMapper.satellites:
+        return siteMapper.satellites[tmpName]
+    return None
+
+def oldGetSitesShareDDM(siteMapper,siteName):
+    if not oldCheckSite(siteMapper,siteName):
+        return []
+    siteSpec = oldGetSite(siteMapper,siteName)
+    retSites = []
+    for tmpSiteName,tmpSiteSpec in siteMapper.siteSpecList.iteritems():
+        if siteSpec.type != tmpSiteSpec.type:
+            continue
+        if tmpSiteSpec.status != 'online':
+            continue
+        if siteSpec.ddm != tmpSiteSpec.ddm:
+            continue
+        if siteName == tmpSiteSpec.sitename:
+            continue
+        if not tmpSiteSpec.sitename in retSites:
+            retSites.append(tmpSiteSpec.sitename)
+    return retSites
+
+
+# make jobs as tuples of (computingSite,destinationSE,nucleus,tokens of files)
+def makeJobs(nJobs,nSites,nFiles,taskBuffer):
+    jobs = []
+    for i in range(nJobs):
+        computingSite = taskBuffer.getSiteName(random.randint(0,nSites-1))
+        nucleus = 'NUCLEUS_%04d' % random.randint(0,(nSites-1)/5)
+        destinationSE = SiteMapper.nucleusTag + nucleus
+        tokens = [random.choice(tokenNames) for j in range(nFiles)]
+        jobs.append((computingSite,destinationSE,nucleus,tokens))
+    return jobs
+
+
+# per-job lookups as done in Setupper
+def runOld(siteMapper,jobs):
+    results = []
+    for computingSite,destinationSE,nucleus,tokens in jobs:
+        tmpResult = [oldResolveNucleus(siteMapper,destinationSE),
+                     oldGetSite(siteMapper,computingSite).ddm,
+                     oldGetNucleus(siteMapper,nucleus).name,
+                     sorted(oldGetSitesShareDDM(siteMapper,computingSite))]
+        for token in tokens:
+            tmpResult.append(oldGetDdmEndpoint(siteMapper,computingSite,token))
+            tmpResult.append(oldGetDdmEndpoint(siteMapper,destinationSE,token))
+        results.append(tmpResult)
+    return results
+
+def runNew(siteMapper,jobs):
+    results = []
+    for computingSite,destinationSE,nucleus,tokens in jobs:
+        tmpResult = [siteMapper.resolveNucleus(destinationSE),
+                     siteMapper.getSite(computingSite).ddm,
+                     siteMapper.getNucleus(nucleus).name,
+                     sorted(DataServiceUtils.getSitesShareDDM(siteMapper,computingSite))]
+        for token in tokens:
+            tmpResult.append(siteMapper.getDdmEndpoint(computingSite,token))
+            tmpResult.append(siteMapper.getDdmEndpoint(destinationSE,token))
+        results.append(tmpResult)
+    return results
+
+
+def main():
+    nJobs = 5000
+    nSites = 1000
+    nFiles = 10
+    if len(sys.argv) > 1:
+        nJobs = int(sys.argv[1])
+    if len(sys.argv) > 2:
+        nSites = int(sys.argv[2])
+    if len(sys.argv) > 3:
+        nFiles = int(sys.argv[3])
+    random.seed(0)
+    taskBuffer = FakeTaskBuffer(nSites)
+    timeStart = time.time()
+    siteMapper = SiteMapper.SiteMapper(taskBuffer)
+    timeInit = time.time() - timeStart
+    jobs = makeJobs(nJobs,nSites,nFiles,taskBuffer)
+    # linear and nested lookups
+    timeStart = time.time()
+    oldResults = runOld(siteMapper,jobs)
+    timeOld = time.time() - timeStart
+    # lookup tables
+    timeStart = time.time()
+    newResults = runNew(siteMapper,jobs)
+    timeNew = time.time() - timeStart
+    print "%s jobs with %s files across %s sites" % (nJobs,nFiles,nSites)
+    print "  SiteMapper init : %8.2f msec" % (timeInit*1000)
+    print "  old lookups     : %8.2f msec" % (timeOld*1000)
+    print "  lookup tables   : %8.2f msec same=%s" % (timeNew*1000,oldResults == newResults)
+    if timeNew > 0:
+        print "  speedup         : %8.1f" % (timeOld/timeNew)
+
+
+if __name__ == "__main__":
+    main()
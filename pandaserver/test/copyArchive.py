@@ -15,8 +15,9 @@ from dataservice.DDM import dashBorad
 from dataservice.DDM import rucioAPI
 from taskbuffer.OraDBProxy import DBProxy
 from taskbuffer.TaskBuffer import taskBuffer
+from taskbuffer.CacheManager import cacheManager
 from pandalogger.PandaLogger import PandaLogger
-from jobdispatcher.Watcher import Watcher
+from jobdispatcher.Watcher import Watcher,WatcherSweeper
 from brokerage.SiteMapper import SiteMapper
 from dataservice.Adder import Adder
 from dataservice.Finisher import Finisher
@@ -131,8 +132,23 @@ except:
     _logger.error("kill process : %s %s" % (type,value))
     
 
+# parameters for watcher sweep
+useWatcherSweeper = hasattr(panda_config,'useWatcherSweeper') and panda_config.useWatcherSweeper == True
+nSweepThreads = 4
+if hasattr(panda_config,'watcherSweepThreads'):
+    nSweepThreads = panda_config.watcherSweepThreads
+sweepChunkSize = 100
+if hasattr(panda_config,'watcherSweepChunkSize'):
+    sweepChunkSize = panda_config.watcherSweepChunkSize
+sweepMaxRate = 0
+if hasattr(panda_config,'watcherSweepMaxRate'):
+    sweepMaxRate = panda_config.watcherSweepMaxRate
+
 # instantiate TB
-taskBuffer.init(panda_config.dbhost,panda_config.dbpasswd,nDBConnection=1)
+if useWatcherSweeper:
+    taskBuffer.init(panda_config.dbhost,panda_config.dbpasswd,nDBConnection=max(1,nSweepThreads))
+else:
+    taskBuffer.init(panda_config.dbhost,panda_config.dbpasswd,nDBConnection=1)
 
 # instantiate sitemapper
 siteMapper = SiteMapper(taskBuffer)
@@ -364,6 +380,21 @@ except:
 _memoryCheck("watcher")
 
 _logger.debug("Watcher session")
+
+# run watchers for jobs
+def runWatchers(label,pandaIDs,sleepTime):
+    if useWatcherSweeper:
+        sweeper = WatcherSweeper(taskBuffer,sleepTime,sitemapper=siteMapper,nThreads=nSweepThreads,
+                                 chunkSize=sweepChunkSize,maxRate=sweepMaxRate)
+        sweeper.sweep(pandaIDs)
+        return
+    for id in pandaIDs:
+        _logger.debug("%s Watcher %s" % (label,id))
+        thr = Watcher(taskBuffer,id,single=True,sleepTime=sleepTime,sitemapper=siteMapper)
+        thr.start()
+        thr.join()
+        time.sleep(1)
+
 # check heartbeat for analysis jobs
 timeLimit = datetime.datetime.utcnow() - datetime.timedelta(hours=2)
 varMap = {}
@@ -381,12 +412,7 @@ if res == None:
     _logger.debug("# of Anal Watcher : %s" % res)
 else:
     _logger.debug("# of Anal Watcher : %s" % len(res))    
-    for (id,) in res:
-        _logger.debug("Anal Watcher %s" % id)    
-        thr = Watcher(taskBuffer,id,single=True,sleepTime=60,sitemapper=siteMapper)
-        thr.start()
-        thr.join()
-        time.sleep(1)
+    runWatchers("Anal",[id for (id,) in res],60)
 
 # check heartbeat for analysis jobs in transferring
 timeLimit = datetime.datetime.utcnow() - datetime.timedelta(hours=2)
@@ -402,12 +428,7 @@ if res == None:
     _logger.debug("# of Transferring Anal Watcher : %s" % res)
 else:
     _logger.debug("# of Transferring Anal Watcher : %s" % len(res))    
-    for (id,) in res:
-        _logger.debug("Trans Anal Watcher %s" % id)    
-        thr = Watcher(taskBuffer,id,single=True,sleepTime=60,sitemapper=siteMapper)
-        thr.start()
-        thr.join()
-        time.sleep(1)
+    runWatchers("Trans Anal",[id for (id,) in res],60)
 
 # check heartbeat for sent jobs
 timeLimit = datetime.datetime.utcnow() - datetime.timedelta(minutes=30)
@@ -420,12 +441,7 @@ if res == None:
     _logger.debug("# of Sent Watcher : %s" % res)
 else:
     _logger.debug("# of Sent Watcher : %s" % len(res))
-    for (id,) in res:
-        _logger.debug("Sent Watcher %s" % id)        
-        thr = Watcher(taskBuffer,id,single=True,sleepTime=30,sitemapper=siteMapper)
-        thr.start()
-        thr.join()
-        time.sleep(1)
+    runWatchers("Sent",[id for (id,) in res],30)
 
 # check heartbeat for 'holding' analysis/ddm jobs
 timeLimit = datetime.datetime.utcnow() - datetime.timedelta(hours=3)
@@ -450,15 +466,13 @@ if res == None:
     _logger.debug("# of Holding Anal/DDM Watcher : %s" % res)
 else:
     _logger.debug("# of Holding Anal/DDM Watcher : %s - XMLs : %s" % (len(res),len(xmlIDs)))
+    pandaIDs = []
     for (id,) in res:
-        _logger.debug("Holding Anal/DDM Watcher %s" % id)
         if int(id) in xmlIDs:
             _logger.debug("   found XML -> skip %s" % id)
             continue
-        thr = Watcher(taskBuffer,id,single=True,sleepTime=180,sitemapper=siteMapper)
-        thr.start()
-        thr.join()
-        time.sleep(1)
+        pandaIDs.append(id)
+    runWatchers("Holding Anal/DDM",pandaIDs,180)
 
 
 # check heartbeat for high prio production jobs
@@ -476,12 +490,7 @@ if res == None:
     _logger.debug("# of High prio Holding Watcher : %s" % res)
 else:
     _logger.debug("# of High prio Holding Watcher : %s" % len(res))    
-    for (id,) in res:
-        _logger.debug("High prio Holding Watcher %s" % id)
-        thr = Watcher(taskBuffer,id,single=True,sleepTime=60*timeOutVal,sitemapper=siteMapper)
-        thr.start()
-        thr.join()
-        time.sleep(1)
+    runWatchers("High prio Holding",[id for (id,) in res],60*timeOutVal)
 
 # check heartbeat for production jobs
 timeOutVal = 48
@@ -496,12 +505,7 @@ if res == None:
     _logger.debug("# of Holding Watcher : %s" % res)
 else:
     _logger.debug("# of Holding Watcher : %s" % len(res))    
-    for (id,) in res:
-        _logger.debug("Holding Watcher %s" % id)
-        thr = Watcher(taskBuffer,id,single=True,sleepTime=60*timeOutVal,sitemapper=siteMapper)
-        thr.start()
-        thr.join()
-        time.sleep(1)
+    runWatchers("Holding",[id for (id,) in res],60*timeOutVal)
 
 # check heartbeat for ddm jobs
 timeLimit = datetime.datetime.utcnow() - datetime.timedelta(hours=2)
@@ -518,12 +522,7 @@ if res == None:
     _logger.debug("# of DDM Watcher : %s" % res)
 else:
     _logger.debug("# of DDM Watcher : %s" % len(res))    
-    for (id,) in res:
-        _logger.debug("DDM Watcher %s" % id)
-        thr = Watcher(taskBuffer,id,single=True,sleepTime=120,sitemapper=siteMapper)
-        thr.start()
-        thr.join()
-        time.sleep(1)
+    runWatchers("DDM",[id for (id,) in res],120)
 
 # check heartbeat for production jobs
 timeOutVal = 2
@@ -540,12 +539,7 @@ if res == None:
     _logger.debug("# of General Watcher : %s" % res)
 else:
     _logger.debug("# of General Watcher : %s" % len(res))    
-    for (id,) in res:
-        _logger.debug("General Watcher %s" % id)
-        thr = Watcher(taskBuffer,id,single=True,sleepTime=60*timeOutVal,sitemapper=siteMapper)
-        thr.start()
-        thr.join()
-        time.sleep(1)
+    runWatchers("General",[id for (id,) in res],60*timeOutVal)
 
 _memoryCheck("reassign")
 
@@ -1093,11 +1087,7 @@ if len(jobs):
         _logger.debug('killJobs for Running (%s)' % jobs[iJob:iJob+nJob])
         Client.killJobs(jobs[iJob:iJob+nJob],2)
         # run watcher
-        for id in jobs[iJob:iJob+nJob]:
-            thr = Watcher(taskBuffer,id,single=True,sitemapper=siteMapper,sleepTime=60*24*21)
-            thr.start()
-            thr.join()
-            time.sleep(1)
+        runWatchers("Long running",jobs[iJob:iJob+nJob],60*24*21)
         iJob += nJob
         time.sleep(10)
 
@@ -1491,7 +1481,24 @@ _memoryCheck("delete XML")
 
 # delete old files in DA cache
 timeLimit = datetime.datetime.utcnow() - datetime.timedelta(days=7)
-files = os.listdir(panda_config.cache_dir)
+if cacheManager.isEnabled():
+    # LRU eviction against disk budget
+    try:
+        cacheManager.evict()
+        _logger.debug("cache stats %s" % str(cacheManager.getStats()))
+    except:
+        errType,errValue = sys.exc_info()[:2]
+        _logger.error("failed to evict cache files with %s %s" % (errType,errValue))
+    files = []
+else:
+    files = os.listdir(panda_config.cache_dir)
+    # sandbox store. links to the same content share mtime so that they expire together
+    sandboxDirs = ['%s/sandbox/data' % panda_config.cache_dir,
+                   '%s/sandbox/index' % panda_config.cache_dir]
+    for sandboxDir in sandboxDirs:
+        for tmpRoot,tmpDirs,tmpFiles in os.walk(sandboxDir):
+            for tmpFile in tmpFiles:
+                files.append(os.path.relpath(os.path.join(tmpRoot,tmpFile),panda_config.cache_dir))
 for file in files:
     # skip special test file
     if file == 'sources.72c48dc5-f055-43e5-a86e-4ae9f8ea3497.tar.gz':
@@ -1507,6 +1514,16 @@ for file in files:
             os.remove('%s/%s' % (panda_config.cache_dir,file))
     except:
         pass
+if not cacheManager.isEnabled():
+    # delete empty directories in sandbox store
+    for sandboxDir in sandboxDirs:
+        for tmpRoot,tmpDirs,tmpFiles in os.walk(sandboxDir,topdown=False):
+            if tmpRoot == sandboxDir:
+                continue
+            try:
+                os.rmdir(tmpRoot)
+            except:
+                pass
 
 
 _memoryCheck("delete core")
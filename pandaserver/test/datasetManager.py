@@ -25,6 +25,7 @@ from dataservice.Finisher import Finisher
 from dataservice.MailUtils import MailUtils
 from dataservice import DataServiceUtils
 from dataservice.Closer import Closer
+from dataservice.TaskExecutor import TaskExecutor
 from taskbuffer import ProcessGroups
 import brokerage.broker_util
 import brokerage.broker
@@ -139,7 +140,10 @@ except:
     
 
 # instantiate TB
-taskBuffer.init(panda_config.dbhost,panda_config.dbpasswd,nDBConnection=1)
+nDBConnection = 1
+if hasattr(panda_config,'datasetManagerDBConnections'):
+    nDBConnection = panda_config.datasetManagerDBConnections
+taskBuffer.init(panda_config.dbhost,panda_config.dbpasswd,nDBConnection=nDBConnection)
 
 # instantiate sitemapper
 siteMapper = SiteMapper(taskBuffer)
@@ -218,42 +222,26 @@ def setTobeDeletedToDis(subDsName):
         _logger.error("setTobeDeletedToDis : %s %s %s" % (subDsName,errType,errValue))
             
 
-# thread pool
-class ThreadPool:
-    def __init__(self):
-        self.lock = threading.Lock()
-        self.list = []
-
-    def add(self,obj):
-        self.lock.acquire()
-        self.list.append(obj)
-        self.lock.release()
-
-    def remove(self,obj):
-        self.lock.acquire()
-        self.list.remove(obj)
-        self.lock.release()
-
-    def join(self):
-        self.lock.acquire()
-        thrlist = tuple(self.list)
-        self.lock.release()
-        for thr in thrlist:
-            thr.join()
-
-
-# thread to close dataset
-class CloserThr (threading.Thread):
-    def __init__(self,lock,proxyLock,datasets,pool):
-        threading.Thread.__init__(self)
+# shared executor for sweeps. quotas limit the number of concurrent tasks per sweep
+nWorkers = 5
+if hasattr(panda_config,'datasetManagerWorkers'):
+    nWorkers = panda_config.datasetManagerWorkers
+executor = TaskExecutor(nWorkers)
+executor.addSweep('activator',quota=3,priority=10)
+executor.addSweep('finisher',quota=3,priority=20)
+executor.addSweep('close',quota=5,priority=30)
+executor.addSweep('freeze',quota=5,priority=40)
+executor.addSweep('disErase',quota=5,priority=50)
+executor.addSweep('t2clean',quota=5,priority=60)
+
+
+# task to close dataset
+class CloserThr:
+    def __init__(self,datasets):
         self.datasets   = datasets
-        self.lock       = lock
-        self.proxyLock  = proxyLock
-        self.pool       = pool
-        self.pool.add(self)
                                         
     def run(self):
-        self.lock.acquire()
+        closedVUIDs = []
         try:
             # loop over all datasets
             for vuid,name,modDate in self.datasets:
@@ -279,14 +267,7 @@ class CloserThr (threading.Thread):
                        out.find("DQDeletedDatasetException") == -1 and out.find("DQUnknownDatasetException") == -1:
                     _logger.error('{0} failed to close with {1}'.format(name,out))
                 else:
-                    self.proxyLock.acquire()
-                    varMap = {}
-                    varMap[':vuid'] = vuid
-                    varMap[':newstatus'] = 'completed'
-                    varMap[':oldstatus'] = 'tobeclosed'
-                    taskBuffer.querySQLS("UPDATE ATLAS_PANDA.Datasets SET status=:newstatus,modificationdate=CURRENT_DATE WHERE vuid=:vuid AND status=:oldstatus",
-                                     varMap)
-                    self.proxyLock.release()                    
+                    closedVUIDs.append(vuid)
                     # set tobedeleted to dis
                     setTobeDeletedToDis(name)
                     # skip if dataset is not real
@@ -311,22 +292,17 @@ class CloserThr (threading.Thread):
                             pass
         except:
             pass
-        self.pool.remove(self)
-        self.lock.release()
+        # update status
+        if closedVUIDs != []:
+            taskBuffer.updateDatasetStatusBulk(closedVUIDs,'completed','tobeclosed')
 
 # close datasets
 _logger.debug("==== close datasets ====")
 timeLimitU = datetime.datetime.utcnow() - datetime.timedelta(minutes=30)
 timeLimitL = datetime.datetime.utcnow() - datetime.timedelta(days=3)
-closeLock = threading.Semaphore(5)
-closeProxyLock = threading.Lock()
-closeThreadPool = ThreadPool()
 maxRows = 100000
 while True:
-    # lock
-    closeLock.acquire()
     # get datasets
-    closeProxyLock.acquire()
     varMap = {}
     varMap[':modificationdateU'] = timeLimitU
     varMap[':modificationdateL'] = timeLimitL    
@@ -341,68 +317,51 @@ while True:
     else:
         _logger.debug("# of datasets to be closed: %s" % len(res))
     if res==None or len(res)==0:
-        closeProxyLock.release()
-        closeLock.release()
         break
-    # release
-    closeProxyLock.release()
-    closeLock.release()
-    # run thread
+    # run tasks
     iRows = 0
     nRows = 500
     while iRows < len(res):    
-        closerThr = CloserThr(closeLock,closeProxyLock,res[iRows:iRows+nRows],closeThreadPool)
-        closerThr.start()
+        closerThr = CloserThr(res[iRows:iRows+nRows])
+        executor.submit('close',closerThr.run,nItems=len(res[iRows:iRows+nRows]))
         iRows += nRows
-    closeThreadPool.join()
+    executor.join('close')
     if len(res) < maxRows:
         break
 
 
-# thread to freeze dataset
-class Freezer (threading.Thread):
-    def __init__(self,lock,proxyLock,datasets,pool):
-        threading.Thread.__init__(self)
+# task to freeze dataset
+class Freezer:
+    def __init__(self,datasets):
         self.datasets   = datasets
-        self.lock       = lock
-        self.proxyLock  = proxyLock
-        self.pool       = pool
-        self.pool.add(self)
                                         
     def run(self):
-        self.lock.acquire()
+        frozenVUIDs = []
+        waitVUIDs = []
         try:
+            # get datasets which still have files to be processed
+            pendingSet = taskBuffer.getDatasetsWithPendingFiles([name for vuid,name,modDate in self.datasets])
             for vuid,name,modDate in self.datasets:
                 _logger.debug("start %s %s" % (modDate,name))
-                self.proxyLock.acquire()
-                retF,resF = taskBuffer.querySQLS("SELECT /*+ index(tab FILESTABLE4_DESTDBLOCK_IDX) */ lfn FROM ATLAS_PANDA.filesTable4 tab WHERE destinationDBlock=:destinationDBlock AND NOT status IN (:status1,:status2,:status3,:status4,:status5)",
-                                             {':destinationDBlock':name,':status1':'ready',':status2':'failed',
-                                              ':status3':'skipped',':status4':'merging',
-                                              ':status5':'finished'})
-                self.proxyLock.release()
-                if retF<0:
+                if pendingSet == None:
                     _logger.error("SQL error")
                 else:
                     # no files in filesTable
-                    if len(resF) == 0:
+                    if not name in pendingSet:
                         _logger.debug("freeze %s " % name)
                         dsExists = True
                         if name.startswith('pandaddm_') or name.startswith('user.') or name.startswith('group.') \
                                 or name.startswith('hc_test.') or name.startswith('panda.um.'):
                             dsExists = False
                         if name.startswith('panda.um.'):
-                            self.proxyLock.acquire()
                             retMer,resMer = taskBuffer.querySQLS("SELECT /*+ index(tab FILESTABLE4_DESTDBLOCK_IDX) */ PandaID FROM ATLAS_PANDA.filesTable4 tab WHERE destinationDBlock=:destinationDBlock AND status IN (:statusM,:statusF) ",
                                                                  {':destinationDBlock':name,
                                                                   ':statusM':'merging',
                                                                   ':statusF':'failed'})
-                            self.proxyLock.release()
                             if resMer != None and len(resMer)>0:
                                 mergeID = resMer[0][0]
                                 # get merging jobs
-                                self.proxyLock.acquire()
                                 mergingJobs = taskBuffer.peekJobs([mergeID],fromDefined=False,fromArchived=False,fromWaiting=False)
-                                self.proxyLock.release()    
                                 mergeJob = mergingJobs[0]
                                 if mergeJob != None:
                                     tmpDestDBlocks = []
@@ -413,11 +372,9 @@ class Freezer (threading.Thread):
                                                 tmpDestDBlocks.append(tmpFile.destinationDBlock)
                                     # run
                                     _logger.debug("start JEDI closer for %s " % name)
-                                    self.proxyLock.acquire()
                                     cThr = Closer(taskBuffer,tmpDestDBlocks,mergeJob)
                                     cThr.start()
                                     cThr.join()
-                                    self.proxyLock.release()
                                     _logger.debug("end JEDI closer for %s " % name)
                                     continue
                                 else:
@@ -442,13 +399,7 @@ class Freezer (threading.Thread):
                                out.find("DQDeletedDatasetException") == -1 and out.find("DQUnknownDatasetException") == -1:
                             _logger.error('{0} failed to freeze with {1}'.format(name,out))
                         else:
-                            self.proxyLock.acquire()
-                            varMap = {}
-                            varMap[':vuid'] = vuid
-                            varMap[':status'] = 'completed' 
-                            taskBuffer.querySQLS("UPDATE ATLAS_PANDA.Datasets SET status=:status,modificationdate=CURRENT_DATE WHERE vuid=:vuid",
-                                             varMap)
-                            self.proxyLock.release()                            
+                            frozenVUIDs.append(vuid)
                             if name.startswith('pandaddm_') or name.startswith('panda.um.') or not dsExists:
                                 continue
                             # set tobedeleted to dis
@@ -472,14 +423,15 @@ class Freezer (threading.Thread):
                                     pass
                     else:
                         _logger.debug("wait %s " % name)
-                        self.proxyLock.acquire()                        
-                        taskBuffer.querySQLS("UPDATE ATLAS_PANDA.Datasets SET modificationdate=CURRENT_DATE WHERE vuid=:vuid", {':vuid':vuid})
-                        self.proxyLock.release()                                                    
+                        waitVUIDs.append(vuid)
                 _logger.debug("end %s " % name)
         except:
             pass
-        self.pool.remove(self)
-        self.lock.release()
+        # update status
+        if frozenVUIDs != []:
+            taskBuffer.updateDatasetStatusBulk(frozenVUIDs,'completed')
+        if waitVUIDs != []:
+            taskBuffer.updateDatasetStatusBulk(waitVUIDs,None)
                             
 # freeze dataset
 _logger.debug("==== freeze datasets ====")
@@ -508,13 +460,8 @@ if resReset != None:
         _logger.debug("reset {0} to freeze".format(name))
         taskBuffer.querySQLS(sql,varMap)
 # loop for freezer
-freezeLock = threading.Semaphore(5)
-freezeProxyLock = threading.Lock()
-freezeThreadPool = ThreadPool()
 maxRows = 100000
 while True:
-    # lock
-    freezeLock.acquire()
     # get datasets
     sqlQuery = "type=:type AND status IN (:status1,:status2,:status3,:status4,:status5) " + \
                "AND (modificationdate BETWEEN :modificationdateL AND :modificationdateU) AND subType=:subType AND rownum <= %s" % maxRows
@@ -528,7 +475,6 @@ while True:
     varMap[':status4'] = 'locked'    
     varMap[':status5'] = 'doing'
     varMap[':subType'] = 'sub'
-    freezeProxyLock.acquire()
     proxyS = taskBuffer.proxyPool.getProxy()
     res = proxyS.getLockDatasets(sqlQuery,varMap,modTimeOffset='90/24/60')
     taskBuffer.proxyPool.putProxy(proxyS)
@@ -537,36 +483,26 @@ while True:
     else:
         _logger.debug("# of datasets to be frozen: %s" % len(res))
     if res==None or len(res)==0:
-        freezeProxyLock.release()
-        freezeLock.release()
         break
-    freezeProxyLock.release()            
-    # release
-    freezeLock.release()
     # run freezer
     iRows = 0
     nRows = 500
     while iRows < len(res):    
-        freezer = Freezer(freezeLock,freezeProxyLock,res[iRows:iRows+nRows],freezeThreadPool)
-        freezer.start()
+        freezer = Freezer(res[iRows:iRows+nRows])
+        executor.submit('freeze',freezer.run,nItems=len(res[iRows:iRows+nRows]))
         iRows += nRows
-    freezeThreadPool.join()
+    executor.join('freeze')
     if len(res) < maxRows:
         break
 
 
-# thread to delete dataset replica from T2
-class T2Cleaner (threading.Thread):
-    def __init__(self,lock,proxyLock,datasets,pool):
-        threading.Thread.__init__(self)
+# task to delete dataset replica from T2
+class T2Cleaner:
+    def __init__(self,datasets):
         self.datasets   = datasets
-        self.lock       = lock
-        self.proxyLock  = proxyLock
-        self.pool       = pool
-        self.pool.add(self)
                                         
     def run(self):
-        self.lock.acquire()
+        cleanedVUIDs = []
         try:
             for vuid,name,modDate in self.datasets:
                 _logger.debug("cleanT2 %s" % name)
@@ -590,11 +526,9 @@ class T2Cleaner (threading.Thread):
                             _logger.debug("wait %s due to active subscription" % name)
                             continue
                         # check cloud
-                        self.proxyLock.acquire()
                         proxyS = taskBuffer.proxyPool.getProxy()
                         destSE,destDBlockToken = proxyS.getDestSEwithDestDBlock(name)
                         taskBuffer.proxyPool.putProxy(proxyS)
-                        self.proxyLock.release()
                         cloudName = None
                         if siteMapper.checkSite(destSE):
                             cloudName = siteMapper.getSite(destSE).cloud
@@ -647,30 +581,20 @@ class T2Cleaner (threading.Thread):
                             else:
                                 _logger.debug('no delete for %s due to empty target in %s' % (name,listOut))
                     # update        
-                    self.proxyLock.acquire()
-                    varMap = {}
-                    varMap[':vuid'] = vuid
-                    varMap[':status'] = 'completed' 
-                    taskBuffer.querySQLS("UPDATE ATLAS_PANDA.Datasets SET status=:status,modificationdate=CURRENT_DATE WHERE vuid=:vuid",
-                                         varMap)
-                    self.proxyLock.release()                            
+                    cleanedVUIDs.append(vuid)
                 _logger.debug("end %s " % name)
         except:
             pass
-        self.pool.remove(self)
-        self.lock.release()
+        # update status
+        if cleanedVUIDs != []:
+            taskBuffer.updateDatasetStatusBulk(cleanedVUIDs,'completed')
                             
 # delete dataset replica from T2
 _logger.debug("==== delete datasets from T2 ====")
 timeLimitU = datetime.datetime.utcnow() - datetime.timedelta(minutes=30)
 timeLimitL = datetime.datetime.utcnow() - datetime.timedelta(days=3)
-t2cleanLock = threading.Semaphore(5)
-t2cleanProxyLock = threading.Lock()
-t2cleanThreadPool = ThreadPool()
 maxRows = 100000
 while True:
-    # lock
-    t2cleanLock.acquire()
     # get datasets
     varMap = {}
     varMap[':modificationdateU'] = timeLimitU
@@ -678,7 +602,6 @@ while True:
     varMap[':type']   = 'output'
     varMap[':status'] = 'cleanup'
     sqlQuery = "type=:type AND status=:status AND (modificationdate BETWEEN :modificationdateL AND :modificationdateU) AND rownum <= %s" % maxRows   
-    t2cleanProxyLock.acquire()
     proxyS = taskBuffer.proxyPool.getProxy()
     res = proxyS.getLockDatasets(sqlQuery,varMap,modTimeOffset='90/24/60')
     taskBuffer.proxyPool.putProxy(proxyS)
@@ -687,37 +610,31 @@ while True:
     else:
         _logger.debug("# of datasets to be deleted from T2: %s" % len(res))
     if res==None or len(res)==0:
-        t2cleanProxyLock.release()
-        t2cleanLock.release()
         break
-    t2cleanProxyLock.release()            
-    # release
-    t2cleanLock.release()
     # run t2cleanr
     iRows = 0
     nRows = 500
     while iRows < len(res):
-        t2cleanr = T2Cleaner(t2cleanLock,t2cleanProxyLock,res[iRows:iRows+nRows],t2cleanThreadPool)
-        t2cleanr.start()
+        t2cleanr = T2Cleaner(res[iRows:iRows+nRows])
+        executor.submit('t2clean',t2cleanr.run,nItems=len(res[iRows:iRows+nRows]))
         iRows += nRows
-    t2cleanThreadPool.join()
+    executor.join('t2clean')
     if len(res) < maxRows:
         break
 
 
 # delete dis datasets
-class EraserThr (threading.Thread):
-    def __init__(self,lock,proxyLock,datasets,pool,operationType):
-        threading.Thread.__init__(self)
+class EraserThr:
+    def __init__(self,datasets,operationType):
         self.datasets   = datasets
-        self.lock       = lock
-        self.proxyLock  = proxyLock
-        self.pool       = pool
-        self.pool.add(self)
         self.operationType = operationType
                                         
     def run(self):
-        self.lock.acquire()
+        if self.operationType == 'deleting':
+            endStatus = 'deleted'
+        else:
+            endStatus = 'shortened'
+        doneVUIDs = []
         try:
             # loop over all datasets
             for vuid,name,modDate in self.datasets:
@@ -763,29 +680,19 @@ class EraserThr (threading.Thread):
                             continue
                 _logger.debug('OK with %s' % name)
                 # update
-                self.proxyLock.acquire()
-                varMap = {}
-                varMap[':vuid'] = vuid
-                varMap[':status'] = endStatus
-                taskBuffer.querySQLS("UPDATE ATLAS_PANDA.Datasets SET status=:status,modificationdate=CURRENT_DATE WHERE vuid=:vuid",
-                                     varMap)
-                self.proxyLock.release()
+                doneVUIDs.append(vuid)
         except:
             pass
-        self.pool.remove(self)
-        self.lock.release()
+        # update status
+        if doneVUIDs != []:
+            taskBuffer.updateDatasetStatusBulk(doneVUIDs,endStatus)
 
 # delete dis datasets
 _logger.debug("==== delete dis datasets ====")
 timeLimitU = datetime.datetime.utcnow() - datetime.timedelta(minutes=30)
 timeLimitL = datetime.datetime.utcnow() - datetime.timedelta(days=3)
-disEraseLock = threading.Semaphore(5)
-disEraseProxyLock = threading.Lock()
-disEraseThreadPool = ThreadPool()
 maxRows = 100000
 for targetStatus in ['deleting','shortening']:
-    # lock
-    disEraseLock.acquire()
     # get datasets
     varMap = {}
     varMap[':modificationdateU'] = timeLimitU
@@ -793,7 +700,6 @@ for targetStatus in ['deleting','shortening']:
     varMap[':type']   = 'dispatch'
     varMap[':status'] = targetStatus
     sqlQuery = "type=:type AND status=:status AND (modificationdate BETWEEN :modificationdateL AND :modificationdateU) AND rownum <= %s" % maxRows     
-    disEraseProxyLock.acquire()
     proxyS = taskBuffer.proxyPool.getProxy()
     res = proxyS.getLockDatasets(sqlQuery,varMap,modTimeOffset='90/24/60')
     taskBuffer.proxyPool.putProxy(proxyS)
@@ -802,44 +708,30 @@ for targetStatus in ['deleting','shortening']:
     else:
         _logger.debug("# of dis datasets for %s: %s" % (targetStatus,len(res)))
     if res==None or len(res)==0:
-        disEraseProxyLock.release()
-        disEraseLock.release()
         break
-    disEraseProxyLock.release()            
-    # release
-    disEraseLock.release()
     # run disEraser
     iRows = 0
     nRows = 500
     while iRows < len(res):        
-        disEraser = EraserThr(disEraseLock,disEraseProxyLock,res[iRows:iRows+nRows],
-                              disEraseThreadPool,targetStatus)
-        disEraser.start()
+        disEraser = EraserThr(res[iRows:iRows+nRows],targetStatus)
+        executor.submit('disErase',disEraser.run,nItems=len(res[iRows:iRows+nRows]))
         iRows += nRows
-    disEraseThreadPool.join()
+    executor.join('disErase')
 
 
 _memoryCheck("finisher")
 
-# finisher thread
-class FinisherThr (threading.Thread):
-    def __init__(self,lock,proxyLock,ids,pool,timeNow):
-        threading.Thread.__init__(self)
+# finisher task
+class FinisherThr:
+    def __init__(self,ids,timeNow):
         self.ids        = ids
-        self.lock       = lock
-        self.proxyLock  = proxyLock
-        self.pool       = pool
         self.timeNow    = timeNow
-        self.pool.add(self)
                                         
     def run(self):
-        self.lock.acquire()
         try:
             # get jobs from DB
             ids = self.ids
-            self.proxyLock.acquire()
             jobs = taskBuffer.peekJobs(ids,fromDefined=False,fromArchived=False,fromWaiting=False)
-            self.proxyLock.release()
             upJobs = []
             finJobs = []
             for job in jobs:
@@ -958,29 +850,21 @@ class FinisherThr (threading.Thread):
                 upJobs.append(job)
             # update
             _logger.debug("updating ...")
-            self.proxyLock.acquire()
             taskBuffer.updateJobs(upJobs,False)
-            self.proxyLock.release()
             # run Finisher
             for job in finJobs:
                 fThr = Finisher(taskBuffer,None,job)
                 fThr.start()
                 fThr.join()
             _logger.debug("done")
-            time.sleep(1)
         except:
             errtype,errvalue = sys.exc_info()[:2]
             errStr  = "FinisherThr failed with %s %s" % (errtype,errvalue)
             errStr += traceback.format_exc()
             _logger.error(errStr)
-        self.pool.remove(self)
-        self.lock.release()
 
 # finish transferring jobs
 _logger.debug("==== finish transferring jobs ====")
-finisherLock = threading.Semaphore(3)
-finisherProxyLock = threading.Lock()
-finisherThreadPool = ThreadPool()
 for loopIdx in ['low','high']:
     timeNow = datetime.datetime.utcnow()
     if loopIdx == 'high':
@@ -989,43 +873,30 @@ for loopIdx in ['low','high']:
         highPrioFlag = False
     # get jobs
     for ii in range(1000):
-        # lock
-        finisherLock.acquire()
-        finisherProxyLock.acquire()
         ret,res = taskBuffer.lockJobsForFinisher(timeNow,200,highPrioFlag)
-        finisherProxyLock.release()
-        finisherLock.release()
         if res == None:
             _logger.debug("# of jobs to be finished for %s : %s" % (loopIdx,res))
         else:
             _logger.debug("# of jobs to be finished for %s : %s" % (loopIdx,len(res)))
         if res == None or len(res) == 0:
             break
-        # run thread
-        finThr = FinisherThr(finisherLock,finisherProxyLock,res,finisherThreadPool,timeNow)
-        finThr.start()
+        # run task. blocks while the quota is used up
+        finThr = FinisherThr(res,timeNow)
+        executor.submit('finisher',finThr.run,nItems=len(res))
     # wait
-    finisherThreadPool.join()
+    executor.join('finisher')
 
 
-# activator thread
-class ActivatorThr (threading.Thread):
-    def __init__(self,lock,proxyLock,ids,pool):
-        threading.Thread.__init__(self)
+# activator task
+class ActivatorThr:
+    def __init__(self,ids):
         self.ids        = ids
-        self.lock       = lock
-        self.proxyLock  = proxyLock
-        self.pool       = pool
-        self.pool.add(self)
                                         
     def run(self):
-        self.lock.acquire()
         try:
             # get jobs from DB
             ids = self.ids
-            self.proxyLock.acquire()
             jobs = taskBuffer.peekJobs(ids,fromActive=False,fromArchived=False,fromWaiting=False)
-            self.proxyLock.release()
             actJobs = []
             for tmpJob in jobs:
                 if tmpJob == None or tmpJob.jobStatus == 'unknown':
@@ -1070,47 +941,38 @@ class ActivatorThr (threading.Thread):
                     actJobs.append(tmpJob)
             # update
             _logger.debug("activating ...")
-            self.proxyLock.acquire()
             taskBuffer.activateJobs(actJobs)
-            self.proxyLock.release()
             _logger.debug("done")
-            time.sleep(1)
         except:
             errtype,errvalue = sys.exc_info()[:2]
             _logger.error("ActivatorThr failed with %s %s" % (errtype,errvalue))
-        self.pool.remove(self)
-        self.lock.release()
 
 
 _memoryCheck("activator")
 
 # activate assigned jobs
 _logger.debug("==== activate assigned jobs ====")
-activatorLock = threading.Semaphore(3)
-activatorProxyLock = threading.Lock()
-activatorThreadPool = ThreadPool()
 timeLimit = datetime.datetime.utcnow() - datetime.timedelta(hours=1)
 # get jobs
 for ii in range(1000):
-    # lock
-    activatorLock.acquire()
-    activatorProxyLock.acquire()
     ret,res = taskBuffer.lockJobsForActivator(timeLimit,100,800)
-    activatorProxyLock.release()
-    activatorLock.release()
     if res == None:
         _logger.debug("# of jobs to be activated for %s " % res)
     else:
         _logger.debug("# of jobs to be activated for %s " % len(res))
     if res == None or len(res) == 0:
         break
-    # run thread
-    actThr = ActivatorThr(activatorLock,activatorProxyLock,res,activatorThreadPool)
-    actThr.start()
+    # run task. blocks while the quota is used up
+    actThr = ActivatorThr(res)
+    executor.submit('activator',actThr.run,nItems=len(res))
 # wait
-activatorThreadPool.join()
+executor.join('activator')
 
 
 _memoryCheck("end")
 
+# stop executor
+executor.shutdown()
+executor.dumpMetrics(_logger)
+
 _logger.debug("===================== end =====================")
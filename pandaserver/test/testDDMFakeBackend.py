@@ -0,0 +1,79 @@
+"""
+check DQ2 and rucio APIs in DDM against the fake backend
+
+usage: python testDDMFakeBackend.py
+
+"""
+
+import sys
+
+from config import panda_config
+panda_config.ddmBackend = 'fake'
+
+from dataservice.DDM import ddm
+from dataservice.DDM import rucioAPI
+from dataservice.DDMFakeBackend import fakeStore
+from dataservice.DDMFakeBackend import FakeRucioClient
+
+nFailed = 0
+
+
+# check a condition
+def check(label,isOK,value=None):
+    global nFailed
+    if isOK:
+        print "OK     %s" % label
+    else:
+        nFailed += 1
+        print "FAILED %s : %s" % (label,value)
+
+
+fakeStore.reset()
+
+# DQ2 to rucio
+lfns   = ['user.x.ds1._000001.pool.root','user.x.ds1._000002.pool.root']
+guids  = ['6f0c2d3e-0000-0000-0000-000000000001','6f0c2d3e-0000-0000-0000-000000000002']
+sizes  = [100,200]
+chksums = ['ad:00000001','md5:0123456789abcdef0123456789abcdef']
+status,out = ddm.DQ2.main('registerNewDataset','user.x:user.x.ds1',lfns,guids,sizes,chksums)
+check('DQ2 registerNewDataset',status == 0,out)
+fileMap,tmpDummy = rucioAPI.listFilesInDataset('user.x:user.x.ds1')
+check('rucio listFilesInDataset returns all files',len(fileMap) == 2,fileMap)
+tmpAttrs = fileMap.get(lfns[0],{})
+check('rucio checksum is not doubly prefixed',tmpAttrs.get('chksum') == 'ad:00000001',tmpAttrs)
+check('scope from scope:name',tmpAttrs.get('scope') == 'user.x',tmpAttrs)
+check('GUID is formatted',tmpAttrs.get('guid') == guids[0],tmpAttrs)
+tmpFiles = dict([(tmpFile['name'],tmpFile) for tmpFile in FakeRucioClient().list_files('user.x','user.x.ds1')])
+check('md5 without prefix',tmpFiles[lfns[1]]['md5'] == chksums[1][4:] and tmpFiles[lfns[1]]['adler32'] == None,
+      tmpFiles[lfns[1]])
+
+# scope derived from the dataset name
+status,out = ddm.DQ2.main('registerNewDataset','group.phys.ds2',['f1'],[None],[1],['ad:00000002'])
+check('DQ2 registerNewDataset without scope',status == 0,out)
+fileMap,tmpDummy = rucioAPI.listFilesInDataset('group.phys.ds2')
+check('scope of group dataset',fileMap.get('f1',{}).get('scope') == 'group.phys',fileMap)
+status,out = ddm.DQ2.main('registerNewDataset','mc16_13TeV.123456.evgen',['f2'],[None],[1],['ad:00000003'])
+fileMap,tmpDummy = rucioAPI.listFilesInDataset('mc16_13TeV.123456.evgen')
+check('scope of official dataset',fileMap.get('f2',{}).get('scope') == 'mc16_13TeV',fileMap)
+
+# rucio to DQ2
+rucioAPI.registerDatasetWithOldFiles('user.y:user.y.ds3',['user.y:f3'],['6f0c2d3e-0000-0000-0000-000000000003'],
+                                     [300],['ad:0000000a'])
+status,out = ddm.DQ2.main('listFilesInDataset','user.y:user.y.ds3')
+check('DQ2 listFilesInDataset',status == 0 and "'ad:0000000a'" in out and "'user.y'" in out,out)
+
+# replicas
+rucioAPI.registerDatasetLocation('user.y:user.y.ds3',['SITE_DATADISK'])
+status,out = rucioAPI.listDatasetReplicas('user.y:user.y.ds3')
+check('rucio location is visible as replica',status == 0 and out.has_key('SITE_DATADISK'),out)
+status,out = ddm.DQ2.main('registerDatasetLocation','user.x:user.x.ds1','OTHER_DATADISK')
+check('DQ2 registerDatasetLocation',status == 0,out)
+status,out = rucioAPI.listDatasetReplicas('user.x:user.x.ds1')
+check('DQ2 location is visible as replica',status == 0 and out.has_key('OTHER_DATADISK'),out)
+
+print
+print "calls : %s" % str(fakeStore.calls)
+if nFailed != 0:
+    print "%s checks failed" % nFailed
+    sys.exit(1)
+print "all checks passed"
@@ -0,0 +1,335 @@
+"""
+check that SiteScorer.filterSites gives the same results as the per-site loop in broker.schedule
+
+usage: python testSiteScorer.py [nTrials]
+
+"""
+
+import re
+import sys
+import types
+import random
+
+from taskbuffer.SiteSpec import SiteSpec
+from brokerage import SiteScorer
+
+releaseNames = ['17.0.1','19.2.3','20.1.0']
+cacheNames = ['AtlasProduction/17.0.1.1','AtlasDerivation/20.1.0.2']
+resultKeys = ['rel','pilot','disk','status','weight','memory','share','transferring','cpucore','reliability',
+              'maxtime','scratch']
+
+
+# site mapper with random sites
+class FakeSiteMapper:
+
+    # constructor
+    def __init__(self,nSites):
+        self.siteSpecList = {}
+        for idx in range(nSites):
+            siteSpec = self.makeSiteSpec(idx)
+            self.siteSpecList[siteSpec.sitename] = siteSpec
+
+    # make site
+    def makeSiteSpec(self,idx):
+        siteSpec = SiteSpec()
+        if idx == 0:
+            siteSpec.sitename = 'CERN-RELEASE'
+        else:
+            siteSpec.sitename = random.choice(['SITE_%04d','ANALY_%04d','SITE_%04d_test']) % idx
+        siteSpec.status = random.choice(['online','online','offline','brokeroff','test'])
+        siteSpec.accesscontrol = random.choice([None,'grouplist'])
+        siteSpec.coreCount = random.choice([0,1,8])
+        siteSpec.memory = random.choice([0,0,2000,4000,'bad'])
+        siteSpec.minmemory = random.choice([0,0,1000,3000])
+        siteSpec.maxtime = random.choice([0,0,3600,86400,'bad'])
+        siteSpec.mintime = random.choice([0,0,600,7200])
+        siteSpec.maxwdir = random.choice([0,0,5000,20000])
+        siteSpec.reliabilityLevel = random.choice([None,1,3,5])
+        siteSpec.cloud = random.choice(['US','DE','ND'])
+        siteSpec.allowdirectaccess = random.choice([True,False])
+        siteSpec.releases = random.choice([[],['ANY'],['True'],['False']]+
+                                          [random.sample(releaseNames,random.randint(1,3)) for i in range(3)])
+        siteSpec.validatedreleases = random.choice([[],['True']]+
+                                                   [random.sample(releaseNames,random.randint(1,3)) for i in range(3)])
+        return siteSpec
+
+    # check site
+    def checkSite(self,site):
+        return self.siteSpecList.has_key(site)
+
+    # get site
+    def getSite(self,site):
+        return self.siteSpecList[site]
+
+
+# release check in broker
+def _checkRelease(jobRels,siteRels):
+    if "True" in siteRels:
+        return True
+    if "False" in siteRels:
+        return False
+    for tmpRel in jobRels.split('\n'):
+        relVer = re.sub('^Atlas-','',tmpRel)
+        if not relVer in siteRels:
+            return False
+    return True
+
+
+# filters in broker.schedule before SiteScorer. return candidates,resultsForAnal,messages,loggerMessages,
+# foundRelease and pilots
+def oldFilterSites(siteMapper,scanSiteList,forAnalysis,computingSite,prevProType,prevSourceLabel,prevCoreCount,
+                   prevMemory,prevMaxCpuCount,prevDiskCount,siteReliability,prevRelease,prevCmtConfig,prevHomePkg,
+                   prevManualPreset,prevDirectAcc,useCacheVersion,siteListWithCache,trustIS,nWNmap):
+    candidates = []
+    resultsForAnal = dict([(tmpKey,[]) for tmpKey in resultKeys])
+    messages = {}
+    loggerMessages = []
+    foundRelease = False
+    pilots = {}
+    for site in scanSiteList:
+        if site == 'NULL':
+            continue
+        if (prevManualPreset == False) and (site.endswith('test') or site.endswith('Test') or site.startswith('Test')):
+            continue
+        if (not forAnalysis) and site.startswith('ANALY'):
+            continue
+        if siteMapper.checkSite(site):
+            tmpSiteSpec = siteMapper.getSite(site)
+        else:
+            messages[site] = " skip: %s doesn't exist in DB" % site
+            continue
+        if tmpSiteSpec.status in ['offline','brokeroff'] and computingSite in ['NULL',None,'']:
+            if forAnalysis and tmpSiteSpec.status == 'brokeroff' and tmpSiteSpec.accesscontrol == 'grouplist':
+                pass
+            elif forAnalysis and  prevProType in ['hammercloud','gangarobot','gangarobot-squid']:
+                pass
+            else:
+                messages[site] = ' skip: status %s' % tmpSiteSpec.status
+                resultsForAnal['status'].append(site)
+                continue
+        if tmpSiteSpec.status == 'test' and (not prevProType in ['prod_test','hammercloud','gangarobot','gangarobot-squid']) \
+               and not prevSourceLabel in ['test','prod_test']:
+            messages[site] = ' skip: status %s for %s' % (tmpSiteSpec.status,prevProType)
+            resultsForAnal['status'].append(site)
+            continue
+        if tmpSiteSpec.coreCount > 1:
+            if not prevCoreCount in [None,'NULL'] and prevCoreCount > 1:
+                pass
+            else:
+                messages[site] = '  skip: MP site (%s core) for job.coreCount=%s' % (tmpSiteSpec.coreCount,
+                                                                                    prevCoreCount)
+                resultsForAnal['cpucore'].append(site)
+                continue
+        else:
+            if not prevCoreCount in [None,'NULL'] and prevCoreCount > 1:
+                messages[site] = '  skip: single core site (%s core) for job.coreCount=%s' % (tmpSiteSpec.coreCount,
+                                                                                             prevCoreCount)
+                resultsForAnal['cpucore'].append(site)
+                continue
+        if tmpSiteSpec.memory != 0 and not prevMemory in [None,0,'NULL']:
+            try:
+                if int(tmpSiteSpec.memory) < int(prevMemory):
+                    messages[site] = '  skip: site memory shortage %s<%s' % (tmpSiteSpec.memory,prevMemory)
+                    resultsForAnal['memory'].append(site)
+                    continue
+            except:
+                pass
+        if tmpSiteSpec.minmemory != 0 and not prevMemory in [None,0,'NULL']:
+            try:
+                if int(tmpSiteSpec.minmemory) > int(prevMemory):
+                    messages[site] = '  skip: job memory shortage %s>%s' % (tmpSiteSpec.memory,prevMemory)
+                    resultsForAnal['memory'].append(site)
+                    continue
+            except:
+                pass
+        if tmpSiteSpec.maxtime != 0 and not prevMaxCpuCount in [None,0,'NULL']:
+            try:
+                if int(tmpSiteSpec.maxtime) < int(prevMaxCpuCount):
+                    messages[site] = '  skip: insufficient maxtime %s<%s' % (tmpSiteSpec.maxtime,prevMaxCpuCount)
+                    resultsForAnal['maxtime'].append(site)
+                    continue
+            except:
+                pass
+        if tmpSiteSpec.mintime != 0 and not prevMaxCpuCount in [None,0,'NULL']:
+            try:
+                if int(tmpSiteSpec.mintime) > int(prevMaxCpuCount):
+                    messages[site] = '  skip: insufficient job maxtime %s<%s' % (prevMaxCpuCount,tmpSiteSpec.mintime)
+                    resultsForAnal['maxtime'].append(site)
+                    continue
+            except:
+                pass
+        if tmpSiteSpec.maxwdir != 0 and (not prevDiskCount in [None,0,'NULL']):
+            try:
+                if int(tmpSiteSpec.maxwdir) < int(prevDiskCount):
+                    messages[site] = '  skip: not enough disk %s<%s' % (tmpSiteSpec.maxwdir,prevDiskCount)
+                    resultsForAnal['scratch'].append(site)
+                    continue
+            except:
+                pass
+        if forAnalysis and isinstance(siteReliability,types.IntType):
+            if tmpSiteSpec.reliabilityLevel != None and tmpSiteSpec.reliabilityLevel > siteReliability:
+                messages[site] = ' skip: insufficient reliability %s > %s' % (tmpSiteSpec.reliabilityLevel,
+                                                                              siteReliability)
+                resultsForAnal['reliability'].append(site)
+                continue
+        releases = tmpSiteSpec.releases
+        origReleases = releases
+        if prevProType in ['reprocessing']:
+            releases = tmpSiteSpec.validatedreleases
+        if origReleases == ['ANY']:
+            foundRelease = True
+        elif forAnalysis and (tmpSiteSpec.cloud in ['ND'] or prevRelease==''):
+            pass
+        elif forAnalysis and useCacheVersion:
+            if not site in siteListWithCache:
+                messages[site] = ' skip: cache %s/%s not found' % (prevRelease.replace('\n',' '),prevCmtConfig)
+                if trustIS:
+                    resultsForAnal['rel'].append(site)
+                continue
+        elif prevRelease != None and \
+                 (useCacheVersion and not tmpSiteSpec.cloud in ['ND'] and not site in ['CERN-RELEASE']) and \
+                 (not prevProType in ['reprocessing']) and \
+                 (not site in siteListWithCache):
+                messages[site] = ' skip: cache %s/%s not found' % (prevHomePkg.replace('\n',' '),prevCmtConfig)
+                if prevSourceLabel in ['managed','test']:
+                    resultsForAnal['rel'].append(site)
+                    message = '%s - cache %s/%s not found' % (site,prevHomePkg.replace('\n',' '),prevCmtConfig)
+                    if not message in loggerMessages:
+                        loggerMessages.append(message)
+                continue
+        elif prevRelease != None and \
+             ((not useCacheVersion and releases != [] and not tmpSiteSpec.cloud in ['ND'] and not site in ['CERN-RELEASE']) or prevProType in ['reprocessing']) and \
+             (((not _checkRelease(prevRelease,releases) and prevManualPreset == False) or not site in siteListWithCache) and not tmpSiteSpec.cloud in ['ND'] and not site in ['CERN-RELEASE']):
+            if not useCacheVersion:
+                messages[site] = ' skip: release %s/%s not found' % (prevRelease.replace('\n',' '),prevCmtConfig)
+            else:
+                messages[site] = ' skip: repro cache %s/%s not found' % (prevHomePkg.replace('\n',' '),prevCmtConfig)
+            resultsForAnal['rel'].append(site)
+            continue
+        elif not foundRelease:
+            foundRelease = True
+        if prevDirectAcc == 'direct' and not tmpSiteSpec.allowdirectaccess:
+            messages[site] = ' skip: no direct access support'
+            continue
+        nPilotsGet = 0
+        nPilotsUpdate = 0
+        if nWNmap.has_key(site):
+            nPilots = nWNmap[site]['getJob'] + nWNmap[site]['updateJob']
+            nPilotsGet = nWNmap[site]['getJob']
+            nPilotsUpdate = nWNmap[site]['updateJob']
+        else:
+            nPilots = 0
+        limitOnGUmax = 1.1
+        limitOnGUmin = 0.9
+        guRatio = float(1+nPilotsGet)/float(1+nPilotsUpdate)
+        if guRatio > limitOnGUmax:
+            nPilotsGet = limitOnGUmax * float(1+nPilotsUpdate) - 1.0
+        elif guRatio < limitOnGUmin:
+            nPilotsGet = limitOnGUmin * float(1+nPilotsUpdate) - 1.0
+        if nPilots == 0 and nWNmap != {}:
+            messages[site] = " skip: %s no pilot" % site
+            resultsForAnal['pilot'].append(site)
+            continue
+        pilots[site] = (nPilots,nPilotsGet,nPilotsUpdate)
+        candidates.append(site)
+    return candidates,resultsForAnal,messages,loggerMessages,foundRelease,pilots
+
+
+# convert the result of SiteScorer to the same format as the old loop
+def convertResult(scanSiteList,scoreResult):
+    resultsForAnal = dict([(tmpKey,[]) for tmpKey in resultKeys])
+    messages = {}
+    for site in scanSiteList:
+        if scoreResult.rejections.has_key(site):
+            resultKey,message = scoreResult.rejections[site]
+            if message != None:
+                messages[site] = message
+            if resultKey != None:
+                resultsForAnal[resultKey].append(site)
+    return scoreResult.candidates,resultsForAnal,messages,scoreResult.loggerMessages,scoreResult.foundRelease,\
+        scoreResult.pilots
+
+
+# make random job parameters
+def makeJobParams(siteNames):
+    params = {}
+    params['forAnalysis'] = random.choice([True,False])
+    params['computingSite'] = random.choice(['NULL',None,'','SITE_0001'])
+    params['prevProType'] = random.choice(['managed','reprocessing','hammercloud','prod_test','simul'])
+    params['prevSourceLabel'] = random.choice(['managed','test','user','prod_test'])
+    params['prevCoreCount'] = random.choice([None,'NULL',1,8])
+    params['prevMemory'] = random.choice([None,0,'NULL',1500,3000,5000])
+    params['prevMaxCpuCount'] = random.choice([None,0,'NULL',1800,5000,100000])
+    params['prevDiskCount'] = random.choice([None,0,'NULL',1000,10000,30000])
+    params['siteReliability'] = random.choice([None,2,4])
+    params['useCacheVersion'] = random.choice([True,False])
+    if params['useCacheVersion']:
+        params['prevRelease'] = random.choice(['','Atlas-17.0.1','Atlas-17.0.1\nAtlas-19.2.3'])
+        params['prevHomePkg'] = random.choice(cacheNames)
+    else:
+        params['prevRelease'] = random.choice([None,'','Atlas-17.0.1','Atlas-17.0.1\nAtlas-19.2.3','Atlas-20.1.0'])
+        params['prevHomePkg'] = random.choice([None,cacheNames[0]])
+    params['prevCmtConfig'] = random.choice([None,'x86_64-slc6-gcc49-opt'])
+    params['prevManualPreset'] = random.choice([True,False])
+    params['prevDirectAcc'] = random.choice(['direct',None])
+    params['siteListWithCache'] = random.sample(siteNames,len(siteNames)/2)
+    params['trustIS'] = random.choice([True,False])
+    return params
+
+
+def main():
+    nTrials = 1000
+    if len(sys.argv) > 1:
+        nTrials = int(sys.argv[1])
+    random.seed(0)
+    nFailed = 0
+    for iTrial in range(nTrials):
+        siteMapper = FakeSiteMapper(200)
+        siteNames = siteMapper.siteSpecList.keys()
+        nWNmap = {}
+        if iTrial % 10 != 0:
+            for site in siteNames:
+                if random.random() < 0.8:
+                    nWNmap[site] = {'getJob':random.randint(0,20),'updateJob':random.randint(0,20)}
+        table = SiteScorer.SiteTable(siteMapper)
+        # bunches of jobs in a brokerage pass share the table
+        for iBunch in range(3):
+            scanSiteList = random.sample(siteNames,random.randint(1,50)) + ['NULL','NO_SUCH_SITE']
+            random.shuffle(scanSiteList)
+            params = makeJobParams(siteNames)
+            oldResult = oldFilterSites(siteMapper,scanSiteList,params['forAnalysis'],params['computingSite'],
+                                       params['prevProType'],params['prevSourceLabel'],params['prevCoreCount'],
+                                       params['prevMemory'],params['prevMaxCpuCount'],params['prevDiskCount'],
+                                       params['siteReliability'],params['prevRelease'],params['prevCmtConfig'],
+                                       params['prevHomePkg'],params['prevManualPreset'],params['prevDirectAcc'],
+                                       params['useCacheVersion'],params['siteListWithCache'],params['trustIS'],
+                                       nWNmap)
+            scoreResult = SiteScorer.filterSites(table,scanSiteList,params['forAnalysis'],params['computingSite'],
+                                                 params['prevProType'],params['prevSourceLabel'],
+                                                 params['prevCoreCount'],params['prevMemory'],
+                                                 params['prevMaxCpuCount'],params['prevDiskCount'],
+                                                 params['siteReliability'],
+                                                 isinstance(params['siteReliability'],types.IntType),
+                                                 params['prevRelease'],params['prevCmtConfig'],
+                                                 params['prevHomePkg'],params['prevManualPreset'],
+                                                 params['prevDirectAcc'],params['useCacheVersion'],
+                                                 params['siteListWithCache'],params['trustIS'],nWNmap)
+            newResult = convertResult(scanSiteList,scoreResult)
+            if oldResult != newResult:
+                nFailed += 1
+                print "trial=%s bunch=%s differs for %s" % (iTrial,iBunch,str(params))
+                for label,oldValue,newValue in zip(['candidates','resultsForAnal','messages','loggerMessages',
+                                                    'foundRelease','pilots'],oldResult,newResult):
+                    if oldValue != newValue:
+                        print "  %s old=%s new=%s" % (label,oldValue,newValue)
+        # rows are made only for scanned sites
+        if len(table.siteSpecs) > len(siteNames):
+            nFailed += 1
+            print "trial=%s too many rows %s" % (iTrial,len(table.siteSpecs))
+    print "%s trials, %s differences" % (nTrials,nFailed)
+    if nFailed != 0:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -5,11 +5,21 @@ client methods
 
 import os
 import re
+import ssl
 import sys
 import gzip
+import types
+import uuid
+import base64
+import socket
+import select
 import urllib
+import httplib
+import urlparse
 import commands
 import tempfile
+import threading
+import cStringIO
 import cPickle as pickle
 
 try:
@@ -96,7 +106,7 @@ def _x509():
 
 
 # curl class
-class _Curl:
+class _CurlCommand:
     # constructor
     def __init__(self):
         # path to curl
@@ -238,6 +248,312 @@ class _Curl:
         if self.verbose:
             print ret
         return ret
+
+
+
+# idle persistent connections : (scheme,host,port,cert,key,verify,proxy) -> [connection,...]
+_idleConnections = {}
+_idleConnectionsLock = threading.Lock()
+
+# max number of idle connections kept per server
+_maxIdleConnections = 4
+
+# size of chunks to send files
+_chunkSize = 1024*1024
+
+# transport : native or curl
+try:
+    _httpTransport = os.environ['PANDA_HTTP_TRANSPORT']
+except:
+    _httpTransport = 'native'
+
+
+# exception raised before the request is sent, i.e. safe to retry with curl
+class _NotSentError(Exception):
+    pass
+
+
+# native HTTP(S) transport with persistent connections
+class _NativeHTTP:
+    # constructor
+    def __init__(self,curl):
+        self.curl = curl
+
+
+    # get key and parameters to connect
+    def _getServer(self,url):
+        scheme,netloc,path,query,fragment = urlparse.urlsplit(url)
+        host = netloc
+        port = None
+        if ':' in netloc:
+            host,port = netloc.split(':')
+            port = int(port)
+        elif scheme == 'https':
+            port = 443
+        else:
+            port = 80
+        selector = path
+        if query:
+            selector += '?' + query
+        # proxy
+        proxy = None
+        proxies = urllib.getproxies()
+        if proxies.has_key(scheme) and not urllib.proxy_bypass(host):
+            proxy = proxies[scheme]
+        key = (scheme,host,port,self.curl.sslCert,self.curl.sslKey,self.curl.verifyHost,proxy)
+        return key,selector
+
+
+    # make a new connection
+    def _connect(self,key):
+        scheme,host,port,sslCert,sslKey,verifyHost,proxy = key
+        connHost,connPort = host,port
+        proxyHeaders = {}
+        if proxy != None:
+            proxyScheme,proxyNetloc = urlparse.urlsplit(proxy)[:2]
+            if '@' in proxyNetloc:
+                proxyAuth,proxyNetloc = proxyNetloc.rsplit('@',1)
+                proxyHeaders['Proxy-Authorization'] = 'Basic ' + base64.b64encode(urllib.unquote(proxyAuth))
+            connHost = proxyNetloc
+            connPort = None
+            if ':' in proxyNetloc:
+                connHost,connPort = proxyNetloc.split(':')
+                connPort = int(connPort)
+        if scheme == 'https':
+            if not verifyHost:
+                context = ssl._create_unverified_context()
+            elif os.environ.has_key('X509_CERT_DIR'):
+                context = ssl.create_default_context(capath=os.environ['X509_CERT_DIR'])
+            elif os.path.exists('/etc/grid-security/certificates'):
+                context = ssl.create_default_context(capath='/etc/grid-security/certificates')
+            else:
+                context = ssl.create_default_context()
+            if sslCert != '':
+                # the proxy certificate is also used as CA like curl --cacert
+                context.load_verify_locations(cafile=sslCert)
+                if sslKey != '':
+                    context.load_cert_chain(sslCert,sslKey)
+                else:
+                    context.load_cert_chain(sslCert)
+            conn = httplib.HTTPSConnection(connHost,connPort,timeout=600,context=context)
+            if proxy != None:
+                conn.set_tunnel(host,port,proxyHeaders)
+        else:
+            conn = httplib.HTTPConnection(connHost,connPort,timeout=600)
+        try:
+            conn.connect()
+        except:
+            errtype,errvalue = sys.exc_info()[:2]
+            raise _NotSentError('failed to connect to %s:%s with %s %s' % (host,port,errtype.__name__,errvalue))
+        # small requests are not delayed by Nagle
+        conn.sock.setsockopt(socket.IPPROTO_TCP,socket.TCP_NODELAY,1)
+        conn.proxyHeaders = proxyHeaders
+        return conn
+
+
+    # get connection from the pool
+    def _getConnection(self,key):
+        _idleConnectionsLock.acquire()
+        try:
+            while _idleConnections.has_key(key) and _idleConnections[key] != []:
+                conn = _idleConnections[key].pop()
+                # idle connection is readable only when the server closed it
+                try:
+                    if select.select([conn.sock],[],[],0)[0] == []:
+                        return conn,True
+                except (select.error,socket.error):
+                    pass
+                conn.close()
+        finally:
+            _idleConnectionsLock.release()
+        return self._connect(key),False
+
+
+    # return connection to the pool
+    def _putConnection(self,key,conn):
+        _idleConnectionsLock.acquire()
+        try:
+            _idleConnections.setdefault(key,[])
+            if len(_idleConnections[key]) < _maxIdleConnections:
+                _idleConnections[key].append(conn)
+                return
+        finally:
+            _idleConnectionsLock.release()
+        conn.close()
+
+
+    # get length of body
+    def _getBodyLength(self,body):
+        # list of ('data',string) or ('file',path) for multipart
+        if isinstance(body,types.ListType):
+            bodyLength = 0
+            for partType,partValue in body:
+                if partType == 'file':
+                    bodyLength += os.path.getsize(partValue)
+                else:
+                    bodyLength += len(partValue)
+            return bodyLength
+        return len(body)
+
+
+    # send body. files are sent in chunks not to load them into memory
+    def _sendBody(self,conn,body):
+        if not isinstance(body,types.ListType):
+            conn.send(body)
+            return
+        for partType,partValue in body:
+            if partType != 'file':
+                conn.send(partValue)
+                continue
+            tmpFile = open(partValue,'rb')
+            try:
+                while True:
+                    tmpChunk = tmpFile.read(_chunkSize)
+                    if tmpChunk == '':
+                        break
+                    conn.send(tmpChunk)
+            finally:
+                tmpFile.close()
+
+
+    # check if the request can be sent again. only when nothing was sent or the server closed
+    # the idle connection without reading the request
+    def _isRetriable(self,sent,errvalue):
+        if not sent:
+            return True
+        return isinstance(errvalue,httplib.BadStatusLine) and errvalue.line in ['',"''"]
+
+
+    # send request and return (status,output) in the same format as curl
+    def request(self,method,url,body=None,headers={}):
+        key,selector = self._getServer(url)
+        # absolute URL for plain HTTP through proxy
+        if key[0] == 'http' and key[-1] != None:
+            selector = url
+        if self.curl.verbose:
+            print method,url
+        if body != None:
+            bodyLength = self._getBodyLength(body)
+        for iTry in range(2):
+            conn,reused = self._getConnection(key)
+            sent = False
+            try:
+                tmpHeaders = {'Connection':'keep-alive'}
+                tmpHeaders.update(headers)
+                if key[0] == 'http':
+                    tmpHeaders.update(conn.proxyHeaders)
+                if body != None:
+                    tmpHeaders['Content-Length'] = str(bodyLength)
+                conn.putrequest(method,selector,skip_accept_encoding=True)
+                conn.putheader('Accept-Encoding','gzip')
+                for tmpKey,tmpVal in tmpHeaders.iteritems():
+                    conn.putheader(tmpKey,tmpVal)
+                # headers are buffered until here
+                sent = True
+                conn.endheaders()
+                if body != None:
+                    self._sendBody(conn,body)
+                res = conn.getresponse()
+                output = res.read()
+            except (httplib.HTTPException,socket.error):
+                conn.close()
+                errtype,errvalue = sys.exc_info()[:2]
+                # the server closed the idle connection
+                if reused and iTry == 0 and self._isRetriable(sent,errvalue):
+                    continue
+                if not sent:
+                    raise _NotSentError('%s %s' % (errtype.__name__,errvalue))
+                # the request may have been processed
+                return EC_Failed,'%s %s' % (errtype.__name__,errvalue)
+            except:
+                conn.close()
+                raise
+            break
+        if res.getheader('content-encoding','') == 'gzip':
+            try:
+                output = gzip.GzipFile(fileobj=cStringIO.StringIO(output)).read()
+            except:
+                errtype,errvalue = sys.exc_info()[:2]
+                conn.close()
+                return EC_Failed,'failed to decompress response with %s %s' % (errtype.__name__,errvalue)
+        if res.will_close:
+            conn.close()
+        else:
+            self._putConnection(key,conn)
+        # commands.getstatusoutput strips the last newline
+        if output[-1:] == '\n':
+            output = output[:-1]
+        if self.curl.verbose:
+            print res.status,output
+        return 0,output
+
+
+    # encode multipart form data for PUT emulation. return a list of ('data',string) or ('file',path)
+    # so that files are read when they are sent
+    def encodeMultipart(self,data):
+        boundary = uuid.uuid4().hex
+        body = []
+        for key,val in data.iteritems():
+            # the value is path[;filename=name] like curl -F
+            items = val.split(';filename=')
+            path = items[0]
+            if len(items) > 1:
+                fileName = items[1]
+            else:
+                fileName = os.path.basename(path)
+            if not os.access(path,os.R_OK):
+                raise IOError('cannot read %s' % path)
+            tmpHead  = '--%s\r\n' % boundary
+            tmpHead += 'Content-Disposition: form-data; name="%s"; filename="%s"\r\n' % (key,fileName)
+            tmpHead += 'Content-Type: application/octet-stream\r\n\r\n'
+            body.append(('data',tmpHead))
+            body.append(('file',path))
+            body.append(('data','\r\n'))
+        body.append(('data','--%s--\r\n' % boundary))
+        return body,'multipart/form-data; boundary=%s' % boundary
+
+
+
+# curl class using the native transport and falling back to the curl command
+class _Curl(_CurlCommand):
+
+    # send request with the native transport if possible
+    def _native(self,method,url,body,headers,fallback):
+        if _httpTransport != 'native':
+            return fallback()
+        try:
+            return _NativeHTTP(self).request(method,url,body,headers)
+        except (_NotSentError,AttributeError,ssl.SSLError,IOError):
+            # AttributeError for old python without SSL context
+            errtype,errvalue = sys.exc_info()[:2]
+            if self.verbose:
+                print 'native transport failed with %s %s. use curl' % (errtype.__name__,errvalue)
+            return fallback()
+
+
+    # GET method
+    def get(self,url,data):
+        tmpURL = url
+        if data != {}:
+            tmpURL += '?' + urllib.urlencode(data)
+        return self._native('GET',tmpURL,None,{},lambda: _CurlCommand.get(self,url,data))
+
+
+    # POST method
+    def post(self,url,data):
+        headers = {'Content-Type':'application/x-www-form-urlencoded'}
+        return self._native('POST',url,urllib.urlencode(data),headers,
+                            lambda: _CurlCommand.post(self,url,data))
+
+
+    # PUT method
+    def put(self,url,data):
+        try:
+            body,contentType = _NativeHTTP(self).encodeMultipart(data)
+        except IOError:
+            return _CurlCommand.put(self,url,data)
+        return self._native('POST',url,body,{'Content-Type':contentType},
+                            lambda: _CurlCommand.put(self,url,data))
             
 
 '''
@@ -21,6 +21,7 @@ from pandalogger.PandaLogger import PandaLogger
 from RbLauncher import RbLauncher
 from ReBroker import ReBroker
 from taskbuffer import PrioUtil
+from taskbuffer import Utils
 from dataservice.DDM import dq2Info
 
 # logger
@@ -241,6 +242,11 @@ class UserIF:
     # check duplicated sandbox file
     def checkSandboxFile(self,userName,fileSize,checkSum):
         ret = self.taskBuffer.checkSandboxFile(userName,fileSize,checkSum)
+        # reuse the same content uploaded by the user to this server
+        if ret == 'NOTFOUND' and Utils.useSandboxStore():
+            fileName = Utils.getSandboxFromStore(userName,fileSize,checkSum)
+            if fileName != None:
+                ret = "FOUND:%s:%s" % (panda_config.pserverhost,fileName)
         # return
         return ret
 